@@ -0,0 +1,176 @@
+# api/admission.py
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from core.metrics import ADMISSION_QUEUE, ADMISSION_REJECTED
+
+T = TypeVar("T")
+
+_REJECT_FULL = ADMISSION_REJECTED.labels("queue_full")
+_REJECT_TIMEOUT = ADMISSION_REJECTED.labels("timeout")
+_DISCONNECTED = ADMISSION_REJECTED.labels("disconnected")
+
+
+class Overloaded(Exception):
+    """Сервис перегружен: очередь полна или не дождались слота; retry_after — в секундах."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(f"overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    """Клиент ушёл, не дождавшись ответа; работа отменена."""
+
+
+class AdmissionController:
+    """
+    Допуск запросов чата: не больше max_inflight одновременно, ещё max_queue ждут слота
+    по очереди (FIFO), но не дольше queue_timeout. Сверх этого — сразу Overloaded (429),
+    а не бесконечная очередь за тредпулом и лимитером, которую клиент всё равно не дождётся.
+    Освободившийся слот передаётся первому ожидающему напрямую — без гонки с новичками.
+    max_inflight <= 0 — без ограничений. Работает в одном event loop (FastAPI).
+    """
+
+    def __init__(self, max_inflight: int = 64, max_queue: int = 256, queue_timeout: float = 10.0) -> None:
+        self.max_inflight = int(max_inflight)
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self.inflight = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+        self._service_s: Optional[float] = None  # EWMA времени обработки — для Retry-After
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.disconnects = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inflight > 0
+
+    def retry_after(self) -> float:
+        # столько примерно займёт разгрести очередь перед нами, но не меньше секунды
+        per_request = self._service_s if self._service_s is not None else 1.0
+        return max(1.0, per_request * (len(self._waiters) + 1) / max(1, self.max_inflight))
+
+    def check(self) -> None:
+        """Быстрая проверка без захвата: встать в очередь уже некуда."""
+        if self.enabled and self.inflight >= self.max_inflight and len(self._waiters) >= self.max_queue:
+            self.rejected_full += 1
+            _REJECT_FULL.inc()
+            raise Overloaded("queue_full", self.retry_after())
+
+    async def acquire(self) -> None:
+        if not self.enabled:
+            self.admitted += 1
+            return
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return
+        self.check()
+        fut: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self.queued_total += 1
+        ADMISSION_QUEUE.inc()
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._leave(fut)
+            self.rejected_timeout += 1
+            _REJECT_TIMEOUT.inc()
+            raise Overloaded("timeout", self.retry_after()) from None
+        except asyncio.CancelledError:
+            self._leave(fut)
+            raise
+        finally:
+            ADMISSION_QUEUE.dec()
+        self.admitted += 1
+
+    def _leave(self, fut: "asyncio.Future[None]") -> None:
+        try:
+            self._waiters.remove(fut)
+        except ValueError:
+            pass
+        if fut.done() and not fut.cancelled():
+            # слот успели передать в момент отмены — отдаём следующему
+            self.release()
+
+    def release(self, service_s: Optional[float] = None) -> None:
+        if service_s is not None:
+            self._service_s = service_s if self._service_s is None else 0.8 * self._service_s + 0.2 * service_s
+        if not self.enabled:
+            return
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)  # слот переходит ожидающему, inflight не меняется
+                return
+        self.inflight -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - t0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "inflight": self.inflight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "client_disconnects": self.disconnects,
+            "service_ms_ewma": round(self._service_s * 1000.0, 1) if self._service_s is not None else None,
+        }
+
+
+async def _wait_disconnect(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    # Тело запроса уже прочитано — следующий receive() вернётся только с http.disconnect
+    while True:
+        message = await receive()
+        if message.get("type") == "http.disconnect":
+            return
+
+
+async def run_until_disconnect(
+    receive: Callable[[], Awaitable[Dict[str, Any]]],
+    work: Awaitable[T],
+    admission: Optional[AdmissionController] = None,
+) -> T:
+    """
+    Выполняет work (вместе с ожиданием в очереди допуска), пока клиент на связи.
+    Разрыв соединения отменяет работу: ни слот, ни квоту провайдера ответ без адресата не тратит.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not task.done():
+            task.cancel()
+        watcher.cancel()
+    if not task.done() or task.cancelled():
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        if admission is not None:
+            admission.disconnects += 1
+        _DISCONNECTED.inc()
+        raise ClientDisconnected()
+    return task.result()
@@ -1,24 +1,42 @@
 # api/app.py
 from __future__ import annotations
 
+import json
+import math
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List
+from typing import AsyncIterator, List
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
+from api.admission import AdmissionController, ClientDisconnected, Overloaded, run_until_disconnect
 from core.config import settings
-from core.history import HistoryRepository
+from core.history import make_history
 from core.logging import setup_logging, get_logger
+from core import tracing
+from core.singleflight import singleflight_stats
+from core.metrics import CHAT_LATENCY, CONTENT_TYPE, HISTORY_SIZE, INFLIGHT, render as render_metrics
+from llm.factory import aclose_pools, failover_stats, limiter_stats, pool_stats
+from llm.ratelimit import RateLimitExceeded
 from services.orchestrator import ChatOrchestrator
 
-setup_logging(settings.LOG_LEVEL)
+setup_logging(settings.LOG_LEVEL, settings.LOG_FORMAT)
 log = get_logger("api")
 
+_INFLIGHT_CHAT = INFLIGHT.labels("chat")
+_INFLIGHT_STREAM = INFLIGHT.labels("stream")
+
+
+def _retry_after(seconds: float) -> dict:
+    # Retry-After — целые секунды, не меньше одной
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
 
 class ChatRequest(BaseModel):
     channel: str = Field(..., examples=["web", "telegram"])
@@ -33,17 +51,32 @@ class ChatResponse(BaseModel):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.hist = HistoryRepository()
+    tracing.configure(export_path=settings.TRACE_EXPORT_PATH or None, log_spans=settings.TRACE_LOG_SPANS)
+    app.state.hist = make_history()
     app.state.orch = ChatOrchestrator(
         history=app.state.hist,
         rag_enabled=settings.RAG_ENABLED,
     )
-    log.info("HistoryRepository и ChatOrchestrator инициализированы")
+    log.info("HistoryRepository (%s) и ChatOrchestrator инициализированы", settings.HISTORY_BACKEND)
+    # Размер истории считается при выгрузке /metrics, а не на каждой записи
+    HISTORY_SIZE.labels("keys").set_function(lambda: len(app.state.hist) if app.state.hist is not None else 0)
+    HISTORY_SIZE.labels("bytes").set_function(
+        lambda: app.state.hist.stats()["bytes"] if app.state.hist is not None else 0
+    )
     try:
         yield
     finally:
+        orch = getattr(app.state, "orch", None)
+        if orch is not None and hasattr(orch, "aclose"):
+            await orch.aclose()
         app.state.orch = None
+        hist = getattr(app.state, "hist", None)
+        if hist is not None and hasattr(hist, "close"):
+            # дописываем очередь фонового писателя истории
+            await run_in_threadpool(hist.close)
         app.state.hist = None
+        await aclose_pools()
+        tracing.shutdown()
         log.info("Сервисы OrionAgent остановлены")
 
 
@@ -54,6 +87,10 @@ def create_app() -> FastAPI:
         lifespan=lifespan,
     )
 
+    if settings.TRACING_ENABLED:
+        # trace id на запрос, Server-Timing и X-Trace-Id в ответе
+        app.add_middleware(tracing.ServerTimingMiddleware)
+
     allow_origins = settings.CORS_ORIGINS or []
     app.add_middleware(
         CORSMiddleware,
@@ -63,25 +100,129 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    admission = AdmissionController(
+        max_inflight=settings.ADMISSION_MAX_INFLIGHT,
+        max_queue=settings.ADMISSION_MAX_QUEUE,
+        queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    )
+    app.state.admission = admission
+
     @app.post("/v1/chat", response_model=ChatResponse)
-    def chat(req: ChatRequest):
-        if not getattr(app.state, "orch", None):
+    async def chat(req: ChatRequest, request: Request):
+        orch = getattr(app.state, "orch", None)
+        if not orch:
             raise HTTPException(status_code=503, detail="Orchestrator not initialized")
+        t0 = time.perf_counter()
+        status = "500"
+        _INFLIGHT_CHAT.inc()
+
+        async def work() -> List[str]:
+            async with admission.slot():
+                areply = getattr(orch, "areply", None)
+                if areply is not None:
+                    return await areply(req.channel, req.user_id, req.text)
+                # Оркестратор без async-пути — не блокируем event loop
+                return await run_in_threadpool(orch.reply, req.channel, req.user_id, req.text)
+
         try:
-            parts = app.state.orch.reply(req.channel, req.user_id, req.text)
+            parts = await run_until_disconnect(request.receive, work(), admission)
+            status = "200"
             return ChatResponse(parts=parts)
-        except HTTPException:
+        except HTTPException as e:
+            status = str(e.status_code)
             raise
+        except ClientDisconnected:
+            # отвечать некому; 499 — как у nginx, только для метрик и логов
+            status = "499"
+            return Response(status_code=499)
+        except Overloaded as e:
+            status = "429"
+            raise HTTPException(
+                status_code=429, detail=f"Server is busy ({e.reason}), retry later", headers=_retry_after(e.retry_after)
+            ) from e
+        except RateLimitExceeded as e:
+            status = "429"
+            raise HTTPException(
+                status_code=429, detail="LLM rate limit, retry later", headers=_retry_after(e.retry_after)
+            ) from e
         except Exception as e:
             log.exception("Ошибка в /v1/chat")
             raise HTTPException(status_code=500, detail="Internal error") from e
+        finally:
+            _INFLIGHT_CHAT.dec()
+            CHAT_LATENCY.labels("chat", status).observe(time.perf_counter() - t0)
+
+    @app.post("/v1/chat/stream")
+    async def chat_stream(req: ChatRequest):
+        orch = getattr(app.state, "orch", None)
+        if not orch:
+            raise HTTPException(status_code=503, detail="Orchestrator not initialized")
+        try:
+            # очередь полна — отказываем статусом, пока заголовки ещё не ушли
+            admission.check()
+        except Overloaded as e:
+            raise HTTPException(
+                status_code=429, detail=f"Server is busy ({e.reason}), retry later", headers=_retry_after(e.retry_after)
+            ) from e
+        if hasattr(orch, "areply_stream"):
+            pieces = orch.areply_stream(req.channel, req.user_id, req.text)
+        elif hasattr(orch, "reply_stream"):
+            pieces = iterate_in_threadpool(orch.reply_stream(req.channel, req.user_id, req.text))
+        else:
+            raise HTTPException(status_code=501, detail="streaming is not supported")
+
+        async def events() -> AsyncIterator[str]:
+            # Server-Sent Events: по событию на кусок ответа, в конце — [DONE] как у OpenAI.
+            # Слот занимаем внутри генератора: при разрыве Starlette отменяет его, и слот освобождается
+            t0 = time.perf_counter()
+            status = "200"
+            _INFLIGHT_STREAM.inc()
+            try:
+                async with admission.slot():
+                    async for piece in pieces:
+                        yield f"data: {json.dumps({'delta': piece}, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+            except (Overloaded, RateLimitExceeded) as e:
+                # заголовки уже ушли — о перегрузке сообщаем событием, как об ошибке
+                status = "429"
+                payload = {"detail": "Server is busy, retry later", "retry_after": math.ceil(e.retry_after)}
+                yield f"event: error\ndata: {json.dumps(payload)}\n\n"
+            except Exception:
+                status = "500"
+                log.exception("Ошибка в /v1/chat/stream")
+                yield f"event: error\ndata: {json.dumps({'detail': 'Internal error'})}\n\n"
+            finally:
+                _INFLIGHT_STREAM.dec()
+                CHAT_LATENCY.labels("stream", status).observe(time.perf_counter() - t0)
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(content=render_metrics(), media_type=CONTENT_TYPE)
 
     @app.get("/healthz", response_model=dict)
     def healthz():
+        semantic = getattr(getattr(app.state, "orch", None), "semantic", None)
+        compactor = getattr(getattr(app.state, "orch", None), "compactor", None)
+        hist = getattr(app.state, "hist", None)
         return {
             "status": "ok",
             "orch_initialized": bool(getattr(app.state, "orch", None)),
-            "hist_initialized": bool(getattr(app.state, "hist", None)),
+            # пустая история ложна по __len__ — сравниваем с None
+            "hist_initialized": hist is not None,
+            "history": hist.stats() if hasattr(hist, "stats") else None,
+            "llm_pools": pool_stats(),
+            "llm_limiter": limiter_stats(),
+            "llm_failover": failover_stats(),
+            "singleflight": singleflight_stats(),
+            "admission": admission.stats(),
+            "semantic_cache": semantic.stats() if semantic is not None else None,
+            "compaction": compactor.stats() if compactor is not None else None,
         }
 
     @app.post("/v1/toggle_rag", response_model=dict)
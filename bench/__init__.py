@@ -0,0 +1 @@
+"""Нагрузочные тесты: заглушка OpenAI-совместимого API (fake_llm), генератор нагрузки (loadgen), полный прогон (run)."""
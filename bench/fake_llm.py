@@ -0,0 +1,150 @@
+"""
+Локальная заглушка OpenAI-совместимого /chat/completions для нагрузочных тестов.
+
+    python -m bench.fake_llm --port 9100 --latency lognormal:400:0.6 --error-rate 0.02
+
+Задержка задаётся распределением, ошибки — долей ответов и набором кодов (429 — с Retry-After).
+Поток (stream=true) отдаёт SSE: первый кусок через latency, дальше по token_interval_ms.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class LatencyModel:
+    """
+    Распределение задержки в миллисекундах:
+    const:200 | uniform:100:500 | exp:300 (среднее) | lognormal:300:0.5 (медиана, σ)
+    """
+
+    def __init__(self, spec: str = "const:0", rng: Optional[random.Random] = None) -> None:
+        self.spec = spec
+        kind, *args = spec.split(":")
+        self.kind = kind.strip().lower()
+        self.args = [float(a) for a in args]
+        self.rng = rng or random.Random()
+        expected = {"const": 1, "uniform": 2, "exp": 1, "lognormal": 2}
+        if self.kind not in expected or len(self.args) != expected[self.kind]:
+            raise ValueError(f"bad latency spec {spec!r}: const:MS | uniform:A:B | exp:MEAN | lognormal:MEDIAN:SIGMA")
+
+    def sample_ms(self) -> float:
+        a = self.args
+        if self.kind == "const":
+            return a[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(a[0], a[1])
+        if self.kind == "exp":
+            return self.rng.expovariate(1.0 / a[0]) if a[0] > 0 else 0.0
+        return a[0] * math.exp(self.rng.gauss(0.0, a[1]))
+
+
+@dataclass
+class FakeConfig:
+    latency: str = "const:50"
+    token_interval_ms: float = 5.0
+    tokens: int = 20
+    error_rate: float = 0.0
+    error_statuses: Sequence[int] = (429, 500, 503)
+    retry_after: float = 1.0
+    seed: Optional[int] = None
+    counters: Dict[str, int] = field(default_factory=lambda: {"requests": 0, "streams": 0, "errors": 0})
+
+
+def _completion(model: str, text: str) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-fake-{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+    }
+
+
+def create_fake_app(config: Optional[FakeConfig] = None) -> FastAPI:
+    cfg = config or FakeConfig()
+    rng = random.Random(cfg.seed)
+    latency = LatencyModel(cfg.latency, rng)
+    app = FastAPI(title="fake-openai")
+    app.state.config = cfg
+
+    async def completions(request: Request):
+        body = await request.json()
+        cfg.counters["requests"] += 1
+        await asyncio.sleep(latency.sample_ms() / 1000.0)
+
+        if cfg.error_rate > 0 and rng.random() < cfg.error_rate:
+            cfg.counters["errors"] += 1
+            status = rng.choice(list(cfg.error_statuses))
+            headers = {"Retry-After": f"{cfg.retry_after:g}"} if status == 429 else {}
+            return JSONResponse({"error": {"message": "fake upstream error", "code": status}}, status, headers=headers)
+
+        model = body.get("model") or "fake-model"
+        messages: List[dict] = body.get("messages") or []
+        last = (messages[-1].get("content") if messages else "") or ""
+        words = [f"w{i}" for i in range(cfg.tokens)]
+        if not body.get("stream"):
+            return JSONResponse(_completion(model, f"echo({len(last)}): " + " ".join(words)))
+
+        cfg.counters["streams"] += 1
+
+        async def events() -> AsyncIterator[str]:
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(cfg.token_interval_ms / 1000.0)
+                chunk = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    # и base_url=http://host:port/v1 (как у OpenAI/Ollama), и без префикса
+    app.add_api_route("/v1/chat/completions", completions, methods=["POST"])
+    app.add_api_route("/chat/completions", completions, methods=["POST"])
+
+    @app.get("/stats")
+    def stats():
+        return dict(cfg.counters)
+
+    return app
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого API для бенчмарков")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--latency", default="lognormal:300:0.5", help="const:MS | uniform:A:B | exp:MEAN | lognormal:MEDIAN:SIGMA")
+    ap.add_argument("--token-interval-ms", type=float, default=5.0)
+    ap.add_argument("--tokens", type=int, default=20)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-statuses", default="429,500,503")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    import uvicorn
+
+    cfg = FakeConfig(
+        latency=args.latency,
+        token_interval_ms=args.token_interval_ms,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        error_statuses=tuple(int(s) for s in args.error_statuses.split(",") if s.strip()),
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    uvicorn.run(create_fake_app(cfg), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
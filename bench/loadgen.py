@@ -0,0 +1,293 @@
+"""
+Генератор нагрузки на /v1/chat с открытой моделью: запросы уходят по расписанию
+(фиксированная или пуассоновская частота), не дожидаясь ответов предыдущих, — так видно
+реальную очередь, а не «замедлившегося клиента» (coordinated omission).
+
+    python -m bench.loadgen --url http://127.0.0.1:8000 --rate 20 --duration 30 --users 500 --out bench/results/run.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+
+@dataclass
+class Sample:
+    scheduled: float  # когда запрос должен был уйти (по расписанию)
+    sent: float
+    done: float
+    status: int  # 0 — сетевая ошибка/таймаут/сброшен
+    error: Optional[str] = None
+
+    @property
+    def latency_ms(self) -> float:
+        # от момента по расписанию: задержка клиента тоже видна пользователю
+        return (self.done - self.scheduled) * 1000.0
+
+    @property
+    def service_ms(self) -> float:
+        return (self.done - self.sent) * 1000.0
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Перцентиль с линейной интерполяцией; q в [0, 100]."""
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    pos = (len(xs) - 1) * q / 100.0
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return xs[lo] + (xs[hi] - xs[lo]) * (pos - lo)
+
+
+def _arrivals(rate: float, duration: float, arrival: str, rng: random.Random) -> List[float]:
+    out, t = [], 0.0
+    if arrival == "poisson":
+        while True:
+            t += rng.expovariate(rate)
+            if t >= duration:
+                return out
+            out.append(t)
+    n = int(rate * duration)
+    return [i / rate for i in range(n)]
+
+
+async def run_load(
+    base_url: str,
+    rate: float,
+    duration: float,
+    users: int = 1000,
+    channel: str = "bench",
+    endpoint: str = "/v1/chat",
+    arrival: str = "uniform",
+    timeout: float = 60.0,
+    max_inflight: int = 10_000,
+    seed: Optional[int] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> List[Sample]:
+    if rate <= 0 or duration <= 0:
+        raise ValueError("rate and duration must be > 0")
+    rng = random.Random(seed)
+    schedule = _arrivals(rate, duration, arrival, rng)
+    own = client is None
+    client = client or httpx.AsyncClient(
+        base_url=base_url, timeout=timeout, trust_env=False,
+        limits=httpx.Limits(max_connections=max_inflight, max_keepalive_connections=256),
+    )
+    samples: List[Sample] = []
+    inflight = 0
+
+    async def one(i: int, scheduled: float) -> None:
+        nonlocal inflight
+        body = {"channel": channel, "user_id": f"bench-{rng.randrange(users)}", "text": f"вопрос {i}: сколько будет {i} + {i}?"}
+        sent = time.perf_counter()
+        try:
+            r = await client.post(endpoint, json=body)
+            samples.append(Sample(scheduled, sent, time.perf_counter(), r.status_code, None if r.status_code < 400 else r.text[:200]))
+        except Exception as e:
+            samples.append(Sample(scheduled, sent, time.perf_counter(), 0, type(e).__name__))
+        finally:
+            inflight -= 1
+
+    tasks = []
+    t0 = time.perf_counter()
+    try:
+        for i, offset in enumerate(schedule):
+            delay = t0 + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            at = t0 + offset
+            if inflight >= max_inflight:
+                samples.append(Sample(at, at, at, 0, "dropped"))
+                continue
+            inflight += 1
+            tasks.append(asyncio.create_task(one(i, at)))
+        await asyncio.gather(*tasks)
+    finally:
+        if own:
+            await client.aclose()
+    return samples
+
+
+def summarize(samples: Sequence[Sample], wall_s: float) -> Dict[str, Any]:
+    ok = [s for s in samples if 200 <= s.status < 300]
+    by_status: Dict[str, int] = {}
+    for s in samples:
+        if not 200 <= s.status < 300:
+            key = str(s.status) if s.status else (s.error or "error")
+            by_status[key] = by_status.get(key, 0) + 1
+    lat = [s.latency_ms for s in ok]
+    svc = [s.service_ms for s in ok]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": by_status,
+        "error_rate": (1.0 - len(ok) / len(samples)) if samples else 0.0,
+        "throughput_rps": len(ok) / wall_s if wall_s > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile(lat, 50), "p95": percentile(lat, 95), "p99": percentile(lat, 99),
+            "max": max(lat, default=0.0), "mean": (sum(lat) / len(lat)) if lat else 0.0,
+        },
+        "service_ms": {"p50": percentile(svc, 50), "p95": percentile(svc, 95), "p99": percentile(svc, 99)},
+    }
+
+
+# --- /metrics сервиса ---
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_prometheus(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    out: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        m = _SAMPLE.match(line.strip())
+        if not m:
+            continue
+        labels = tuple(sorted(_LABEL.findall(m.group(2) or "")))
+        try:
+            out[(m.group(1), labels)] = float(m.group(3))
+        except ValueError:
+            continue
+    return out
+
+
+def histogram_delta(before: Dict, after: Dict, name: str) -> Dict[str, Any]:
+    """Разница гистограммы между двумя снимками, сложенная по всем меткам, кроме le."""
+    buckets: Dict[float, float] = {}
+    total = count = 0.0
+    for (metric, labels), value in after.items():
+        prev = before.get((metric, labels), 0.0)
+        if metric == f"{name}_bucket":
+            le = dict(labels)["le"]
+            bound = math.inf if le == "+Inf" else float(le)
+            buckets[bound] = buckets.get(bound, 0.0) + value - prev
+        elif metric == f"{name}_sum":
+            total += value - prev
+        elif metric == f"{name}_count":
+            count += value - prev
+    return {"count": count, "sum": total, "buckets": sorted(buckets.items())}
+
+
+def histogram_quantile(buckets: Sequence[Tuple[float, float]], q: float) -> float:
+    """Как histogram_quantile в PromQL: линейная интерполяция внутри кумулятивной корзины."""
+    if not buckets or buckets[-1][1] <= 0:
+        return 0.0
+    rank = q * buckets[-1][1]
+    prev_bound, prev_count = 0.0, 0.0
+    for bound, cum in buckets:
+        if cum >= rank:
+            if bound == math.inf:
+                return prev_bound
+            if cum == prev_count:
+                return bound
+            return prev_bound + (bound - prev_bound) * (rank - prev_count) / (cum - prev_count)
+        prev_bound, prev_count = bound, cum
+    return prev_bound
+
+
+def limiter_summary(before: Dict, after: Dict) -> Dict[str, Any]:
+    h = histogram_delta(before, after, "orion_ratelimit_wait_seconds")
+    return {
+        "acquired": int(h["count"]),
+        "wait_ms_mean": (h["sum"] / h["count"] * 1000.0) if h["count"] else 0.0,
+        "wait_ms_p95": histogram_quantile(h["buckets"], 0.95) * 1000.0,
+        "wait_ms_p99": histogram_quantile(h["buckets"], 0.99) * 1000.0,
+    }
+
+
+async def scrape(client: httpx.AsyncClient) -> Dict:
+    try:
+        r = await client.get("/metrics")
+        r.raise_for_status()
+        return parse_prometheus(r.text)
+    except Exception:
+        return {}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def benchmark(base_url: str, client: Optional[httpx.AsyncClient] = None, **kw: Any) -> Dict[str, Any]:
+    """Прогон + снимки /metrics до и после; результат — словарь для JSON."""
+    own = client is None
+    client = client or httpx.AsyncClient(base_url=base_url, timeout=kw.get("timeout", 60.0), trust_env=False)
+    try:
+        before = await scrape(client)
+        t0 = time.perf_counter()
+        samples = await run_load(base_url, client=client, **kw)
+        wall = time.perf_counter() - t0
+        after = await scrape(client)
+    finally:
+        if own:
+            await client.aclose()
+    result = summarize(samples, wall)
+    result["wall_s"] = wall
+    result["ratelimit"] = limiter_summary(before, after) if after else None
+    result["config"] = {"url": base_url, **{k: v for k, v in kw.items() if k != "client"}}
+    result["git"] = git_revision()
+    result["ts"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return result
+
+
+def save(result: Dict[str, Any], path: str) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def print_report(r: Dict[str, Any]) -> None:
+    lat = r["latency_ms"]
+    print(
+        f"{r['requests']} req in {r['wall_s']:.1f}s | ok {r['ok']} | {r['throughput_rps']:.1f} rps | "
+        f"errors {r['error_rate']:.1%} {r['errors'] or ''}"
+    )
+    print(f"latency ms: p50 {lat['p50']:.0f} | p95 {lat['p95']:.0f} | p99 {lat['p99']:.0f} | max {lat['max']:.0f}")
+    if r.get("ratelimit"):
+        rl = r["ratelimit"]
+        print(f"rate limiter: {rl['acquired']} acquires, wait mean {rl['wait_ms_mean']:.0f} ms, p95 {rl['wait_ms_p95']:.0f} ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Нагрузка на /v1/chat с фиксированной частотой прихода запросов")
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--rate", type=float, default=10.0, help="запросов в секунду")
+    ap.add_argument("--duration", type=float, default=30.0, help="секунд")
+    ap.add_argument("--users", type=int, default=1000, help="число разных user_id")
+    ap.add_argument("--channel", default="bench")
+    ap.add_argument("--arrival", choices=["uniform", "poisson"], default="uniform")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--max-inflight", type=int, default=10_000)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--out", default="", help="куда сохранить JSON с результатом")
+    args = ap.parse_args()
+
+    result = asyncio.run(
+        benchmark(
+            args.url, rate=args.rate, duration=args.duration, users=args.users, channel=args.channel,
+            arrival=args.arrival, timeout=args.timeout, max_inflight=args.max_inflight, seed=args.seed,
+        )
+    )
+    print_report(result)
+    if args.out:
+        save(result, args.out)
+        print(f"saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
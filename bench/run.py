@@ -0,0 +1,98 @@
+"""
+Полный прогон: заглушка LLM + сервис OrionAgent (оба — подпроцессы) + нагрузка.
+
+    python -m bench.run --rate 20 --duration 30 --latency lognormal:400:0.6 --error-rate 0.01
+
+Сервис получает LLM_PROVIDER=ollama и OLLAMA_BASE_URL/OPENAI_BASE_URL на заглушку;
+остальные настройки (LLM_RPS, HISTORY_*, ADMISSION_*, ...) берутся из окружения — так сравниваются конфигурации.
+Результат пишется в bench/results/<git>-<время>.json.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from .loadgen import benchmark, git_revision, print_report, save
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"процесс для {url} завершился с кодом {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0, trust_env=False).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} не поднялся за {timeout:.0f} с")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Бенчмарк OrionAgent против локальной заглушки LLM")
+    ap.add_argument("--rate", type=float, default=10.0)
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--arrival", choices=["uniform", "poisson"], default="uniform")
+    ap.add_argument("--latency", default="lognormal:300:0.5")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--fake-port", type=int, default=9100)
+    ap.add_argument("--api-port", type=int, default=8100)
+    ap.add_argument("--workers", type=int, default=1, help="воркеры uvicorn сервиса")
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    env = {
+        **os.environ,
+        "LLM_PROVIDER": "ollama",
+        "OLLAMA_BASE_URL": f"{fake_url}/v1",
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "VS_PROVIDER": os.environ.get("VS_PROVIDER", "none"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "bench.fake_llm", "--port", str(args.fake_port),
+             "--latency", args.latency, "--error-rate", str(args.error_rate)],
+            cwd=ROOT, env=env,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api.app:app", "--port", str(args.api_port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=ROOT, env=env,
+        ),
+    ]
+    try:
+        _wait_ready(f"{fake_url}/stats", procs[0])
+        _wait_ready(f"{api_url}/healthz", procs[1])
+        result = asyncio.run(
+            benchmark(api_url, rate=args.rate, duration=args.duration, users=args.users, arrival=args.arrival)
+        )
+        result["fake_llm"] = {"latency": args.latency, "error_rate": args.error_rate}
+        result["env"] = {k: v for k, v in env.items() if k.startswith(("LLM_", "HISTORY_", "COMPACTION_", "SEMANTIC_", "ADMISSION_", "RAG_"))}
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+
+    print_report(result)
+    out = args.out or str(ROOT / "bench" / "results" / f"{git_revision() or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    save(result, out)
+    print(f"saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,21 +27,80 @@ def _int(value: str | None, default: int) -> int:
         return default
 
 
+def _float(value: str | None, default: float) -> float:
+    try:
+        return float(value) if value is not None else default
+    except ValueError:
+        return default
+
+
 class Settings:
     # API / Server
     API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
     API_PORT: int = _int(os.getenv("API_PORT"), 8000)
     API_RELOAD: bool = _bool(os.getenv("API_RELOAD"), False)
     CORS_ORIGINS: list[str] = _csv(os.getenv("CORS_ORIGINS", ""))
+    # Допуск к /v1/chat: одновременно в работе / в очереди / сколько ждать слота (0 — без ограничений)
+    ADMISSION_MAX_INFLIGHT: int = _int(os.getenv("ADMISSION_MAX_INFLIGHT"), 64)
+    ADMISSION_MAX_QUEUE: int = _int(os.getenv("ADMISSION_MAX_QUEUE"), 256)
+    ADMISSION_QUEUE_TIMEOUT: float = _float(os.getenv("ADMISSION_QUEUE_TIMEOUT"), 10.0)
 
     # Features
     RAG_ENABLED: bool = _bool(os.getenv("RAG_ENABLED"), False)
+    # Минимальная близость чанка для попадания в контекст (не задано — без порога)
+    RAG_MIN_SCORE: float | None = _float(os.getenv("RAG_MIN_SCORE"), 0.0) if os.getenv("RAG_MIN_SCORE") else None
+    # Склеивать одинаковые одновременные запросы к ретриверу (single-flight)
+    RAG_COALESCE: bool = _bool(os.getenv("RAG_COALESCE"), True)
+
+    # История диалогов: окно на ключ, LRU по числу ключей, бюджет памяти и TTL простоя (0 — без ограничения).
+    # Бюджет и TTL — по желанию: без них история в памяти ведёт себя как раньше, ничего не забывая
+    HISTORY_WINDOW: int = _int(os.getenv("HISTORY_WINDOW"), 20)
+    HISTORY_MAX_KEYS: int = _int(os.getenv("HISTORY_MAX_KEYS"), 0)
+    HISTORY_MAX_BYTES: int = _int(os.getenv("HISTORY_MAX_BYTES"), 0)
+    HISTORY_IDLE_TTL: float = _float(os.getenv("HISTORY_IDLE_TTL"), 0.0)
+    # Хранилище: memory — только процесс; sqlite — WAL-файл, общий для воркеров и переживающий рестарт
+    HISTORY_BACKEND: str = os.getenv("HISTORY_BACKEND", "memory")
+    HISTORY_SQLITE_PATH: str = os.getenv("HISTORY_SQLITE_PATH", "./history.sqlite3")
+    HISTORY_SQLITE_RETAIN: int = _int(os.getenv("HISTORY_SQLITE_RETAIN"), 200)
+    # Перечитывать окно из sqlite не реже раза в N секунд: в один ключ пишут несколько воркеров.
+    # Для sqlite по умолчанию 1 с — столько максимум отстаёт окно воркера от чужих ходов.
+    # 0 — доверять кэшу бессрочно: это безопасно ТОЛЬКО с одним воркером
+    HISTORY_CACHE_REVALIDATE: float = _float(
+        os.getenv("HISTORY_CACHE_REVALIDATE"), 1.0 if HISTORY_BACKEND.strip().lower() == "sqlite" else 0.0
+    )
+
+    # Фоновое сжатие длинных диалогов в сводку (system-сообщение вместо старых ходов)
+    COMPACTION_ENABLED: bool = _bool(os.getenv("COMPACTION_ENABLED"), False)
+    COMPACTION_THRESHOLD_TOKENS: int = _int(os.getenv("COMPACTION_THRESHOLD_TOKENS"), 3000)
+    COMPACTION_KEEP_RECENT: int = _int(os.getenv("COMPACTION_KEEP_RECENT"), 6)
+    # Каналы (пусто — все) и пороги по каналам: «telegram=2000,web=6000»
+    COMPACTION_CHANNELS: list[str] = _csv(os.getenv("COMPACTION_CHANNELS", ""))
+    COMPACTION_THRESHOLDS: list[str] = _csv(os.getenv("COMPACTION_THRESHOLDS", ""))
+    # Провайдер/модель для пересказа (пусто — основной LLM)
+    COMPACTION_PROVIDER: str = os.getenv("COMPACTION_PROVIDER", "")
+    COMPACTION_MODEL: str = os.getenv("COMPACTION_MODEL", "")
+
+    # Семантический кэш ответов (перефразировки одного вопроса); пустой список каналов — все
+    SEMANTIC_CACHE_ENABLED: bool = _bool(os.getenv("SEMANTIC_CACHE_ENABLED"), False)
+    SEMANTIC_CACHE_THRESHOLD: float = _float(os.getenv("SEMANTIC_CACHE_THRESHOLD"), 0.92)
+    SEMANTIC_CACHE_MAX: int = _int(os.getenv("SEMANTIC_CACHE_MAX"), 1000)
+    SEMANTIC_CACHE_CHANNELS: list[str] = _csv(os.getenv("SEMANTIC_CACHE_CHANNELS", ""))
 
     # Логирование (оставляем один источник правды)
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", os.getenv("API_LOG_LEVEL", "INFO"))
+    # text — строки как раньше; json — JSON на запись с trace_id/span_id
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")
+
+    # Трассировка запросов: Server-Timing/X-Trace-Id, спаны в лог и в файл OTLP/JSON (пусто — без файла)
+    TRACING_ENABLED: bool = _bool(os.getenv("TRACING_ENABLED"), True)
+    TRACE_LOG_SPANS: bool = _bool(os.getenv("TRACE_LOG_SPANS"), False)
+    TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH", "")
 
     # LLM (по умолчанию OpenRouter)
     LLM_PROVIDER: str = os.getenv("LLM_PROVIDER", "openrouter")
+    # Бюджет промпта: окно контекста модели (0 — по имени модели) и резерв под ответ
+    LLM_CONTEXT_TOKENS: int = _int(os.getenv("LLM_CONTEXT_TOKENS"), 0)
+    LLM_MAX_COMPLETION_TOKENS: int = _int(os.getenv("LLM_MAX_COMPLETION_TOKENS"), 1024)
 
     # OpenAI-совместимые эндпоинты
     OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "https://openrouter.ai/api/v1")
@@ -59,11 +118,32 @@ class Settings:
     # Ollama
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
 
+    # Эмбеддинги: микробатчинг конкурентных embed_query
+    EMB_BATCHING: bool = _bool(os.getenv("EMB_BATCHING"), False)
+    EMB_BATCH_MAX: int = _int(os.getenv("EMB_BATCH_MAX"), 32)
+    EMB_BATCH_WINDOW_MS: float = _float(os.getenv("EMB_BATCH_WINDOW_MS"), 5.0)
+    # Кэш эмбеддингов: LRU запросов в памяти + векторы документов на диске (пустой каталог — только LRU)
+    EMB_CACHE: bool = _bool(os.getenv("EMB_CACHE"), False)
+    EMB_CACHE_DIR: str = os.getenv("EMB_CACHE_DIR", "./emb_cache")
+    EMB_QUERY_CACHE_SIZE: int = _int(os.getenv("EMB_QUERY_CACHE_SIZE"), 4096)
+
     # Vector Stores (RAG)
     VS_PROVIDER: str = os.getenv("VS_PROVIDER", "chroma")
     CHROMA_DIR: str = os.getenv("CHROMA_DIR", "./chroma_store")
     CHROMA_COLLECTION: str = os.getenv("CHROMA_COLLECTION", "ai_agent")
 
+    NUMPY_STORE_PATH: str = os.getenv("NUMPY_STORE_PATH", "./numpy_store/store.oavs")
+    NUMPY_STORE_MMAP: bool = _bool(os.getenv("NUMPY_STORE_MMAP"), True)
+    # flat — точный перебор; ivf — приближённый поиск (nlist кластеров, nprobe просматриваемых)
+    NUMPY_STORE_INDEX: str = os.getenv("NUMPY_STORE_INDEX", "flat")
+    IVF_NLIST: int = _int(os.getenv("IVF_NLIST"), 256)
+    IVF_NPROBE: int = _int(os.getenv("IVF_NPROBE"), 8)
+
+    # Инкрементальная индексация: манифест (source, hash чанка) → id и параметры нарезки
+    INDEX_MANIFEST_PATH: str = os.getenv("INDEX_MANIFEST_PATH", "./index_manifest.sqlite3")
+    INDEX_CHUNK_SIZE: int = _int(os.getenv("INDEX_CHUNK_SIZE"), 1000)
+    INDEX_CHUNK_OVERLAP: int = _int(os.getenv("INDEX_CHUNK_OVERLAP"), 200)
+
     QDRANT_URL: str = os.getenv("QDRANT_URL", "http://localhost:6333")
     QDRANT_API_KEY: str = os.getenv("QDRANT_API_KEY", "")
     QDRANT_COLLECTION: str = os.getenv("QDRANT_COLLECTION", "rag_demo")
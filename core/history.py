@@ -1,68 +1,421 @@
 from __future__ import annotations
-from collections import defaultdict
-from threading import Lock
-from typing import Dict, List, Literal, TypedDict
+import sys
 import time
-import copy
+from collections import OrderedDict, deque
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Literal, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from .history_backends import HistoryBackend
 
 Role = Literal["user", "assistant", "system"]
+_ROLES = ("user", "assistant", "system")
+
+# Грубая оценка памяти сообщения сверх самой строки: dict, слот, ячейка deque
+_MSG_OVERHEAD = 280
+_CONV_OVERHEAD = 900
+
+
+class Message(dict):
+    """
+    Неизменяемое сообщение истории. Наследуем dict, чтобы LLM-клиенты, кэш и json
+    работали с ним как раньше; tokens — слот под закэшированный подсчёт токенов (кодировка, число).
+    """
+
+    __slots__ = ("tokens",)
+
+    def __init__(self, role: Role, content: str) -> None:
+        dict.__init__(self, role=role, content=content)
+        self.tokens: Optional[Tuple[Optional[str], int]] = None
+
+    @property
+    def role(self) -> Role:
+        return self["role"]
+
+    @property
+    def content(self) -> str:
+        return self["content"]
+
+    def _readonly(self, *args: Any, **kwargs: Any) -> None:
+        raise TypeError("Message is immutable")
+
+    __setitem__ = __delitem__ = _readonly  # type: ignore[assignment]
+    clear = pop = popitem = setdefault = update = _readonly  # type: ignore[assignment]
+    __ior__ = _readonly  # type: ignore[assignment]
+
+    def __copy__(self) -> "Message":
+        return self
+
+    def __deepcopy__(self, memo: dict) -> "Message":
+        return self
+
+    def __reduce__(self):
+        return (Message, (self["role"], self["content"]))
+
+
+def _msg_bytes(msg: Message) -> int:
+    return _MSG_OVERHEAD + sys.getsizeof(msg["content"])
+
+
+class _Conversation:
+    # Окно сообщений + кэш снимка: повторное чтение без изменений не копирует ничего
+    __slots__ = ("items", "snapshot", "bytes", "touched", "loaded")
+
+    def __init__(self, window: int, now: float) -> None:
+        self.items: Deque[Message] = deque(maxlen=window)
+        self.snapshot: Optional[Tuple[Message, ...]] = ()
+        self.bytes = _CONV_OVERHEAD
+        self.touched = now
+        self.loaded = now
+
+
+class _Stripe:
+    # data упорядочен по давности обращения: первый ключ — самый холодный в полосе
+    __slots__ = ("lock", "data")
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.data: "OrderedDict[str, _Conversation]" = OrderedDict()
 
-class Message(TypedDict):
-    role: Role
-    content: str
-    ts: float  # метка времени (секунды с эпохи)
 
 class HistoryRepository:
-    def __init__(self, window: int = 20, max_keys: int | None = None):
+    """
+    История диалогов в памяти: на ключ (channel:user_id) — deque(maxlen=window)
+    неизменяемых Message. Блокировки разбиты на полосы по хэшу ключа,
+    поэтому разные пользователи не ждут друг друга на одном Lock.
+    messages() отдаёт кортеж-снимок без глубокого копирования.
+
+    Вытеснение — по давности последнего обращения (LRU): при превышении max_keys или
+    max_bytes уходит самый холодный диалог среди голов всех полос; диалоги,
+    простаивающие дольше idle_ttl секунд, удаляются лениво и периодической зачисткой.
+
+    С backend память — только горячий кэш окон: запись уходит и в бэкенд, промах читает
+    окно из него, а вытеснение и TTL лишь освобождают память, не теряя диалог.
+    revalidate (секунды) — как часто перечитывать окно из бэкенда, если в тот же ключ
+    могут писать другие процессы; None — доверять кэшу (годится только для одного процесса).
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        max_keys: int | None = None,
+        stripes: int = 64,
+        max_bytes: int | None = None,
+        idle_ttl: float | None = None,
+        backend: Optional["HistoryBackend"] = None,
+        revalidate: float | None = None,
+    ):
         # window — длина окна в сообщениях на один ключ (channel:user_id)
         # max_keys — необязательное ограничение на число разных ключей
+        # max_bytes — бюджет памяти на всю историю (приблизительный учёт)
         if window < 0:
             raise ValueError("window must be >= 0")
-        self._store: Dict[str, List[Message]] = defaultdict(list)
         self._win = window
-        self._lock = Lock()
-        self._max_keys = max_keys
+        self._max_keys = max_keys if max_keys and max_keys > 0 else None
+        self._max_bytes = max_bytes if max_bytes and max_bytes > 0 else None
+        self._ttl = float(idle_ttl) if idle_ttl and idle_ttl > 0 else None
+        self._stripes: List[_Stripe] = [_Stripe() for _ in range(max(1, int(stripes)))]
+        self.backend = backend
+        self._revalidate = float(revalidate) if revalidate and revalidate > 0 else None
+
+        # Глобальные счётчики под отдельным коротким Lock — полосы их только инкрементят
+        self._acct = Lock()
+        self._keys = 0
+        self._bytes = 0
+        self.evictions: Dict[str, int] = {"lru": 0, "bytes": 0, "ttl": 0}
+        self._evicting = Lock()
+        self._sweep_every = min(60.0, self._ttl / 4) if self._ttl else None
+        self._next_sweep = time.monotonic() + (self._sweep_every or 0.0)
 
     @staticmethod
     def _key(channel: str, user_id: str) -> str:
         return f"{channel}:{user_id}"
 
-    def messages(self, channel: str, user_id: str) -> List[Message]:
-        # Возвращаем глубокую копию, чтобы внешние изменения не затронули хранилище
-        with self._lock:
-            msgs = self._store[self._key(channel, user_id)][-self._win:]
-            return copy.deepcopy(msgs)
+    def _stripe(self, key: str) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def __len__(self) -> int:
+        return self._keys
+
+    def _account(self, keys: int, nbytes: int) -> None:
+        with self._acct:
+            self._keys += keys
+            self._bytes += nbytes
+
+    def _expired(self, conv: _Conversation, now: float) -> bool:
+        return self._ttl is not None and now - conv.touched > self._ttl
+
+    def _lookup(self, stripe: _Stripe, key: str, now: float) -> Optional[_Conversation]:
+        # Вызывать под stripe.lock: отдаёт живой диалог, протухший выкидывает
+        conv = stripe.data.get(key)
+        if conv is None:
+            return None
+        if self._expired(conv, now):
+            reason: Optional[str] = "ttl"
+        elif self._revalidate is not None and self.backend is not None and now - conv.loaded > self._revalidate:
+            reason = None  # перечитаем из бэкенда
+        else:
+            return conv
+        del stripe.data[key]
+        self._account(-1, -conv.bytes)
+        if reason is not None:
+            self._count_eviction(reason)
+        return None
+
+    def _load(self, key: str, stripe: _Stripe) -> _Conversation:
+        # Чтение бэкенда — вне блокировки полосы, чтобы промах не тормозил соседние ключи
+        assert self.backend is not None
+        records = self.backend.load(key, self._win)
+        conv = _Conversation(self._win, time.monotonic())
+        for role, content in records:
+            msg = Message(role, content)  # type: ignore[arg-type]
+            conv.items.append(msg)
+            conv.bytes += _msg_bytes(msg)
+        conv.snapshot = None
+        with stripe.lock:
+            cur = stripe.data.get(key)
+            if cur is not None:  # другой поток успел загрузить
+                return cur
+            stripe.data[key] = conv
+            self._account(1, conv.bytes)
+        return conv
+
+    def messages(self, channel: str, user_id: str) -> Tuple[Message, ...]:
+        key = self._key(channel, user_id)
+        stripe = self._stripe(key)
+        now = time.monotonic()
+        with stripe.lock:
+            conv = self._lookup(stripe, key, now)
+            if conv is None and self.backend is None:
+                return ()
+        if conv is None:
+            conv = self._load(key, stripe)
+            self._maybe_evict(now, keep=key)
+        with stripe.lock:
+            conv.touched = now
+            if key in stripe.data:
+                stripe.data.move_to_end(key)
+            snap = conv.snapshot
+            if snap is None:
+                snap = conv.snapshot = tuple(conv.items)
+            return snap
 
     def append(self, channel: str, user_id: str, role: Role, content: str) -> None:
-        if role not in ("user", "assistant", "system"):
+        if role not in _ROLES:
             raise ValueError(f"invalid role: {role}")
         if content is None:
             content = ""
+        msg = Message(role, content)
         key = self._key(channel, user_id)
-        with self._lock:
-            # Простая защита от бесконтрольного роста количества ключей
-            if self._max_keys is not None and key not in self._store and len(self._store) >= self._max_keys:
-                # удаляем самый старый ключ (наивная политика FIFO)
-                oldest_key = next(iter(self._store))
-                self._store.pop(oldest_key, None)
-
-            self._store[key].append({"role": role, "content": content, "ts": time.time()})
-            if self._win > 0:
-                self._store[key] = self._store[key][-self._win:]
+        stripe = self._stripe(key)
+        now = time.monotonic()
+        if self.backend is not None:
+            # окно должно начинаться с сохранённой истории, а не с этого сообщения
+            with stripe.lock:
+                present = self._lookup(stripe, key, now) is not None
+            if not present:
+                self._load(key, stripe)
+        new_keys = created = 0
+        with stripe.lock:
+            conv = self._lookup(stripe, key, now)
+            if conv is None:
+                # без бэкенда простоявший диалог начинается заново
+                conv = stripe.data[key] = _Conversation(self._win, now)
+                new_keys, created = 1, conv.bytes
             else:
-                # окно 0 — очищаем хранение (разрешено, но странно)
-                self._store[key].clear()
+                stripe.data.move_to_end(key)
+            # deque(maxlen) сам вытесняет старое сообщение — вычитаем его размер; окно 0 ничего не хранит
+            delta = 0
+            if self._win > 0:
+                delta = _msg_bytes(msg)
+                if len(conv.items) == self._win:
+                    delta -= _msg_bytes(conv.items[0])
+            conv.items.append(msg)
+            conv.bytes += delta
+            conv.touched = now
+            conv.snapshot = None
+            if self.backend is not None:
+                # ставим в очередь под той же блокировкой: параллельная загрузка ключа не задвоит сообщение
+                self.backend.append(key, role, content)
+        self._account(new_keys, created + delta)
+        self._maybe_evict(now, keep=key)
+
+    # --- вытеснение ---
+
+    def _count_eviction(self, reason: str) -> None:
+        with self._acct:
+            self.evictions[reason] += 1
+
+    def _over_budget(self) -> Optional[str]:
+        if self._max_keys is not None and self._keys > self._max_keys:
+            return "lru"
+        if self._max_bytes is not None and self._bytes > self._max_bytes:
+            return "bytes"
+        return None
+
+    def _maybe_evict(self, now: float, keep: Optional[str] = None) -> None:
+        if self._sweep_every is not None and now >= self._next_sweep:
+            self._next_sweep = now + self._sweep_every
+            self.sweep(now)
+        if self._over_budget() is None:
+            return
+        # Один вытесняющий поток за раз: остальные не дерутся за одни и те же головы полос
+        if not self._evicting.acquire(blocking=False):
+            return
+        try:
+            while True:
+                reason = self._over_budget()
+                if reason is None or not self._evict_coldest(reason, keep):
+                    break
+        finally:
+            self._evicting.release()
+
+    def _evict_coldest(self, reason: str, keep: Optional[str]) -> bool:
+        # Самый холодный диалог — минимум touched среди голов LRU всех полос
+        best: Optional[_Stripe] = None
+        best_key: Optional[str] = None
+        best_ts = float("inf")
+        for stripe in self._stripes:
+            with stripe.lock:
+                for key, conv in stripe.data.items():
+                    if key == keep:  # только что записанный диалог не выселяем
+                        continue
+                    if conv.touched < best_ts:
+                        best, best_key, best_ts = stripe, key, conv.touched
+                    break
+        if best is None or best_key is None:
+            return False
+        with best.lock:
+            conv = best.data.get(best_key)
+            if conv is None or conv.touched != best_ts:
+                return True  # ключ тронули между проходами — пересчитаем на следующем шаге
+            del best.data[best_key]
+        self._account(-1, -conv.bytes)
+        self._count_eviction(reason)
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаляет диалоги, простаивающие дольше idle_ttl. Головы полос — самые старые, дальше не смотрим."""
+        if self._ttl is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        removed = 0
+        for stripe in self._stripes:
+            freed_keys = freed_bytes = 0
+            with stripe.lock:
+                while stripe.data:
+                    key, conv = next(iter(stripe.data.items()))
+                    if not self._expired(conv, now):
+                        break
+                    del stripe.data[key]
+                    freed_keys += 1
+                    freed_bytes += conv.bytes
+            if freed_keys:
+                self._account(-freed_keys, -freed_bytes)
+                with self._acct:
+                    self.evictions["ttl"] += freed_keys
+                removed += freed_keys
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._acct:
+            return {
+                "live_keys": self._keys,
+                "bytes": self._bytes,
+                "max_keys": self._max_keys,
+                "max_bytes": self._max_bytes,
+                "idle_ttl": self._ttl,
+                "evictions": dict(self.evictions),
+                "backend": self.backend.stats() if self.backend is not None else None,
+            }
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        return self.backend.flush(timeout) if self.backend is not None else True
+
+    def close(self) -> None:
+        if self.backend is not None:
+            self.backend.close()
 
     # Алиасы
     def append_user(self, channel: str, user_id: str, content: str) -> None:
         self.append(channel, user_id, "user", content)
 
-    def append_system(self, channel: str, user_id: str, content: str) -> None:
-        self.append(channel, user_id, "system", content)
+    def append_system(
+        self,
+        channel: str,
+        user_id: str,
+        content: str,
+        replaces: Optional[Sequence[Message]] = None,
+    ) -> bool:
+        """
+        replaces — начальные сообщения окна, которые system-сообщение заменяет (сжатие диалога).
+        Замена атомарна и проходит, только если окно всё ещё начинается ровно с них;
+        иначе (окно сдвинулось, диалог сброшен) ничего не меняем и возвращаем False.
+        """
+        if not replaces:
+            self.append(channel, user_id, "system", content)
+            return True
+        msg = Message("system", content if content is not None else "")
+        key = self._key(channel, user_id)
+        stripe = self._stripe(key)
+        with stripe.lock:
+            conv = stripe.data.get(key)
+            items = conv.items if conv is not None else None
+            n = len(replaces)
+            if items is None or n > len(items) or any(items[i] is not replaces[i] for i in range(n)):
+                return False
+            delta = _msg_bytes(msg)
+            for _ in range(n):
+                delta -= _msg_bytes(items.popleft())
+            items.appendleft(msg)
+            conv.bytes += delta
+            conv.snapshot = None
+            if self.backend is not None:
+                self.backend.compact(key, len(items) - 1, "system", msg["content"])
+        self._account(0, delta)
+        return True
 
     def append_assistant(self, channel: str, user_id: str, content: str) -> None:
         self.append(channel, user_id, "assistant", content)
 
     def reset(self, channel: str, user_id: str) -> None:
-        with self._lock:
-            self._store.pop(self._key(channel, user_id), None)
+        key = self._key(channel, user_id)
+        stripe = self._stripe(key)
+        with stripe.lock:
+            conv = stripe.data.pop(key, None)
+            if self.backend is not None:
+                self.backend.reset(key)
+        if conv is not None:
+            self._account(-1, -conv.bytes)
+
+
+def make_history() -> HistoryRepository:
+    """HistoryRepository по настройкам: HISTORY_BACKEND=memory|sqlite."""
+    from .config import settings
+
+    kind = (settings.HISTORY_BACKEND or "memory").lower()
+    backend: Optional["HistoryBackend"] = None
+    if kind == "sqlite":
+        from .history_backends import SQLiteHistoryBackend
+
+        backend = SQLiteHistoryBackend(
+            settings.HISTORY_SQLITE_PATH,
+            retain=max(settings.HISTORY_WINDOW, settings.HISTORY_SQLITE_RETAIN),
+        )
+        if not settings.HISTORY_CACHE_REVALIDATE:
+            from .logging import get_logger
+
+            get_logger("history").warning(
+                "HISTORY_CACHE_REVALIDATE=0: окна в памяти не перечитываются — с несколькими воркерами"
+                " промпты будут строиться по устаревшей истории; безопасно только с одним воркером"
+            )
+    elif kind != "memory":
+        raise ValueError(f"Unknown history backend: {kind}")
+    return HistoryRepository(
+        window=settings.HISTORY_WINDOW,
+        max_keys=settings.HISTORY_MAX_KEYS or None,
+        max_bytes=settings.HISTORY_MAX_BYTES or None,
+        idle_ttl=settings.HISTORY_IDLE_TTL or None,
+        backend=backend,
+        revalidate=settings.HISTORY_CACHE_REVALIDATE or None,
+    )
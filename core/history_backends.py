@@ -0,0 +1,287 @@
+from __future__ import annotations
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.logging import get_logger
+from core.metrics import HISTORY_WRITE_FAILURES
+
+_RETRIED = HISTORY_WRITE_FAILURES.labels("retried")
+_LOST = HISTORY_WRITE_FAILURES.labels("lost")
+
+Record = Tuple[str, str]  # (role, content)
+
+
+class HistoryBackend(ABC):
+    """
+    Долговременное хранилище истории за HistoryRepository.
+    Репозиторий держит горячее окно в памяти и читает бэкенд только при промахе.
+    """
+
+    @abstractmethod
+    def load(self, key: str, limit: int) -> List[Record]:
+        """Последние limit сообщений ключа в хронологическом порядке."""
+
+    @abstractmethod
+    def append(self, key: str, role: str, content: str) -> None:
+        ...
+
+    @abstractmethod
+    def reset(self, key: str) -> None:
+        ...
+
+    def compact(self, key: str, keep_last: int, role: str, content: str) -> None:
+        """Заменяет всё, кроме последних keep_last сообщений ключа, одним сообщением (сводкой)."""
+        raise NotImplementedError(f"{type(self).__name__} не поддерживает сжатие истории")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        return True
+
+    def close(self) -> None:
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+_FLUSH = object()
+_STOP = object()
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    """
+    История в SQLite (WAL): переживает рестарт и общая для нескольких воркеров uvicorn.
+    Записи идут через очередь в фоновый поток, который коммитит пачкой (group commit):
+    всё, что накопилось за commit_interval_ms, — одна транзакция и один fsync.
+    retain — сколько последних сообщений ключа хранить (старые подрезаются при записи).
+    Вызывающие уже получили подтверждение, поэтому сбойную пачку не бросаем: она повторяется
+    с паузой, потом делится пополам, чтобы изолировать сбойную операцию; потерянные
+    операции считаются в stats()["lost"] и метрике orion_history_write_failures_total.
+    """
+
+    def __init__(
+        self,
+        path: str = "./history.sqlite3",
+        retain: int = 200,
+        batch_max: int = 512,
+        commit_interval_ms: float = 5.0,
+        retries: int = 3,
+        retry_backoff: float = 0.05,
+    ) -> None:
+        self.log = get_logger("history.sqlite")
+        self.path = path
+        self.retain = max(1, int(retain))
+        self.batch_max = max(1, int(batch_max))
+        self.interval = max(0.0, float(commit_interval_ms)) / 1000.0
+        self.retries = max(0, int(retries))
+        self.retry_backoff = max(0.0, float(retry_backoff))
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._writer_db = self._connect()
+        self._writer_db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL,"
+            " role TEXT NOT NULL, content TEXT NOT NULL, ts REAL NOT NULL)"
+        )
+        self._writer_db.execute("CREATE INDEX IF NOT EXISTS history_key_id ON history(key, id)")
+        # Читатель — своё соединение: в WAL чтение не ждёт пишущую транзакцию
+        self._reader_db = self._connect()
+        self._read_lock = threading.Lock()
+
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._pending: Dict[str, int] = {}
+        self._pending_lock = threading.Lock()
+        self.batches = 0
+        self.written = 0
+        self.errors = 0
+        self.lost = 0
+        self.commit_ms_max = 0.0
+        self._worker = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._worker.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- API ---
+
+    def load(self, key: str, limit: int) -> List[Record]:
+        if limit <= 0:
+            return []
+        # Свои ещё не записанные сообщения этого ключа должны попасть в выборку
+        if self.pending(key):
+            self.flush()
+        with self._read_lock:
+            rows = self._reader_db.execute(
+                "SELECT role, content FROM history WHERE key = ? ORDER BY id DESC LIMIT ?", (key, int(limit))
+            ).fetchall()
+        rows.reverse()
+        return [(r, c) for r, c in rows]
+
+    def append(self, key: str, role: str, content: str) -> None:
+        with self._pending_lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        self._queue.put(("append", key, role, content, time.time()))
+
+    def reset(self, key: str) -> None:
+        with self._pending_lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        self._queue.put(("reset", key, None, None, None))
+
+    def compact(self, key: str, keep_last: int, role: str, content: str) -> None:
+        # В общей очереди: применится строго после уже поставленных дозаписей этого ключа
+        with self._pending_lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        self._queue.put(("compact", key, role, content, int(keep_last)))
+
+    def pending(self, key: str) -> int:
+        with self._pending_lock:
+            return self._pending.get(key, 0)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        if not self._worker.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        if self._worker.is_alive():
+            self._queue.put((_STOP, None))
+            self._worker.join(timeout=10)
+        self._writer_db.close()
+        with self._read_lock:
+            self._reader_db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "avg_batch": (self.written / self.batches) if self.batches else 0.0,
+            "commit_ms_max": self.commit_ms_max,
+            "errors": self.errors,
+            "lost": self.lost,
+        }
+
+    # --- фоновый писатель ---
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            ops, signals, stop = self._collect(first)
+            if ops:
+                self._commit(ops)
+            for ev in signals:
+                ev.set()
+            if stop:
+                return
+
+    def _collect(self, first: Any) -> Tuple[List[tuple], List[threading.Event], bool]:
+        ops: List[tuple] = []
+        signals: List[threading.Event] = []
+        item = first
+        deadline = time.monotonic() + self.interval
+        while True:
+            if item[0] is _STOP:
+                return ops, signals, True
+            if item[0] is _FLUSH:
+                # flush не ждёт окна группировки
+                signals.append(item[1])
+                deadline = 0.0
+            else:
+                ops.append(item)
+            if len(ops) >= self.batch_max:
+                break
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return ops, signals, False
+
+    def _commit(self, ops: List[tuple]) -> None:
+        try:
+            self._commit_or_split(ops)
+        finally:
+            with self._pending_lock:
+                for op in ops:
+                    left = self._pending.get(op[1], 0) - 1
+                    if left > 0:
+                        self._pending[op[1]] = left
+                    else:
+                        self._pending.pop(op[1], None)
+
+    def _commit_or_split(self, ops: List[tuple], retry: bool = True) -> None:
+        # С паузами повторяем целую пачку (временные сбои: блокировка, диск) и одиночную
+        # операцию перед потерей; промежуточные половины — одна попытка, иначе поиск плохой
+        # операции в пачке из batch_max стоит log2(batch_max) циклов ожидания.
+        attempts = self.retries + 1 if retry or len(ops) == 1 else 1
+        for attempt in range(attempts):
+            if attempt:
+                _RETRIED.inc()
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            started = time.perf_counter()
+            try:
+                self._apply(ops)
+            except Exception as e:
+                self.errors += 1
+                self.log.warning("history batch of %d ops failed (attempt %d): %s", len(ops), attempt + 1, e)
+                try:
+                    self._writer_db.execute("ROLLBACK")
+                except Exception:
+                    pass
+            else:
+                self.batches += 1
+                self.written += len(ops)
+                self.commit_ms_max = max(self.commit_ms_max, (time.perf_counter() - started) * 1000.0)
+                return
+        if len(ops) > 1:
+            # половины по порядку: порядок операций ключа сохраняется
+            mid = len(ops) // 2
+            self._commit_or_split(ops[:mid], retry=False)
+            self._commit_or_split(ops[mid:], retry=False)
+            return
+        self.lost += 1
+        _LOST.inc()
+        self.log.error("history op %s for key %r lost after %d attempts", ops[0][0], ops[0][1], attempts)
+
+    def _apply(self, ops: List[tuple]) -> None:
+        touched = set()
+        db = self._writer_db
+        db.execute("BEGIN")
+        for kind, key, role, content, extra in ops:
+            if kind == "append":
+                db.execute(
+                    "INSERT INTO history(key, role, content, ts) VALUES (?, ?, ?, ?)", (key, role, content, extra)
+                )
+                touched.add(key)
+            elif kind == "compact":
+                # Сводка встаёт перед последними extra сообщениями: переписываем их после неё
+                kept = db.execute(
+                    "SELECT role, content, ts FROM history WHERE key = ? ORDER BY id DESC LIMIT ?", (key, extra)
+                ).fetchall()
+                db.execute("DELETE FROM history WHERE key = ?", (key,))
+                db.execute(
+                    "INSERT INTO history(key, role, content, ts) VALUES (?, ?, ?, ?)", (key, role, content, time.time())
+                )
+                db.executemany(
+                    "INSERT INTO history(key, role, content, ts) VALUES (?, ?, ?, ?)",
+                    [(key, r, c, t) for r, c, t in reversed(kept)],
+                )
+            else:
+                db.execute("DELETE FROM history WHERE key = ?", (key,))
+        for key in touched:
+            db.execute(
+                "DELETE FROM history WHERE key = ? AND id <= "
+                "(SELECT id FROM history WHERE key = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (key, key, self.retain),
+            )
+        db.execute("COMMIT")
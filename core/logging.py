@@ -1,5 +1,6 @@
 # core/logging.py
 from __future__ import annotations
+import json
 import logging
 import os
 
@@ -11,30 +12,61 @@ def _coerce_level(level: str | None) -> int:
     lvl = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
     return getattr(logging, lvl, logging.INFO)
 
-def _ensure_formatter(logger: logging.Logger, fmt: str, datefmt: str) -> None:
-    formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой: trace_id/span_id и спан (если есть) — отдельными полями."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": self.formatTime(record, DEFAULT_DATEFMT),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            out["trace_id"] = trace_id
+            out["span_id"] = getattr(record, "span_id", None)
+        span = getattr(record, "span", None)
+        if span is not None:
+            out["span"] = span
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+def _make_formatter(fmt: str, datefmt: str, style: str) -> logging.Formatter:
+    if style == "json":
+        return JsonFormatter()
+    return logging.Formatter(fmt=fmt, datefmt=datefmt)
+
+def _ensure_formatter(logger: logging.Logger, fmt: str, datefmt: str, style: str = "text") -> None:
+    from core.tracing import TraceContextFilter  # здесь: tracing сам импортирует этот модуль
+
+    formatter = _make_formatter(fmt, datefmt, style)
     for h in logger.handlers:
         h.setFormatter(formatter)
+        if not any(isinstance(f, TraceContextFilter) for f in h.filters):
+            h.addFilter(TraceContextFilter())
 
-def setup_logging(level: str | None = None) -> None:
+def setup_logging(level: str | None = None, style: str | None = None) -> None:
+    # style: text — как раньше; json — по записи на строку с trace_id (LOG_FORMAT)
     lvl = _coerce_level(level)
+    style = (style or os.getenv("LOG_FORMAT", "text")).strip().lower()
 
     root = logging.getLogger()
-    if root.handlers:
-        root.setLevel(lvl)
-        _ensure_formatter(root, DEFAULT_FMT, DEFAULT_DATEFMT)
-    else:
+    if not root.handlers:
         logging.basicConfig(
             level=lvl,
             format=DEFAULT_FMT,
             datefmt=DEFAULT_DATEFMT,
         )
+    root.setLevel(lvl)
+    _ensure_formatter(root, DEFAULT_FMT, DEFAULT_DATEFMT, style)
 
     # Приводим uvicorn-логгеры (уровень + формат их хендлеров)
     for name in ("uvicorn", "uvicorn.access", "uvicorn.error"):
         lg = logging.getLogger(name)
         lg.setLevel(lvl)
-        _ensure_formatter(lg, DEFAULT_FMT, DEFAULT_DATEFMT)
+        _ensure_formatter(lg, DEFAULT_FMT, DEFAULT_DATEFMT, style)
 
 def get_logger(name: str) -> logging.Logger:
     return logging.getLogger(name)
@@ -0,0 +1,294 @@
+# core/metrics.py
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Границы гистограмм задержек в секундах: от миллисекунд (история, кэш) до минуты (LLM)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    """
+    Метрика с метками. Дочерний объект на набор значений меток создаётся один раз
+    и кэшируется: на горячем пути — поиск в dict, без аллокаций. Потребители, которые
+    знают метки заранее (провайдер/модель), держат ссылку на дочерний объект сами.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {values}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(v) for v in values), self._new_child())
+                self._children.setdefault(values, child)
+        return child
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], object]]:
+        if not self.labelnames:
+            return [((), self._default)]
+        with self._lock:
+            # один дочерний объект может лежать под двумя ключами (исходные и str-значения)
+            seen, out = set(), []
+            for values, child in self._children.items():
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    out.append((tuple(str(v) for v in values), child))
+            return out
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child: object) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "lock", "fn")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.lock = threading.Lock()
+        self.fn: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        """Значение считается при выгрузке /metrics, а не на каждом событии."""
+        self.fn = fn
+
+    def get(self) -> float:
+        if self.fn is not None:
+            try:
+                return float(self.fn())
+            except Exception:
+                return math.nan
+        return self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, values)} {_fmt(child.get())}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._default.set_function(fn)
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя ячейка — +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("target", "t0")
+
+    def __init__(self, target: _Buckets) -> None:
+        self.target = target
+
+    def __enter__(self) -> "_Timer":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.target.observe(time.perf_counter() - self.t0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS
+    ) -> None:
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return _Timer(self._default)
+
+    def _render_child(self, values, child) -> List[str]:
+        with child.lock:
+            counts, total = list(child.counts), child.sum
+        lines, acc = [], 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            acc += n
+            le = _labels(self.labelnames, values, f'le="{_fmt(bound)}"')
+            lines.append(f"{self.name}_bucket{le} {acc}")
+        plain = _labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{plain} {_fmt(total)}")
+        lines.append(f"{self.name}_count{plain} {acc}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help: str, labelnames: Sequence[str], **kw):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kw)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"метрика {name} уже зарегистрирована с другим типом или метками")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- метрики сервиса ---
+
+CHAT_LATENCY = REGISTRY.histogram(
+    "orion_chat_request_seconds", "Полное время обработки запроса чата", ("endpoint", "status")
+)
+INFLIGHT = REGISTRY.gauge("orion_inflight_requests", "Запросы чата в обработке", ("endpoint",))
+ADMISSION_QUEUE = REGISTRY.gauge("orion_admission_queue_depth", "Запросы чата, ждущие слота допуска")
+ADMISSION_REJECTED = REGISTRY.counter(
+    "orion_admission_rejected_total", "Запросы чата без ответа: queue_full, timeout, disconnected", ("reason",)
+)
+HISTORY_LATENCY = REGISTRY.histogram("orion_history_seconds", "Операции HistoryRepository", ("op",))
+HISTORY_SIZE = REGISTRY.gauge("orion_history_size", "Размер истории в памяти", ("unit",))
+HISTORY_WRITE_FAILURES = REGISTRY.counter(
+    "orion_history_write_failures_total", "Сбои group commit истории: retried — повторено, lost — потеряно", ("outcome",)
+)
+RETRIEVER_LATENCY = REGISTRY.histogram(
+    "orion_retriever_seconds", "Стадии Retriever.retrieve: embed — эмбеддинг запроса, search — поиск", ("stage",)
+)
+RATELIMIT_WAIT = REGISTRY.histogram("orion_ratelimit_wait_seconds", "Ожидание жетона лимитера LLM", ("provider",))
+RATELIMIT_QUEUE = REGISTRY.gauge("orion_ratelimit_queue_depth", "Запросы, ждущие жетона лимитера", ("provider",))
+RATELIMIT_REJECTED = REGISTRY.counter(
+    "orion_ratelimit_rejected_total", "Отказы лимитера LLM (deadline, timeout, cancelled)", ("provider", "reason")
+)
+RATELIMIT_RATE = REGISTRY.gauge("orion_ratelimit_rate", "Текущая скорость лимитера провайдера, запросов/с", ("provider",))
+RATELIMIT_ADJUST = REGISTRY.counter("orion_ratelimit_decreases_total", "Снижения скорости после 429", ("provider",))
+LLM_LATENCY = REGISTRY.histogram(
+    "orion_llm_request_seconds", "Время вызова LLM (stream — до последнего куска)", ("provider", "model", "mode")
+)
+LLM_TTFT = REGISTRY.histogram("orion_llm_ttft_seconds", "Время до первого куска потокового ответа", ("provider", "model"))
+LLM_ERRORS = REGISTRY.counter("orion_llm_errors_total", "Ошибки вызовов LLM", ("provider", "model"))
+SINGLEFLIGHT = REGISTRY.counter(
+    "orion_singleflight_total", "Склейка одинаковых вызовов: leader — выполнен, shared — сэкономлен", ("scope", "role")
+)
+LLM_FAILOVER = REGISTRY.counter(
+    "orion_llm_backend_events_total", "События связки провайдеров: errors, hedges, cancelled, breaker_open", ("backend", "event")
+)
+LLM_RETRIES = REGISTRY.counter("orion_llm_retries_total", "Повторы запросов к LLM", ("provider",))
+LLM_TOKENS = REGISTRY.counter(
+    "orion_llm_tokens_total", "Токены промпта и ответа (оценка, если нет tiktoken)", ("model", "kind")
+)
+CACHE_EVENTS = REGISTRY.counter(
+    "orion_cache_requests_total", "Обращения к кэшам ответов: llm — точный, semantic — по смыслу", ("cache", "result")
+)
+
+
+def render() -> str:
+    return REGISTRY.render()
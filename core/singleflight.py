@@ -0,0 +1,134 @@
+# core/singleflight.py
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from core.metrics import SINGLEFLIGHT
+
+T = TypeVar("T")
+
+_INSTANCES: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+class _Counters:
+    def _init_counters(self, name: str) -> None:
+        self.name = name
+        self.leaders = 0
+        self.shared = 0  # сэкономленные вызовы: получили чужой результат
+        self._m_leader = SINGLEFLIGHT.labels(name, "leader")
+        self._m_shared = SINGLEFLIGHT.labels(name, "shared")
+        _INSTANCES.add(self)
+
+    def _count(self, leader: bool) -> None:
+        if leader:
+            self.leaders += 1
+            self._m_leader.inc()
+        else:
+            self.shared += 1
+            self._m_shared.inc()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "leaders": self.leaders, "shared": self.shared, "in_flight": len(self)}
+
+
+class _Call:
+    __slots__ = ("event", "result", "exc")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.exc: Optional[BaseException] = None
+
+
+class SingleFlight(_Counters):
+    """
+    Склейка одинаковых одновременных вызовов: первый по ключу (лидер) выполняет fn,
+    остальные ждут и получают тот же результат или то же исключение.
+    Завершённые вызовы не запоминаются — это не кэш.
+    """
+
+    def __init__(self, name: str = "default") -> None:
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._init_counters(name)
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self._count(leader)
+        if not leader:
+            call.event.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.exc = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Future[Any]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight(_Counters):
+    """
+    Асинхронный вариант: вызов лидера идёт отдельной задачей, поэтому отмена одного
+    ожидающего (клиент ушёл) не рвёт запрос остальным; задача отменяется, только когда
+    не осталось ни одного ожидающего.
+    """
+
+    def __init__(self, name: str = "default") -> None:
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._init_counters(name)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        # задачу чужого event loop (перезапуск lifespan, тесты) не ждём
+        leader = flight is None or flight.task.get_loop() is not loop
+        if leader:
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda _t, key=key, fl=flight: self._forget(key, fl))
+        self._count(leader)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+            raise
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # исключение забирают ожидающие; если их не осталось — не шумим «never retrieved»
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+
+def singleflight_stats() -> List[Dict[str, Any]]:
+    return [sf.stats() for sf in list(_INSTANCES)]
@@ -0,0 +1,119 @@
+# core/tokens.py
+from __future__ import annotations
+import math
+from functools import lru_cache
+from typing import Any, Iterable, List, Mapping, Optional, Sequence
+
+try:
+    import tiktoken  # type: ignore
+except ImportError:  # опционально: без него — оценка по байтам
+    tiktoken = None
+
+# Служебные токены ChatML на сообщение (role, разделители) — как считает OpenAI
+MESSAGE_OVERHEAD = 4
+
+# Окна контекста по префиксу имени модели; неизвестная модель — default из настроек
+_CONTEXT_WINDOWS = (
+    ("gpt-4o", 128_000),
+    ("gpt-4.1", 1_000_000),
+    ("gpt-4-turbo", 128_000),
+    ("gpt-3.5", 16_385),
+    ("deepseek", 64_000),
+    ("llama-3.1", 131_072),
+    ("llama-3.3", 131_072),
+    ("llama3", 8_192),
+    ("mixtral", 32_768),
+    ("qwen", 32_768),
+)
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: Optional[str]):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model or "")
+    except Exception:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Число токенов текста: tiktoken, если установлен, иначе оценка ~4 байта UTF-8 на токен
+    (латиница ≈ 4 символа, кириллица ≈ 2 символа на токен).
+    """
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def _count_key(model: Optional[str]) -> Optional[str]:
+    # Подсчёт зависит не от модели, а от её кодировки: модели с общей кодировкой делят кэш
+    enc = _encoding(model)
+    return enc.name if enc is not None else None
+
+
+def message_tokens(msg: Mapping[str, Any], model: Optional[str] = None) -> int:
+    """
+    Токены сообщения с учётом служебных. У Message из истории подсчёт кэшируется
+    парой (кодировка, число): при счёте под другую модель пересчитываем.
+    """
+    key = _count_key(model)
+    cached = getattr(msg, "tokens", None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    n = MESSAGE_OVERHEAD + count_tokens(str(msg.get("content") or ""), model)
+    if hasattr(msg, "tokens"):
+        try:
+            msg.tokens = (key, n)  # type: ignore[union-attr]
+        except AttributeError:
+            pass
+    return n
+
+
+def messages_tokens(messages: Iterable[Mapping[str, Any]], model: Optional[str] = None) -> int:
+    return sum(message_tokens(m, model) for m in messages)
+
+
+def context_window(model: Optional[str], default: int = 8192) -> int:
+    name = (model or "").lower().split("/")[-1]
+    for prefix, size in _CONTEXT_WINDOWS:
+        if name.startswith(prefix):
+            return size
+    return default
+
+
+def fit_to_budget(
+    messages: Sequence[Mapping[str, Any]],
+    budget: int,
+    model: Optional[str] = None,
+    pin_system: bool = True,
+) -> List[Mapping[str, Any]]:
+    """
+    Берёт сообщения с конца, пока сумма токенов укладывается в budget.
+    Последнее сообщение (текущий вопрос) попадает всегда, даже если одно превышает бюджет.
+    pin_system: ведущее system-сообщение (сводка старых ходов) резервируется первым.
+    """
+    head: List[Mapping[str, Any]] = []
+    if pin_system and len(messages) > 1 and messages[0].get("role") == "system":
+        n = message_tokens(messages[0], model)
+        if n <= budget - message_tokens(messages[-1], model):
+            head = [messages[0]]
+            budget -= n
+            messages = messages[1:]
+    out: List[Mapping[str, Any]] = []
+    used = 0
+    for msg in reversed(messages):
+        n = message_tokens(msg, model)
+        if out and used + n > budget:
+            break
+        out.append(msg)
+        used += n
+    out.reverse()
+    return head + out
@@ -0,0 +1,306 @@
+# core/tracing.py
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from core.logging import get_logger
+
+# Трасса запроса и текущий спан живут в contextvars: asyncio-задачи и asyncio.to_thread
+# наследуют их сами, поэтому id запроса доходит до ретривера и LLM без явной передачи
+_TRACE: ContextVar[Optional["Trace"]] = ContextVar("orion_trace", default=None)
+_SPAN: ContextVar[Optional["Span"]] = ContextVar("orion_span", default=None)
+
+_log = get_logger("trace")
+_exporter: Optional["OTLPFileExporter"] = None
+_log_spans = False
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_TIMING_NAME = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Trace:
+    """Завершённые спаны одного запроса — для заголовка Server-Timing."""
+
+    __slots__ = ("trace_id", "parent_id", "spans")
+
+    def __init__(self, trace_id: Optional[str] = None, parent_id: Optional[str] = None) -> None:
+        self.trace_id = trace_id or new_trace_id()
+        self.parent_id = parent_id  # спан вызывающей стороны из traceparent
+        self.spans: List["Span"] = []
+
+    def server_timing(self, total_ms: Optional[float] = None, limit: int = 16) -> str:
+        # Одноимённые спаны (например, ретраи LLM) суммируем
+        agg: Dict[str, float] = {}
+        for s in list(self.spans):
+            if s.parent_id == self.parent_id or s.duration_ms is None:
+                continue  # корневой спан — это total
+            name = _TIMING_NAME.sub("_", s.name)
+            agg[name] = agg.get(name, 0.0) + s.duration_ms
+        parts = [f"{name};dur={dur:.1f}" for name, dur in list(agg.items())[:limit]]
+        if total_ms is not None:
+            parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+
+class Span:
+    __slots__ = ("name", "trace", "trace_id", "span_id", "parent_id", "attrs", "start_ns", "t0", "duration_ms", "error", "_token", "_parent")
+
+    def __init__(self, name: str, trace: Optional[Trace], attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.trace = trace
+        self.attrs = attrs
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000.0
+
+    def __enter__(self) -> "Span":
+        parent = _SPAN.get()
+        if parent is not None:
+            self.trace_id, self.parent_id = parent.trace_id, parent.span_id
+        elif self.trace is not None:
+            self.trace_id, self.parent_id = self.trace.trace_id, self.trace.parent_id
+        else:
+            self.trace_id, self.parent_id = new_trace_id(), None
+        self.span_id = new_span_id()
+        self._parent = parent
+        self._token = _SPAN.set(self)
+        self.start_ns = time.time_ns()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration_ms = self.elapsed_ms()
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.error = exc_type.__name__
+        try:
+            _SPAN.reset(self._token)
+        except ValueError:
+            # генератор, который докрутили в другом потоке/контексте (iterate_in_threadpool)
+            _SPAN.set(self._parent)
+        if self.trace is not None:
+            self.trace.spans.append(self)
+        _emit(self)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms or 0.0, 3),
+            "error": self.error,
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+class _NoopSpan:
+    """Трассировка не нужна (нет запроса и экспорта) — спан ничего не стоит."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs: Any):
+    """
+    with span("retriever.search", k=3): ...
+    Вне запроса и без экспорта возвращает общий no-op, так что на горячем пути бесплатно.
+    """
+    trace = _TRACE.get()
+    if trace is None and _exporter is None and not _log_spans:
+        return _NOOP
+    return Span(name, trace, attrs)
+
+
+def current_ids() -> tuple[Optional[str], Optional[str]]:
+    """(trace_id, span_id) текущего контекста — для логов."""
+    s = _SPAN.get()
+    if s is not None:
+        return s.trace_id, s.span_id
+    trace = _TRACE.get()
+    return (trace.trace_id if trace is not None else None), None
+
+
+def _emit(s: Span) -> None:
+    if _log_spans and _log.isEnabledFor(20):
+        _log.info("span %s %.1f ms", s.name, s.duration_ms or 0.0, extra={"span": s.as_dict()})
+    if _exporter is not None:
+        _exporter.export(s)
+
+
+class OTLPFileExporter:
+    """
+    Спаны в файл JSON Lines в формате OTLP/JSON (ExportTraceServiceRequest на строку) —
+    как у file-экспортёра OpenTelemetry Collector; файл можно скормить коллектору или Jaeger.
+    Пишем пачками: batch спанов или раз в flush_interval секунд.
+    """
+
+    def __init__(self, path: str, service_name: str = "orionagent", batch: int = 64, flush_interval: float = 1.0) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.service_name = service_name
+        self.batch = max(1, int(batch))
+        self.flush_interval = float(flush_interval)
+        self._buf: List[Span] = []
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self._last_flush = time.monotonic()
+        self.exported = 0
+
+    def export(self, s: Span) -> None:
+        with self._lock:
+            self._buf.append(s)
+            if len(self._buf) >= self.batch or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._write_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_locked()
+            self._file.close()
+
+    def _write_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buf or self._file.closed:
+            return
+        spans, self._buf = self._buf, []
+        line = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attr("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "orionagent"}, "spans": [_otlp_span(s) for s in spans]}],
+            }]
+        }
+        self._file.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self.exported += len(spans)
+
+
+def _attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        v = {"boolValue": value}
+    elif isinstance(value, int):
+        v = {"intValue": str(value)}
+    elif isinstance(value, float):
+        v = {"doubleValue": value}
+    else:
+        v = {"stringValue": str(value)}
+    return {"key": key, "value": v}
+
+
+def _otlp_span(s: Span) -> Dict[str, Any]:
+    end = s.start_ns + int((s.duration_ms or 0.0) * 1_000_000)
+    out = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 1,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(end),
+        "attributes": [_attr(k, v) for k, v in s.attrs.items()],
+        # 1 — OK, 2 — ERROR
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    return out
+
+
+def configure(export_path: Optional[str] = None, log_spans: bool = False) -> None:
+    """Включает экспорт спанов в файл и/или в лог; повторный вызов заменяет экспортёр."""
+    global _exporter, _log_spans
+    shutdown()
+    _exporter = OTLPFileExporter(export_path) if export_path else None
+    _log_spans = bool(log_spans)
+
+
+def shutdown() -> None:
+    global _exporter
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
+
+
+def _parse_traceparent(value: Optional[str]) -> tuple[Optional[str], Optional[str]]:
+    m = _TRACEPARENT.match((value or "").strip().lower())
+    return (m.group(1), m.group(2)) if m else (None, None)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI-middleware: трасса на HTTP-запрос (trace id из W3C traceparent или новый),
+    корневой спан и заголовки Server-Timing (суммы спанов по имени) и X-Trace-Id.
+    Для потоковых ответов заголовок уходит в начале — в нём только то, что успело завершиться.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or ())
+        trace_id, parent_id = _parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        trace = Trace(trace_id, parent_id)
+        root = Span(f"{scope.get('method', 'HTTP')} {scope.get('path', '')}", trace, {"http.method": scope.get("method")})
+
+        async def send_with_timing(message) -> None:
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message.get("status"))
+                extra = [
+                    (b"server-timing", trace.server_timing(total_ms=root.elapsed_ms()).encode("latin-1")),
+                    (b"x-trace-id", trace.trace_id.encode("latin-1")),
+                ]
+                message = {**message, "headers": [*message.get("headers", ()), *extra]}
+            await send(message)
+
+        token = _TRACE.set(trace)
+        try:
+            with root:
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            _TRACE.reset(token)
+
+
+class TraceContextFilter:
+    """logging.Filter: добавляет trace_id/span_id в каждую запись лога."""
+
+    def filter(self, record) -> bool:
+        trace_id, span_id = current_ids()
+        record.trace_id = trace_id
+        record.span_id = span_id
+        return True
@@ -1,5 +1,7 @@
 from .base import BaseEmbedder
 from .hf_embedder import HFEmbedder
+from .batching import BatchingEmbedder
+from .cache import CachedEmbedder
 from .factory import make_embedder
 
-__all__ = ["BaseEmbedder", "HFEmbedder", "make_embedder"]
+__all__ = ["BaseEmbedder", "HFEmbedder", "BatchingEmbedder", "CachedEmbedder", "make_embedder"]
@@ -21,3 +21,25 @@ class BaseEmbedder(ABC):
     @abstractmethod
     def as_langchain(self) -> SupportsLangChainEmbedding:
         ...
+
+
+try:
+    from langchain_core.embeddings import Embeddings as _LCEmbeddings
+except ImportError:  # без langchain достаточно утиной типизации
+    _LCEmbeddings = object  # type: ignore
+
+
+class LangChainView(_LCEmbeddings):  # type: ignore[misc, valid-type]
+    """
+    Представление обёртки (батчинг, кэш) как LangChain Embeddings,
+    чтобы сторы LangChain ходили через неё, а не напрямую в модель.
+    """
+
+    def __init__(self, owner: BaseEmbedder) -> None:
+        self._owner = owner
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._owner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._owner.embed_query(text)
@@ -0,0 +1,142 @@
+# embedder/batching.py
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base import BaseEmbedder, LangChainView, SupportsLangChainEmbedding
+
+try:
+    from core.logging import get_logger  # type: ignore
+except ImportError:
+    import logging
+    get_logger = logging.getLogger
+
+
+_Item = Tuple[str, "Future[List[float]]", float]
+
+
+class BatchingEmbedder(BaseEmbedder):
+    """
+    Микробатчинг запросов: конкурентные embed_query копятся в очереди в течение window_ms
+    (или до max_batch) и считаются одним embed_documents на выделенном потоке.
+    """
+
+    def __init__(self, inner: BaseEmbedder, max_batch: int = 32, window_ms: float = 5.0) -> None:
+        self.inner = inner
+        self.max_batch = max(1, int(max_batch))
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.log = get_logger("BatchingEmbedder")
+
+        self._queue: "queue.Queue[Optional[_Item]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self.batch_sizes: Dict[int, int] = {}
+        self.batches = 0
+        self.items = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedder-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self, first: _Item) -> List[_Item]:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # сигнал остановки — вернём его в очередь, чтобы цикл завершился после батча
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            started = time.monotonic()
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = self.inner.embed_documents(texts)
+            except BaseException as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+            else:
+                if len(vectors) != len(batch):
+                    err = RuntimeError(f"embed_documents вернул {len(vectors)} векторов на {len(batch)} текстов")
+                    for _, fut, _ in batch:
+                        fut.set_exception(err)
+                else:
+                    for (_, fut, _), vec in zip(batch, vectors):
+                        fut.set_result(vec)
+            self._record(batch, started)
+
+    def _record(self, batch: List[_Item], started: float) -> None:
+        with self._stats_lock:
+            n = len(batch)
+            self.batches += 1
+            self.items += n
+            self.batch_sizes[n] = self.batch_sizes.get(n, 0) + 1
+            for _, _, enqueued in batch:
+                wait = (started - enqueued) * 1000.0
+                self.wait_ms_total += wait
+                self.wait_ms_max = max(self.wait_ms_max, wait)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._ensure_worker()
+        fut: "Future[List[float]]" = Future()
+        self._queue.put((text, fut, time.monotonic()))
+        return fut.result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Документы и так приходят пачкой — отдаём напрямую
+        return self.inner.embed_documents(texts)
+
+    def as_langchain(self) -> SupportsLangChainEmbedding:
+        # Отдаём обёртку над собой, иначе сторы LangChain обходили бы батчинг
+        return LangChainView(self)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch": (self.items / self.batches) if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "queue_wait_ms_avg": (self.wait_ms_total / self.items) if self.items else 0.0,
+                "queue_wait_ms_max": self.wait_ms_max,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self) -> None:
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout=5)
+            self._worker = None
+
+    def __getattr__(self, name: str) -> Any:
+        # model_name, normalize и прочие атрибуты обёрнутого эмбеддера
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def __repr__(self) -> str:
+        return f"BatchingEmbedder({self.inner!r}, max_batch={self.max_batch}, window_ms={self.window * 1000.0:g})"
@@ -0,0 +1,214 @@
+# embedder/cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .base import BaseEmbedder, LangChainView, SupportsLangChainEmbedding
+
+_DIGEST = 32  # sha256
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class DiskEmbeddingStore:
+    """
+    Контентно-адресуемое хранилище векторов документов на диске:
+    - keys.bin    — подряд идущие sha256 текстов (32 байта на строку);
+    - vectors.f32 — float32-матрица тех же строк, читается через np.memmap без копирования;
+    - meta.json   — модель, нормализация, размерность.
+    Только дозапись: сначала векторы, потом ключи; хвост оборванной записи обрезается при открытии.
+    """
+
+    def __init__(self, directory: str, meta: Dict[str, Any]) -> None:
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._keys_path = self.dir / "keys.bin"
+        self._vec_path = self.dir / "vectors.f32"
+        self._meta_path = self.dir / "meta.json"
+        self._lock = threading.Lock()
+        self.meta = dict(meta)
+
+        if self._meta_path.exists():
+            stored = json.loads(self._meta_path.read_text(encoding="utf-8"))
+            for k in ("model", "normalize"):
+                if stored.get(k) != self.meta.get(k):
+                    raise ValueError(f"Кэш эмбеддингов {self.dir} создан для {k}={stored.get(k)!r}")
+            self.meta["dim"] = stored.get("dim")
+        self.dim: Optional[int] = self.meta.get("dim")
+
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self._mmap: Optional[np.memmap] = None
+        self._load()
+
+    def _load(self) -> None:
+        if not self._keys_path.exists() or not self.dim:
+            return
+        keys = self._keys_path.read_bytes()
+        n_keys = len(keys) // _DIGEST
+        n_vecs = (self._vec_path.stat().st_size // (4 * self.dim)) if self._vec_path.exists() else 0
+        self._rows = min(n_keys, n_vecs)
+        # Оборванная запись оставляет «лишние» строки в одном из файлов (или хвост неполной строки).
+        # Обрезаем оба до общего числа строк, иначе следующая дозапись сдвинет векторы относительно ключей
+        if len(keys) != self._rows * _DIGEST:
+            with open(self._keys_path, "r+b") as f:
+                f.truncate(self._rows * _DIGEST)
+                os.fsync(f.fileno())
+            keys = keys[: self._rows * _DIGEST]
+        if self._vec_path.exists() and self._vec_path.stat().st_size != self._rows * self.dim * 4:
+            with open(self._vec_path, "r+b") as f:
+                f.truncate(self._rows * self.dim * 4)
+                os.fsync(f.fileno())
+        for row in range(self._rows):
+            self._index[keys[row * _DIGEST:(row + 1) * _DIGEST]] = row
+
+    def _matrix(self) -> np.ndarray:
+        # Перемапливаем только если файл вырос с прошлого раза
+        if self._mmap is None or self._mmap.shape[0] < self._rows:
+            self._mmap = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+        return self._mmap
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def get_many(self, digests: List[bytes]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            rows = [self._index.get(d) for d in digests]
+            if self._rows == 0 or all(r is None for r in rows):
+                return [None] * len(digests)
+            m = self._matrix()
+            return [m[r] if r is not None else None for r in rows]
+
+    def put_many(self, digests: List[bytes], vectors: np.ndarray) -> None:
+        if not digests:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self.meta["dim"] = self.dim
+                self._meta_path.write_text(json.dumps(self.meta, ensure_ascii=False), encoding="utf-8")
+            fresh = [i for i, d in enumerate(digests) if d not in self._index]
+            if not fresh:
+                return
+            with open(self._vec_path, "ab") as f:
+                f.write(vectors[fresh].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(digests[i] for i in fresh))
+            for i in fresh:
+                self._index[digests[i]] = self._rows
+                self._rows += 1
+
+
+class CachedEmbedder(BaseEmbedder):
+    """
+    Кэш эмбеддингов по (model_name, normalize, sha256(text)):
+    запросы — горячий LRU в памяти, документы — DiskEmbeddingStore на диске.
+    Переиндексация неизменного корпуса не вызывает модель вовсе.
+    """
+
+    def __init__(
+        self,
+        inner: BaseEmbedder,
+        model_name: str,
+        normalize: bool,
+        cache_dir: Optional[str] = None,
+        query_cache_size: int = 4096,
+    ) -> None:
+        self.inner = inner
+        self.model_name = model_name
+        self.normalize = bool(normalize)
+        self.query_cache_size = max(0, int(query_cache_size))
+        self._queries: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._qlock = threading.Lock()
+
+        self.store: Optional[DiskEmbeddingStore] = None
+        if cache_dir:
+            ns = hashlib.sha256(f"{model_name}|{self.normalize}".encode("utf-8")).hexdigest()[:16]
+            self.store = DiskEmbeddingStore(
+                str(Path(cache_dir) / ns),
+                meta={"model": model_name, "normalize": self.normalize},
+            )
+
+        self.query_hits = 0
+        self.query_misses = 0
+        self.doc_hits = 0
+        self.doc_misses = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        key = text_digest(text)
+        with self._qlock:
+            vec = self._queries.get(key)
+            if vec is not None:
+                self._queries.move_to_end(key)
+                self.query_hits += 1
+                return vec
+            self.query_misses += 1
+        vec = self.inner.embed_query(text)
+        if self.query_cache_size:
+            with self._qlock:
+                self._queries[key] = vec
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        return vec
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.store is None:
+            return self.inner.embed_documents(texts)
+
+        digests = [text_digest(t) for t in texts]
+        found = self.store.get_many(digests)
+
+        # Уникальные промахи: одинаковые тексты в батче считаем один раз (dict хранит порядок)
+        missing: Dict[bytes, str] = {}
+        for d, t, v in zip(digests, texts, found):
+            if v is None:
+                missing.setdefault(d, t)
+        pos = {d: i for i, d in enumerate(missing)}
+
+        fresh: Optional[np.ndarray] = None
+        if missing:
+            fresh = np.asarray(self.inner.embed_documents(list(missing.values())), dtype=np.float32)
+            self.store.put_many(list(missing), fresh)
+
+        self.doc_hits += sum(v is not None for v in found)
+        self.doc_misses += len(missing)
+
+        out: List[List[float]] = []
+        for d, v in zip(digests, found):
+            row = v if v is not None else fresh[pos[d]]  # type: ignore[index]
+            out.append(row.tolist())
+        return out
+
+    def as_langchain(self) -> SupportsLangChainEmbedding:
+        return LangChainView(self)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "query_hits": self.query_hits,
+            "query_misses": self.query_misses,
+            "query_entries": len(self._queries),
+            "doc_hits": self.doc_hits,
+            "doc_misses": self.doc_misses,
+            "doc_rows": len(self.store) if self.store is not None else 0,
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def __repr__(self) -> str:
+        return f"CachedEmbedder({self.inner!r}, dir={self.store.dir if self.store else None})"
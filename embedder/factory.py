@@ -4,6 +4,8 @@ from typing import Optional
 
 from .base import BaseEmbedder
 from .hf_embedder import HFEmbedder  # предполагаем, что доступен
+from .batching import BatchingEmbedder
+from .cache import CachedEmbedder
 
 try:
     # Ленивая загрузка конфигурации из core
@@ -26,6 +28,8 @@ def make_embedder(
     model_name: Optional[str] = None,
     device: Optional[str] = None,
     normalize_embeddings: Optional[bool] = None,
+    batching: Optional[bool] = None,
+    cache: Optional[bool] = None,
 ) -> BaseEmbedder:
     if settings is not None:
         model_name = model_name or getattr(settings, "EMB_MODEL", "sentence-transformers/all-mpnet-base-v2")
@@ -44,8 +48,31 @@ def make_embedder(
     if not isinstance(device, str) or not device:
         raise ValueError("Некорректный EMB_DEVICE: ожидается непустая строка")
 
-    return HFEmbedder(
+    emb: BaseEmbedder = HFEmbedder(
         model_name=model_name,
         device=device,
         normalize_embeddings=bool(normalize_embeddings),
     )
+
+    if batching is None:
+        batching = _to_bool(getattr(settings, "EMB_BATCHING", False) if settings is not None else False)
+    if batching:
+        emb = BatchingEmbedder(
+            emb,
+            max_batch=int(getattr(settings, "EMB_BATCH_MAX", 32) if settings is not None else 32),
+            window_ms=float(getattr(settings, "EMB_BATCH_WINDOW_MS", 5.0) if settings is not None else 5.0),
+        )
+
+    # Кэш — внешний слой: попадание не должно стоять в очереди батчера
+    if cache is None:
+        cache = _to_bool(getattr(settings, "EMB_CACHE", False) if settings is not None else False)
+    if cache:
+        emb = CachedEmbedder(
+            emb,
+            model_name=model_name,
+            normalize=bool(normalize_embeddings),
+            cache_dir=(getattr(settings, "EMB_CACHE_DIR", "./emb_cache") if settings is not None else "./emb_cache") or None,
+            query_cache_size=int(getattr(settings, "EMB_QUERY_CACHE_SIZE", 4096) if settings is not None else 4096),
+        )
+
+    return emb
@@ -1,13 +1,61 @@
-from .base import BaseLLM
-from .openai_compat import OpenAICompatLLM
-from .decorators import LoggingLLM, RetryingLLM, RateLimitLLM
-from .factory import make_llm
+from .base import BaseLLM, AsyncBaseLLM
+from .openai_compat import OpenAICompatLLM, AsyncOpenAICompatLLM
+from .decorators import (
+    LoggingLLM,
+    RetryingLLM,
+    RateLimitLLM,
+    AsyncLoggingLLM,
+    AsyncRetryingLLM,
+    AsyncRateLimitLLM,
+    CachingLLM,
+    AsyncCachingLLM,
+    CoalescingLLM,
+    AsyncCoalescingLLM,
+)
+from .cache import CacheBackend, MemoryCache, SQLiteCache
+from .transport import HTTPPool
+from .ratelimit import AIMDController, RateLimiter, RateLimitExceeded, rate_limit_key
+from .errors import ErrorClass, classify, is_retryable
+from .failover import AsyncFailoverLLM, AsyncHedgedLLM, CircuitBreaker, FailoverLLM, HedgedLLM, NoBackendAvailable
+from .factory import make_llm, make_async_llm, get_pool, pool_stats, get_limiter, limiter_stats, failover_stats
 
 __all__ = [
     "BaseLLM",
+    "AsyncBaseLLM",
     "OpenAICompatLLM",
+    "AsyncOpenAICompatLLM",
     "LoggingLLM",
     "RetryingLLM",
     "RateLimitLLM",
+    "AsyncLoggingLLM",
+    "AsyncRetryingLLM",
+    "AsyncRateLimitLLM",
+    "CachingLLM",
+    "AsyncCachingLLM",
+    "CoalescingLLM",
+    "AsyncCoalescingLLM",
+    "CacheBackend",
+    "MemoryCache",
+    "SQLiteCache",
+    "HTTPPool",
+    "RateLimiter",
+    "RateLimitExceeded",
+    "rate_limit_key",
+    "AIMDController",
+    "ErrorClass",
+    "classify",
+    "is_retryable",
+    "FailoverLLM",
+    "HedgedLLM",
+    "AsyncFailoverLLM",
+    "AsyncHedgedLLM",
+    "CircuitBreaker",
+    "NoBackendAvailable",
     "make_llm",
+    "make_async_llm",
+    "get_pool",
+    "pool_stats",
+    "get_limiter",
+    "limiter_stats",
+    "failover_stats",
 ]
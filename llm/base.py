@@ -1,6 +1,6 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import List
+from typing import AsyncIterator, Iterator, List
 
 
 class BaseLLM(ABC):
@@ -8,3 +8,24 @@ class BaseLLM(ABC):
     @abstractmethod
     def chat(self, messages: List[dict]) -> str:
         ...
+
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        # По умолчанию — «поток» из одного куска; клиенты со стримингом переопределяют
+        yield self.chat(messages)
+
+
+class AsyncBaseLLM(ABC):
+    """
+    Асинхронный вариант BaseLLM: вызов не держит поток на время сетевого ожидания.
+    """
+
+    @abstractmethod
+    async def chat(self, messages: List[dict]) -> str:
+        ...
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        yield await self.chat(messages)
+
+    async def aclose(self) -> None:
+        # Освобождение сетевых ресурсов (по умолчанию нечего закрывать)
+        return None
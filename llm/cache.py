@@ -0,0 +1,174 @@
+# llm/cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def cache_key(messages: List[dict], model: str, temperature: float, top_p: float) -> str:
+    """
+    Канонический ключ ответа: sha256 от сообщений (только role/content/name) и параметров семплинга.
+    Служебные поля истории (метки времени и т.п.) в ключ не попадают.
+    """
+    canon = [
+        {k: m[k] for k in ("role", "content", "name") if m.get(k) is not None}
+        for m in messages
+    ]
+    blob = json.dumps(
+        {"m": canon, "model": model, "t": round(float(temperature), 4), "p": round(float(top_p), 4)},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CacheBackend(ABC):
+    def __init__(self) -> None:
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def close(self) -> None:
+        return None
+
+
+class MemoryCache(CacheBackend):
+    """
+    LRU в памяти с TTL. Просроченные записи удаляются при обращении и вытеснении.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 3600.0) -> None:
+        super().__init__()
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if self.ttl is not None and expires < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Кэш на диске (SQLite) — переживает перезапуск процесса. LRU по времени последнего чтения.
+    """
+
+    def __init__(self, path: str = "./llm_cache.sqlite3", max_entries: int = 100_000, ttl: Optional[float] = 86400.0) -> None:
+        super().__init__()
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl if ttl and ttl > 0 else None
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_used ON llm_cache(used)")
+        # Размер держим в памяти, чтобы не делать COUNT(*) на каждую запись
+        (self._count,) = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and created + self.ttl < now:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._count -= 1
+                self.evictions += 1
+                return None
+            self._db.execute("UPDATE llm_cache SET used = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            exists = self._db.execute("SELECT 1 FROM llm_cache WHERE key = ?", (key,)).fetchone() is not None
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache(key, value, created, used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if not exists:
+                self._count += 1
+            extra = self._count - self.max_entries
+            if extra > 0:
+                self._db.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY used LIMIT ?)",
+                    (extra,),
+                )
+                self._count -= extra
+                self.evictions += extra
+
+    def __len__(self) -> int:
+        return int(self._count)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CacheStats:
+    """
+    Счётчики кэша, общие для sync- и async-декораторов.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.bypass = 0
+
+    def as_dict(self, backend: CacheBackend) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypass": self.bypass,
+            "evictions": backend.evictions,
+            "entries": len(backend),
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -1,12 +1,18 @@
 # llm/decorators.py
 from __future__ import annotations
 
+import asyncio
 import time
-import threading
 import random
-from typing import List, Optional, Callable
+from typing import AsyncIterator, Iterator, List, Optional, Callable
 
-from .base import BaseLLM
+from .base import BaseLLM, AsyncBaseLLM
+from .cache import CacheBackend, CacheStats, MemoryCache, cache_key
+from .errors import classify
+from .ratelimit import AIMDController, RateLimiter, RateLimitExceeded, current_rate_key
+from core.singleflight import AsyncSingleFlight, SingleFlight
+from core.tracing import span
+from core.metrics import CACHE_EVENTS, LLM_ERRORS, LLM_LATENCY, LLM_RETRIES, LLM_TTFT
 
 try:
     from core.logging import get_logger  # type: ignore
@@ -15,6 +21,31 @@ except ImportError:
     get_logger = logging.getLogger
 
 
+def _observe_provider(
+    limiter: RateLimiter, controller: Optional[AIMDController], provider: str, exc: Optional[Exception]
+) -> None:
+    # Обратная связь от провайдера: 429 и Retry-After замедляют весь провайдер, успех — ускоряет
+    if exc is None:
+        if controller is not None:
+            controller.on_success()
+        return
+    info = classify(exc)
+    if not info.throttled or isinstance(exc, RateLimitExceeded):
+        return
+    if controller is not None:
+        controller.on_throttle(info.retry_after)
+    elif info.retry_after:
+        limiter.pause_provider(provider, info.retry_after)
+
+
+def _bind_llm_metrics(obj: object, provider: str, model: str) -> None:
+    # Метки известны при сборке клиента — берём дочерние метрики один раз, не на каждый вызов
+    obj._m_chat = LLM_LATENCY.labels(provider, model, "chat")
+    obj._m_stream = LLM_LATENCY.labels(provider, model, "stream")
+    obj._m_ttft = LLM_TTFT.labels(provider, model)
+    obj._m_errors = LLM_ERRORS.labels(provider, model)
+
+
 class LoggingLLM(BaseLLM):
     """
     Декоратор, который логирует вызовы LLM.
@@ -26,11 +57,15 @@ class LoggingLLM(BaseLLM):
         name: str = "LLM",
         max_preview: int = 200,
         return_on_error: Optional[str] = "",
+        provider: str = "",
+        model: str = "",
     ) -> None:
         self.inner = inner
         self.log = get_logger(name)
         self.max_preview = max_preview
         self.return_on_error = return_on_error
+        _bind_llm_metrics(self, provider, model)
+        self.provider, self.model_label = provider, model
 
     def chat(self, messages: List[dict]) -> str:
         try:
@@ -40,18 +75,94 @@ class LoggingLLM(BaseLLM):
                 last = messages[-1]
                 preview = (last.get("content") or "")[: self.max_preview].replace("\n", " ")
             self.log.info("-> chat(%s msg) last=%r", len(messages), preview)
-            out = self.inner.chat(messages)
+            with span("llm.chat", provider=self.provider, model=self.model_label, messages=len(messages)):
+                out = self.inner.chat(messages)
             dt = (time.perf_counter() - t0) * 1000.0
+            self._m_chat.observe(dt / 1000.0)
             self.log.info("<- chat(%d chars) in %.1f ms", len(out or ""), dt)
             return out
+        except RateLimitExceeded:
+            # Перегрузку не маскируем пустым ответом — её отдают клиенту как 429
+            raise
         except Exception:
+            self._m_errors.inc()
             self.log.exception("LLM error")
             if self.return_on_error is None:
                 raise
             return self.return_on_error
 
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        t0 = time.perf_counter()
+        ttft: Optional[float] = None
+        size = 0
+        try:
+            self.log.info("-> chat_stream(%s msg)", len(messages))
+            with span("llm.stream", provider=self.provider, model=self.model_label) as sp:
+                for piece in self.inner.chat_stream(messages):
+                    if ttft is None:
+                        ttft = (time.perf_counter() - t0) * 1000.0
+                        self._m_ttft.observe(ttft / 1000.0)
+                        sp.set("ttft_ms", round(ttft, 1))
+                    size += len(piece)
+                    yield piece
+            dt = (time.perf_counter() - t0) * 1000.0
+            self._m_stream.observe(dt / 1000.0)
+            self.log.info("<- chat_stream(%d chars) ttft %.1f ms, total %.1f ms", size, ttft or dt, dt)
+        except RateLimitExceeded:
+            raise
+        except Exception:
+            self._m_errors.inc()
+            self.log.exception("LLM stream error")
+            # После первого куска обрыв пробрасываем: иначе половина ответа ушла бы в историю и кэш как полная
+            if self.return_on_error is None or ttft is not None:
+                raise
+            if self.return_on_error:
+                yield self.return_on_error
+
+
+class _RetryPolicy:
+    """
+    Общая часть RetryingLLM/AsyncRetryingLLM: что повторять и сколько ждать.
+    По умолчанию повторяем только то, что может пройти (429, 5xx, таймауты, сеть);
+    Retry-After провайдера важнее собственного бэкоффа, но дольше max_retry_after не ждём.
+    """
+
+    def _init_retry(
+        self,
+        attempts: int,
+        backoff: float,
+        max_backoff: float,
+        retry_if: Optional[Callable[[Exception], bool]],
+        provider: str,
+        max_retry_after: float,
+    ) -> None:
+        self.attempts = max(1, int(attempts))
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.retry_if = retry_if
+        self.max_retry_after = float(max_retry_after)
+        self.log = get_logger("RetryingLLM")
+        self._m_retries = LLM_RETRIES.labels(provider)
+
+    def _sleep_for(self, e: Exception, attempt: int, delay: float) -> Optional[float]:
+        """Пауза перед следующей попыткой; None — не повторяем."""
+        if attempt >= self.attempts:
+            return None
+        info = classify(e)
+        if not (self.retry_if(e) if self.retry_if is not None else info.retryable):
+            return None
+        # Экспоненциальный бэкофф с лёгким джиттером
+        sleep_for = min(delay, self.max_backoff) * (0.8 + 0.4 * random.random())
+        if info.retry_after is not None:
+            if info.retry_after > self.max_retry_after:
+                return None
+            sleep_for = max(sleep_for, info.retry_after)
+        self.log.warning("Retry %d/%d in %.2fs after error: %s", attempt, self.attempts, sleep_for, e)
+        self._m_retries.inc()
+        return sleep_for
+
 
-class RetryingLLM(BaseLLM):
+class RetryingLLM(_RetryPolicy, BaseLLM):
     """
     Декоратор, который повторяет запрос при ошибках
     """
@@ -63,63 +174,485 @@ class RetryingLLM(BaseLLM):
         backoff: float = 0.7,
         max_backoff: float = 4.0,
         retry_if: Optional[Callable[[Exception], bool]] = None,
+        provider: str = "",
+        max_retry_after: float = 30.0,
     ) -> None:
         self.inner = inner
-        self.attempts = max(1, int(attempts))
-        self.backoff = float(backoff)
-        self.max_backoff = float(max_backoff)
-        self.retry_if = retry_if
-        self.log = get_logger("RetryingLLM")
+        self._init_retry(attempts, backoff, max_backoff, retry_if, provider, max_retry_after)
 
     def chat(self, messages: List[dict]) -> str:
         delay = self.backoff
-        last_exc: Optional[Exception] = None
         for i in range(1, self.attempts + 1):
             try:
                 return self.inner.chat(messages)
+            except RateLimitExceeded:
+                # Повтор только удлинил бы очередь, которую лимитер уже счёл слишком длинной
+                raise
+            except Exception as e:
+                sleep_for = self._sleep_for(e, i, delay)
+                if sleep_for is None:
+                    raise
+                with span("llm.retry_backoff", attempt=i, error=type(e).__name__):
+                    time.sleep(sleep_for)
+                delay *= 2.0
+        raise RuntimeError("Unknown LLM error")
+
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        # Повторяем только пока клиенту ничего не отдано — иначе он получил бы дубли
+        delay = self.backoff
+        for i in range(1, self.attempts + 1):
+            started = False
+            try:
+                for piece in self.inner.chat_stream(messages):
+                    started = True
+                    yield piece
+                return
+            except RateLimitExceeded:
+                raise
             except Exception as e:
-                last_exc = e
-                # Если предикат задан и запрещает ретрай — выходим сразу
-                if self.retry_if is not None and not self.retry_if(e):
-                    break
-                if i == self.attempts:
-                    break
-                self.log.warning("Retry %d/%d after error: %s", i, self.attempts, e)
-                # Экспоненциальный бэкофф с лёгким джиттером
-                sleep_for = min(delay, self.max_backoff) * (0.8 + 0.4 * random.random())
-                time.sleep(sleep_for)
+                sleep_for = None if started else self._sleep_for(e, i, delay)
+                if sleep_for is None:
+                    raise
+                with span("llm.retry_backoff", attempt=i, error=type(e).__name__):
+                    time.sleep(sleep_for)
                 delay *= 2.0
-        # Если сюда попали все попытки исчерпаны или ретрай запрещён
-        raise last_exc or RuntimeError("Unknown LLM error")
 
 
 class RateLimitLLM(BaseLLM):
-    def __init__(self, inner: BaseLLM, rps: float = 2.0, burst: int = 2) -> None:
-        if rps <= 0:
+    """
+    Декоратор-лимитер. Без limiter заводит собственный (rps/burst на уровне провайдера);
+    фабрика передаёт общий на процесс RateLimiter с глобальным и пользовательским уровнями.
+    Ответы провайдера уходят в controller (AIMD): 429 снижает скорость, успехи — поднимают.
+    """
+
+    def __init__(
+        self,
+        inner: BaseLLM,
+        rps: float = 2.0,
+        burst: int = 2,
+        provider: str = "",
+        limiter: Optional[RateLimiter] = None,
+        max_wait: Optional[float] = None,
+        controller: Optional[AIMDController] = None,
+    ) -> None:
+        if limiter is None and rps <= 0:
             raise ValueError("rps must be > 0")
         self.inner = inner
-        self.capacity = max(1, int(burst))  # максимальное число жетонов в бакете
-        self.tokens = float(self.capacity)  # текущее число жетонов
-        self.rate = float(rps)              # скорость пополнения жетонов в секунду
-        self.lock = threading.Lock()
-        self.last = time.monotonic()
-
-    def _acquire(self) -> None:
-        while True:
-            with self.lock:
-                now = time.monotonic()
-                elapsed = now - self.last
-                self.last = now
-                # пополняем бакет
-                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
-                if self.tokens >= 1.0:
-                    self.tokens -= 1.0
-                    return
-                # не хватает жетонов — посчитаем, сколько ждать
-                need = (1.0 - self.tokens) / self.rate
-            # небольшой джиттер, чтобы потоки не просыпались синхронно
-            time.sleep(max(need, 0.01) * (0.9 + 0.2 * random.random()))
+        self.provider = provider
+        self.limiter = limiter or RateLimiter(provider_rate=rps, provider_burst=burst, max_wait=max_wait)
+        self.controller = controller
+
+    def _observe(self, exc: Optional[Exception]) -> None:
+        _observe_provider(self.limiter, self.controller, self.provider, exc)
 
     def chat(self, messages: List[dict]) -> str:
-        self._acquire()
-        return self.inner.chat(messages)
+        with span("llm.ratelimit", key=current_rate_key() or ""):
+            self.limiter.acquire(self.provider)
+        try:
+            out = self.inner.chat(messages)
+        except Exception as e:
+            self._observe(e)
+            raise
+        self._observe(None)
+        return out
+
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        with span("llm.ratelimit", key=current_rate_key() or ""):
+            self.limiter.acquire(self.provider)
+        try:
+            yield from self.inner.chat_stream(messages)
+        except Exception as e:
+            self._observe(e)
+            raise
+        self._observe(None)
+
+
+class AsyncLoggingLLM(AsyncBaseLLM):
+    """
+    Асинхронный вариант LoggingLLM.
+    """
+
+    def __init__(
+        self,
+        inner: AsyncBaseLLM,
+        name: str = "LLM",
+        max_preview: int = 200,
+        return_on_error: Optional[str] = "",
+        provider: str = "",
+        model: str = "",
+    ) -> None:
+        self.inner = inner
+        self.log = get_logger(name)
+        self.max_preview = max_preview
+        self.return_on_error = return_on_error
+        _bind_llm_metrics(self, provider, model)
+        self.provider, self.model_label = provider, model
+
+    async def chat(self, messages: List[dict]) -> str:
+        try:
+            t0 = time.perf_counter()
+            preview = ""
+            if messages:
+                last = messages[-1]
+                preview = (last.get("content") or "")[: self.max_preview].replace("\n", " ")
+            self.log.info("-> chat(%s msg) last=%r", len(messages), preview)
+            with span("llm.chat", provider=self.provider, model=self.model_label, messages=len(messages)):
+                out = await self.inner.chat(messages)
+            dt = (time.perf_counter() - t0) * 1000.0
+            self._m_chat.observe(dt / 1000.0)
+            self.log.info("<- chat(%d chars) in %.1f ms", len(out or ""), dt)
+            return out
+        except (asyncio.CancelledError, RateLimitExceeded):
+            # Отмену (клиент ушёл, таймаут) и перегрузку лимитера не превращаем в пустой ответ
+            raise
+        except Exception:
+            self._m_errors.inc()
+            self.log.exception("LLM error")
+            if self.return_on_error is None:
+                raise
+            return self.return_on_error
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        t0 = time.perf_counter()
+        ttft: Optional[float] = None
+        size = 0
+        try:
+            self.log.info("-> chat_stream(%s msg)", len(messages))
+            with span("llm.stream", provider=self.provider, model=self.model_label) as sp:
+                async for piece in self.inner.chat_stream(messages):
+                    if ttft is None:
+                        ttft = (time.perf_counter() - t0) * 1000.0
+                        self._m_ttft.observe(ttft / 1000.0)
+                        sp.set("ttft_ms", round(ttft, 1))
+                    size += len(piece)
+                    yield piece
+            dt = (time.perf_counter() - t0) * 1000.0
+            self._m_stream.observe(dt / 1000.0)
+            self.log.info("<- chat_stream(%d chars) ttft %.1f ms, total %.1f ms", size, ttft or dt, dt)
+        except RateLimitExceeded:
+            raise
+        except Exception:
+            self._m_errors.inc()
+            self.log.exception("LLM stream error")
+            if self.return_on_error is None or ttft is not None:
+                raise
+            if self.return_on_error:
+                yield self.return_on_error
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class AsyncRetryingLLM(_RetryPolicy, AsyncBaseLLM):
+    """
+    Асинхронный вариант RetryingLLM: бэкофф через asyncio.sleep, поток не блокируется.
+    """
+
+    def __init__(
+        self,
+        inner: AsyncBaseLLM,
+        attempts: int = 3,
+        backoff: float = 0.7,
+        max_backoff: float = 4.0,
+        retry_if: Optional[Callable[[Exception], bool]] = None,
+        provider: str = "",
+        max_retry_after: float = 30.0,
+    ) -> None:
+        self.inner = inner
+        self._init_retry(attempts, backoff, max_backoff, retry_if, provider, max_retry_after)
+
+    async def chat(self, messages: List[dict]) -> str:
+        delay = self.backoff
+        for i in range(1, self.attempts + 1):
+            try:
+                return await self.inner.chat(messages)
+            except RateLimitExceeded:
+                raise
+            except Exception as e:
+                sleep_for = self._sleep_for(e, i, delay)
+                if sleep_for is None:
+                    raise
+                with span("llm.retry_backoff", attempt=i, error=type(e).__name__):
+                    await asyncio.sleep(sleep_for)
+                delay *= 2.0
+        raise RuntimeError("Unknown LLM error")
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        delay = self.backoff
+        for i in range(1, self.attempts + 1):
+            started = False
+            try:
+                async for piece in self.inner.chat_stream(messages):
+                    started = True
+                    yield piece
+                return
+            except RateLimitExceeded:
+                raise
+            except Exception as e:
+                sleep_for = None if started else self._sleep_for(e, i, delay)
+                if sleep_for is None:
+                    raise
+                with span("llm.retry_backoff", attempt=i, error=type(e).__name__):
+                    await asyncio.sleep(sleep_for)
+                delay *= 2.0
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class AsyncRateLimitLLM(AsyncBaseLLM):
+    def __init__(
+        self,
+        inner: AsyncBaseLLM,
+        rps: float = 2.0,
+        burst: int = 2,
+        provider: str = "",
+        limiter: Optional[RateLimiter] = None,
+        max_wait: Optional[float] = None,
+        controller: Optional[AIMDController] = None,
+    ) -> None:
+        if limiter is None and rps <= 0:
+            raise ValueError("rps must be > 0")
+        self.inner = inner
+        self.provider = provider
+        self.limiter = limiter or RateLimiter(provider_rate=rps, provider_burst=burst, max_wait=max_wait)
+        self.controller = controller
+
+    def _observe(self, exc: Optional[Exception]) -> None:
+        _observe_provider(self.limiter, self.controller, self.provider, exc)
+
+    async def chat(self, messages: List[dict]) -> str:
+        with span("llm.ratelimit", key=current_rate_key() or ""):
+            await self.limiter.aacquire(self.provider)
+        try:
+            out = await self.inner.chat(messages)
+        except Exception as e:
+            self._observe(e)
+            raise
+        self._observe(None)
+        return out
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        with span("llm.ratelimit", key=current_rate_key() or ""):
+            await self.limiter.aacquire(self.provider)
+        try:
+            async for piece in self.inner.chat_stream(messages):
+                yield piece
+        except Exception as e:
+            self._observe(e)
+            raise
+        self._observe(None)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+_CACHE_HIT = CACHE_EVENTS.labels("llm", "hit")
+_CACHE_MISS = CACHE_EVENTS.labels("llm", "miss")
+_CACHE_BYPASS = CACHE_EVENTS.labels("llm", "bypass")
+
+
+class _CachePolicy:
+    """
+    Общая часть CachingLLM/AsyncCachingLLM: ключ, счётчики и правило обхода кэша.
+    При temperature > 0 ответ недетерминирован — по умолчанию кэш не используем.
+    """
+
+    def _init_cache(
+        self,
+        backend: Optional[CacheBackend],
+        model: str,
+        temperature: float,
+        top_p: float,
+        allow_sampled: bool,
+    ) -> None:
+        self.backend = backend if backend is not None else MemoryCache()
+        self.model = model
+        self.temperature = float(temperature)
+        self.top_p = float(top_p)
+        self.allow_sampled = bool(allow_sampled)
+        self.counters = CacheStats()
+
+    def _key(self, messages: List[dict]) -> Optional[str]:
+        if self.temperature > 0 and not self.allow_sampled:
+            self.counters.bypass += 1
+            _CACHE_BYPASS.inc()
+            return None
+        return cache_key(messages, self.model, self.temperature, self.top_p)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        cached = self.backend.get(key)
+        if cached is None:
+            self.counters.misses += 1
+            _CACHE_MISS.inc()
+        else:
+            self.counters.hits += 1
+            _CACHE_HIT.inc()
+        return cached
+
+    def _store(self, key: str, answer: str) -> None:
+        # Пустые ответы (в т.ч. подменённые ошибки) не кэшируем
+        if answer:
+            self.backend.set(key, answer)
+
+    def stats(self) -> dict:
+        return self.counters.as_dict(self.backend)
+
+
+class CachingLLM(_CachePolicy, BaseLLM):
+    """
+    Декоратор-кэш ответов: одинаковый промпт с теми же параметрами не идёт к провайдеру повторно.
+    """
+
+    def __init__(
+        self,
+        inner: BaseLLM,
+        backend: Optional[CacheBackend] = None,
+        model: str = "",
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        allow_sampled: bool = False,
+    ) -> None:
+        self.inner = inner
+        self._init_cache(backend, model, temperature, top_p, allow_sampled)
+
+    def chat(self, messages: List[dict]) -> str:
+        key = self._key(messages)
+        if key is None:
+            return self.inner.chat(messages)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        out = self.inner.chat(messages)
+        self._store(key, out)
+        return out
+
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        key = self._key(messages)
+        if key is None:
+            yield from self.inner.chat_stream(messages)
+            return
+        cached = self._lookup(key)
+        if cached is not None:
+            yield cached
+            return
+        parts: List[str] = []
+        for piece in self.inner.chat_stream(messages):
+            parts.append(piece)
+            yield piece
+        self._store(key, "".join(parts))
+
+
+class AsyncCachingLLM(_CachePolicy, AsyncBaseLLM):
+    def __init__(
+        self,
+        inner: AsyncBaseLLM,
+        backend: Optional[CacheBackend] = None,
+        model: str = "",
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        allow_sampled: bool = False,
+    ) -> None:
+        self.inner = inner
+        self._init_cache(backend, model, temperature, top_p, allow_sampled)
+        # память — словарь под локом, её читаем прямо в loop; SQLite и прочее — диск, уводим в поток
+        self._inline = isinstance(self.backend, MemoryCache)
+
+    async def _alookup(self, key: str) -> Optional[str]:
+        if self._inline:
+            return self._lookup(key)
+        return await asyncio.to_thread(self._lookup, key)
+
+    async def _astore(self, key: str, answer: str) -> None:
+        if self._inline:
+            self._store(key, answer)
+        else:
+            await asyncio.to_thread(self._store, key, answer)
+
+    async def chat(self, messages: List[dict]) -> str:
+        key = self._key(messages)
+        if key is None:
+            return await self.inner.chat(messages)
+        cached = await self._alookup(key)
+        if cached is not None:
+            return cached
+        out = await self.inner.chat(messages)
+        await self._astore(key, out)
+        return out
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        key = self._key(messages)
+        if key is None:
+            async for piece in self.inner.chat_stream(messages):
+                yield piece
+            return
+        cached = await self._alookup(key)
+        if cached is not None:
+            yield cached
+            return
+        parts: List[str] = []
+        async for piece in self.inner.chat_stream(messages):
+            parts.append(piece)
+            yield piece
+        await self._astore(key, "".join(parts))
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class CoalescingLLM(BaseLLM):
+    """
+    Single-flight: одинаковые одновременные запросы (рассылка в группу, повтор клиента
+    по таймауту) уходят к провайдеру один раз, остальные получают тот же ответ или ошибку.
+    Ключ — тот же канонический хэш, что у кэша. Поток не склеивается: у каждого свой.
+    """
+
+    def __init__(
+        self,
+        inner: BaseLLM,
+        model: str = "",
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        flight: Optional[SingleFlight] = None,
+    ) -> None:
+        self.inner = inner
+        self.model, self.temperature, self.top_p = model, float(temperature), float(top_p)
+        self.flight = flight or SingleFlight("llm")
+
+    def chat(self, messages: List[dict]) -> str:
+        key = cache_key(messages, self.model, self.temperature, self.top_p)
+        return self.flight.do(key, lambda: self.inner.chat(messages))
+
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        yield from self.inner.chat_stream(messages)
+
+    def stats(self) -> dict:
+        return self.flight.stats()
+
+
+class AsyncCoalescingLLM(AsyncBaseLLM):
+    def __init__(
+        self,
+        inner: AsyncBaseLLM,
+        model: str = "",
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        flight: Optional[AsyncSingleFlight] = None,
+    ) -> None:
+        self.inner = inner
+        self.model, self.temperature, self.top_p = model, float(temperature), float(top_p)
+        self.flight = flight or AsyncSingleFlight("llm")
+
+    async def chat(self, messages: List[dict]) -> str:
+        key = cache_key(messages, self.model, self.temperature, self.top_p)
+        return await self.flight.do(key, lambda: self.inner.chat(messages))
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        async for piece in self.inner.chat_stream(messages):
+            yield piece
+
+    def stats(self) -> dict:
+        return self.flight.stats()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
@@ -0,0 +1,80 @@
+# llm/errors.py
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Optional
+
+import httpx
+import requests
+
+from .ratelimit import RateLimitExceeded
+
+# 408/425 — «повторите позже», 429 — перегрузка; остальные 4xx (в т.ч. 409 — конфликт) от повтора не исправятся
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504, 520, 522, 524, 529})
+
+
+@dataclass(frozen=True)
+class ErrorClass:
+    retryable: bool
+    throttled: bool = False           # провайдер просит сбавить темп (429/529)
+    status: Optional[int] = None
+    retry_after: Optional[float] = None  # секунды из Retry-After / retry-after-ms
+
+
+def parse_retry_after(headers: Any, now: Optional[float] = None) -> Optional[float]:
+    """Retry-After в секундах или HTTP-дате; retry-after-ms (OpenAI) точнее и в приоритете."""
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return max(0.0, float(ms) / 1000.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0.0, when - (time.time() if now is None else now))
+
+
+def _response_of(exc: BaseException) -> Any:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response
+    if isinstance(exc, requests.HTTPError):
+        return exc.response
+    return None
+
+
+def classify(exc: BaseException) -> ErrorClass:
+    """
+    Можно ли повторить вызов. HTTP-ошибки решаются по коду, сетевые сбои и таймауты
+    повторяемы; прочее (битый JSON от прокси и т.п.) — тоже, как и раньше по умолчанию.
+    """
+    if isinstance(exc, RateLimitExceeded):
+        return ErrorClass(retryable=False, throttled=True, retry_after=exc.retry_after)
+    resp = _response_of(exc)
+    if resp is not None:
+        status = int(resp.status_code)
+        retry_after = parse_retry_after(resp.headers)
+        return ErrorClass(
+            retryable=status in RETRYABLE_STATUSES,
+            throttled=status in (429, 529),
+            status=status,
+            retry_after=retry_after,
+        )
+    return ErrorClass(retryable=True)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return classify(exc).retryable
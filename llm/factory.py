@@ -1,10 +1,27 @@
 from __future__ import annotations
 import os
-from typing import Optional
+import threading
+import weakref
+from typing import Any, Dict, List, Optional
 
-from .base import BaseLLM
-from .openai_compat import OpenAICompatLLM
-from .decorators import LoggingLLM, RetryingLLM, RateLimitLLM
+from .base import BaseLLM, AsyncBaseLLM
+from .openai_compat import OpenAICompatLLM, AsyncOpenAICompatLLM
+from .transport import HTTPPool
+from .cache import CacheBackend, MemoryCache, SQLiteCache
+from .decorators import (
+    LoggingLLM,
+    RetryingLLM,
+    RateLimitLLM,
+    AsyncLoggingLLM,
+    AsyncRetryingLLM,
+    AsyncRateLimitLLM,
+    CachingLLM,
+    AsyncCachingLLM,
+    CoalescingLLM,
+    AsyncCoalescingLLM,
+)
+from .ratelimit import AIMDController, RateLimiter
+from .failover import AsyncFailoverLLM, FailoverLLM
 
 
 try:
@@ -19,48 +36,309 @@ def _openrouter_headers() -> dict:
     return settings.openrouter_headers()
 
 
-def make_llm(
-    provider: Optional[str] = None,
-    *,
-    with_logging: bool = True,
-    with_retry: bool = True,
-    with_rate_limit: bool = True,
-) -> BaseLLM:
-    prov = (provider or (getattr(settings, "LLM_PROVIDER", "openrouter") if settings else "openrouter")).lower()
+def _resolve_provider(provider: Optional[str]) -> str:
+    return (provider or (getattr(settings, "LLM_PROVIDER", "openrouter") if settings else "openrouter")).lower()
+
 
+def _provider_config(prov: str) -> Dict[str, Any]:
+    # Параметры клиента (base_url, ключ, модель, заголовки) для выбранного провайдера
     if prov == "openrouter":
         base_url = getattr(settings, "OPENAI_BASE_URL", "https://openrouter.ai/api/v1") if settings else "https://openrouter.ai/api/v1"
         api_key  = getattr(settings, "OPENROUTER_API_KEY", "") if settings else os.getenv("OPENROUTER_API_KEY", "")
         model    = getattr(settings, "OPENROUTER_MODEL", "gpt-4o-mini") if settings else os.getenv("OPENROUTER_MODEL", "gpt-4o-mini")
-        llm: BaseLLM = OpenAICompatLLM(base_url, api_key or None, model, extra_headers=_openrouter_headers(), return_errors=False)
+        return {"base_url": base_url, "api_key": api_key or None, "model": model, "extra_headers": _openrouter_headers()}
 
-    elif prov == "groq":
+    if prov == "groq":
         base_url = "https://api.groq.com/openai/v1"
         api_key  = getattr(settings, "GROQ_API_KEY", "") if settings else os.getenv("GROQ_API_KEY", "")
         model    = os.getenv("GROQ_MODEL", "llama3-8b-8192")
-        llm = OpenAICompatLLM(base_url, api_key or None, model, return_errors=False)
+        return {"base_url": base_url, "api_key": api_key or None, "model": model}
 
-    elif prov == "openai":
+    if prov == "openai":
         base_url = "https://api.openai.com/v1"
         api_key  = getattr(settings, "OPENAI_API_KEY", "") if settings else os.getenv("OPENAI_API_KEY", "")
         model    = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        llm = OpenAICompatLLM(base_url, api_key or None, model, return_errors=False)
+        return {"base_url": base_url, "api_key": api_key or None, "model": model}
 
-    elif prov == "ollama":
+    if prov == "ollama":
         base_url = getattr(settings, "OLLAMA_BASE_URL", "http://localhost:11434/v1") if settings else os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
         api_key  = os.getenv("OLLAMA_API_KEY", "")
         model    = os.getenv("OLLAMA_MODEL", "llama3")
-        llm = OpenAICompatLLM(base_url, api_key or None, model, return_errors=False)
+        return {"base_url": base_url, "api_key": api_key or None, "model": model}
+
+    raise ValueError(f"Unknown LLM provider: {prov}")
+
+
+_POOLS: Dict[str, HTTPPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(prov: str) -> HTTPPool:
+    # Один пул соединений на провайдера: общий для sync- и async-клиентов и всех make_llm()
+    with _POOLS_LOCK:
+        pool = _POOLS.get(prov)
+        if pool is None:
+            pool = HTTPPool(
+                prov,
+                pool_size=int(os.getenv("LLM_POOL_SIZE", "10")),
+                per_host=int(os.getenv("LLM_POOL_PER_HOST", "20")),
+                connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+                read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "60")),
+                http2=os.getenv("LLM_HTTP2", "false").strip().lower() in {"1", "true", "yes", "on"},
+                keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+            )
+            _POOLS[prov] = pool
+        return pool
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    with _POOLS_LOCK:
+        pools = dict(_POOLS)
+    return {name: pool.stats() for name, pool in pools.items()}
+
+
+async def aclose_pools() -> None:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        await pool.aclose()
+
+
+_LIMITER: Optional[RateLimiter] = None
+
+
+def get_limiter() -> RateLimiter:
+    """
+    Один лимитер на процесс: все клиенты (основной, компакция, sync и async) делят бюджет.
+    LLM_GLOBAL_RPS — общий потолок, LLM_RPS_<PROVIDER> (или LLM_RPS) — на провайдера,
+    LLM_USER_RPS — на channel:user_id; 0 отключает уровень. LLM_MAX_WAIT — отказ вместо ожидания.
+    """
+    global _LIMITER
+    with _POOLS_LOCK:
+        if _LIMITER is None:
+            _LIMITER = RateLimiter(
+                global_rate=float(os.getenv("LLM_GLOBAL_RPS", "0")),
+                global_burst=float(os.getenv("LLM_GLOBAL_BURST", "10")),
+                provider_rate=float(os.getenv("LLM_RPS", "2.0")),
+                provider_burst=float(os.getenv("LLM_BURST", "2")),
+                key_rate=float(os.getenv("LLM_USER_RPS", "0")),
+                key_burst=float(os.getenv("LLM_USER_BURST", "3")),
+                max_wait=float(os.getenv("LLM_MAX_WAIT", "0")) or None,
+            )
+        return _LIMITER
+
+
+def _limiter_for(prov: str) -> RateLimiter:
+    limiter = get_limiter()
+    suffix = prov.upper()
+    rate = os.getenv(f"LLM_RPS_{suffix}")
+    if rate is not None:
+        limiter.limit_provider(prov, float(rate), float(os.getenv(f"LLM_BURST_{suffix}", os.getenv("LLM_BURST", "2"))))
+    return limiter
+
+
+_CONTROLLERS: Dict[str, AIMDController] = {}
+
+
+def _controller_for(prov: str, limiter: RateLimiter) -> Optional[AIMDController]:
+    # LLM_ADAPTIVE: скорость провайдера ходит между LLM_RPS_MIN и LLM_RPS_MAX (по умолчанию — LLM_RPS) по ответам 429
+    if os.getenv("LLM_ADAPTIVE", "true").strip().lower() not in {"1", "true", "yes", "on"}:
+        return None
+    with _POOLS_LOCK:
+        ctl = _CONTROLLERS.get(prov)
+        if ctl is None and limiter.rate_of(prov) is not None:
+            ctl = _CONTROLLERS[prov] = AIMDController(
+                limiter,
+                prov,
+                min_rate=float(os.getenv("LLM_RPS_MIN", "0.1")),
+                max_rate=float(os.getenv("LLM_RPS_MAX", "0")) or None,
+                decrease=float(os.getenv("LLM_AIMD_DECREASE", "0.5")),
+                increase=float(os.getenv("LLM_AIMD_INCREASE", "0.1")),
+            )
+        return ctl
+
+
+def limiter_stats() -> Dict[str, Any]:
+    if _LIMITER is None:
+        return {}
+    out = _LIMITER.stats()
+    with _POOLS_LOCK:
+        out["adaptive"] = {prov: ctl.stats() for prov, ctl in _CONTROLLERS.items()}
+    return out
+
+
+_CACHE: Optional[CacheBackend] = None
+
+
+def get_cache_backend() -> Optional[CacheBackend]:
+    # LLM_CACHE=off|memory|sqlite; один бэкенд на процесс — ключ и так содержит модель
+    global _CACHE
+    kind = os.getenv("LLM_CACHE", "off").strip().lower()
+    if kind in ("", "off", "none", "0", "false"):
+        return None
+    with _POOLS_LOCK:
+        if _CACHE is None:
+            ttl = float(os.getenv("LLM_CACHE_TTL", "3600"))
+            size = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+            if kind == "memory":
+                _CACHE = MemoryCache(max_entries=size, ttl=ttl)
+            elif kind == "sqlite":
+                _CACHE = SQLiteCache(os.getenv("LLM_CACHE_PATH", "./llm_cache.sqlite3"), max_entries=size, ttl=ttl)
+            else:
+                raise ValueError(f"Unknown LLM_CACHE backend: {kind}")
+        return _CACHE
+
+
+def _coalesce_enabled() -> bool:
+    # LLM_COALESCE: одинаковые одновременные запросы — один вызов провайдера (single-flight)
+    return os.getenv("LLM_COALESCE", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _coalesce_kwargs(llm: Any) -> Dict[str, Any]:
+    return {"model": llm.model, "temperature": llm.temperature, "top_p": llm.top_p}
 
-    else:
-        raise ValueError(f"Unknown LLM provider: {prov}")
 
-    
+def _cache_kwargs(llm: Any) -> Dict[str, Any]:
+    return {
+        "backend": get_cache_backend(),
+        "model": llm.model,
+        "temperature": llm.temperature,
+        "top_p": llm.top_p,
+        "allow_sampled": os.getenv("LLM_CACHE_ALLOW_SAMPLED", "false").strip().lower() in {"1", "true", "yes", "on"},
+    }
+
+
+def _failover_chain(provider: Optional[str]) -> List[str]:
+    # LLM_FAILOVER=openrouter,groq,ollama — порядок приоритета; явный provider связку отключает
+    if provider:
+        return []
+    chain = [p.strip().lower() for p in os.getenv("LLM_FAILOVER", "").split(",") if p.strip()]
+    return chain if len(chain) > 1 else []
+
+
+def _failover_kwargs() -> Dict[str, Any]:
+    return {
+        "hedge": os.getenv("LLM_HEDGE", "false").strip().lower() in {"1", "true", "yes", "on"},
+        "hedge_after": float(os.getenv("LLM_HEDGE_AFTER", "2.0")),
+        "failure_threshold": int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+        "reset_timeout": float(os.getenv("LLM_BREAKER_RESET", "30")),
+    }
+
+
+_FAILOVERS: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+def failover_stats() -> List[Dict[str, Any]]:
+    return [fo.stats() for fo in list(_FAILOVERS)]
+
+
+def _provider_chain(prov: str, model: Optional[str], with_rate_limit: bool, with_retry: bool, attempts: int):
+    cfg = _provider_config(prov)
+    if model:
+        cfg["model"] = model  # например, более дешёвая модель для служебных задач
+    base = OpenAICompatLLM(**cfg, return_errors=False, transport=get_pool(prov))
+    llm: BaseLLM = base
+
+    if with_rate_limit:
+        limiter = _limiter_for(prov)
+        llm = RateLimitLLM(llm, provider=prov, limiter=limiter, controller=_controller_for(prov, limiter))
+    if with_retry and attempts > 1:
+        llm = RetryingLLM(
+            llm,
+            attempts=attempts,
+            provider=prov,
+            max_retry_after=float(os.getenv("LLM_MAX_RETRY_AFTER", "30")),
+        )
+    return llm, base
+
+
+def _async_provider_chain(prov: str, model: Optional[str], with_rate_limit: bool, with_retry: bool, attempts: int):
+    cfg = _provider_config(prov)
+    if model:
+        cfg["model"] = model
+    base = AsyncOpenAICompatLLM(**cfg, return_errors=False, pool=get_pool(prov))
+    llm: AsyncBaseLLM = base
+
     if with_rate_limit:
-        llm = RateLimitLLM(llm, rps=float(os.getenv("LLM_RPS", "2.0")), burst=int(os.getenv("LLM_BURST", "2")))
-    if with_retry:
-        llm = RetryingLLM(llm, attempts=int(os.getenv("LLM_RETRIES", "3")))
+        limiter = _limiter_for(prov)
+        llm = AsyncRateLimitLLM(llm, provider=prov, limiter=limiter, controller=_controller_for(prov, limiter))
+    if with_retry and attempts > 1:
+        llm = AsyncRetryingLLM(
+            llm,
+            attempts=attempts,
+            provider=prov,
+            max_retry_after=float(os.getenv("LLM_MAX_RETRY_AFTER", "30")),
+        )
+    return llm, base
+
+
+def make_llm(
+    provider: Optional[str] = None,
+    *,
+    with_logging: bool = True,
+    with_retry: bool = True,
+    with_rate_limit: bool = True,
+    with_cache: Optional[bool] = None,
+    model: Optional[str] = None,
+) -> BaseLLM:
+    chain = _failover_chain(provider)
+    if chain:
+        # В связке долгие ретраи одного провайдера только мешают — по умолчанию сразу к следующему;
+        # model относится к основному провайдеру, у запасных — их модели по умолчанию
+        attempts = int(os.getenv("LLM_FAILOVER_RETRIES", "1"))
+        parts = [_provider_chain(p, model if i == 0 else None, with_rate_limit, with_retry, attempts) for i, p in enumerate(chain)]
+        llm: BaseLLM = FailoverLLM([(p, part[0]) for p, part in zip(chain, parts)], **_failover_kwargs())
+        _FAILOVERS.add(llm)
+        base = parts[0][1]
+        prov = "+".join(chain)
+    else:
+        prov = _resolve_provider(provider)
+        llm, base = _provider_chain(prov, model, with_rate_limit, with_retry, int(os.getenv("LLM_RETRIES", "3")))
+
+    # Склейка внутри кэша: промах, случившийся у нескольких сразу, идёт к провайдеру один раз
+    if _coalesce_enabled():
+        llm = CoalescingLLM(llm, **_coalesce_kwargs(base))
+    # Кэш снаружи ретраев и лимитера: попадание не тратит ни жетоны, ни попытки
+    use_cache = with_cache if with_cache is not None else get_cache_backend() is not None
+    if use_cache:
+        llm = CachingLLM(llm, **_cache_kwargs(base))
+    if with_logging:
+        llm = LoggingLLM(llm, name=f"LLM[{prov}]", provider=prov, model=base.model)
+
+    return llm
+
+
+def make_async_llm(
+    provider: Optional[str] = None,
+    *,
+    with_logging: bool = True,
+    with_retry: bool = True,
+    with_rate_limit: bool = True,
+    with_cache: Optional[bool] = None,
+    model: Optional[str] = None,
+) -> AsyncBaseLLM:
+    chain = _failover_chain(provider)
+    if chain:
+        attempts = int(os.getenv("LLM_FAILOVER_RETRIES", "1"))
+        parts = [
+            _async_provider_chain(p, model if i == 0 else None, with_rate_limit, with_retry, attempts)
+            for i, p in enumerate(chain)
+        ]
+        llm: AsyncBaseLLM = AsyncFailoverLLM([(p, part[0]) for p, part in zip(chain, parts)], **_failover_kwargs())
+        _FAILOVERS.add(llm)
+        base = parts[0][1]
+        prov = "+".join(chain)
+    else:
+        prov = _resolve_provider(provider)
+        llm, base = _async_provider_chain(prov, model, with_rate_limit, with_retry, int(os.getenv("LLM_RETRIES", "3")))
+
+    if _coalesce_enabled():
+        llm = AsyncCoalescingLLM(llm, **_coalesce_kwargs(base))
+    use_cache = with_cache if with_cache is not None else get_cache_backend() is not None
+    if use_cache:
+        llm = AsyncCachingLLM(llm, **_cache_kwargs(base))
     if with_logging:
-        llm = LoggingLLM(llm, name=f"LLM[{prov}]")
+        llm = AsyncLoggingLLM(llm, name=f"LLM[{prov}]", provider=prov, model=base.model)
 
     return llm
@@ -0,0 +1,478 @@
+# llm/failover.py
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait as futures_wait
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from core.metrics import LLM_FAILOVER
+from core.tracing import span
+
+from .base import AsyncBaseLLM, BaseLLM
+from .ratelimit import RateLimitExceeded
+
+try:
+    from core.logging import get_logger  # type: ignore
+except ImportError:
+    import logging
+    get_logger = logging.getLogger
+
+
+class NoBackendAvailable(RuntimeError):
+    """Все бэкенды с разомкнутым предохранителем — звать некого."""
+
+
+class LatencyWindow:
+    """Скользящее окно последних задержек (с); перцентиль — по отсортированной копии."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20) -> None:
+        self._values: Deque[float] = deque(maxlen=max(1, int(size)))
+        self.min_samples = max(1, int(min_samples))
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """None, пока замеров меньше min_samples: на паре точек p95 ничего не значит."""
+        with self._lock:
+            if len(self._values) < self.min_samples:
+                return None
+            xs = sorted(self._values)
+        return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class CircuitBreaker:
+    """
+    closed → (failure_threshold ошибок подряд) → open → (reset_timeout) → half_open:
+    пропускаем одну пробу; успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """Без побочных эффектов: можно ли вообще рассчитывать на бэкенд."""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def allow(self) -> bool:
+        """Занимает слот пробы в half_open — вызывать непосредственно перед запросом."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """True — предохранитель только что разомкнулся."""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None:
+                # проба в half_open не удалась — ждём ещё reset_timeout
+                self.opened_at = time.monotonic()
+                return False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                return True
+            return False
+
+    def release(self) -> None:
+        # Проба отменена (проиграла хедж) — ничего не узнали, слот свободен
+        with self._lock:
+            self._probing = False
+
+
+class Backend:
+    """Один провайдер в связке: клиент, предохранитель, окна задержек и счётчики."""
+
+    def __init__(self, name: str, llm: Any, breaker: Optional[CircuitBreaker] = None, window: int = 200) -> None:
+        self.name = name
+        self.llm = llm
+        self.breaker = breaker or CircuitBreaker()
+        # chat — полное время ответа, stream — время до первого куска
+        self.latency = {"chat": LatencyWindow(window), "stream": LatencyWindow(window)}
+        self.counters = {"calls": 0, "ok": 0, "errors": 0, "hedges": 0, "wins": 0, "cancelled": 0}
+        self._m = {e: LLM_FAILOVER.labels(name, e) for e in ("errors", "hedges", "cancelled", "breaker_open")}
+
+    def count(self, event: str) -> None:
+        self.counters[event] += 1
+        if event in self._m:
+            self._m[event].inc()
+
+    def succeeded(self, mode: str, seconds: float) -> None:
+        self.count("ok")
+        self.latency[mode].add(seconds)
+        self.breaker.record_success()
+
+    def failed(self, exc: BaseException) -> None:
+        self.count("errors")
+        # Отказ собственного лимитера — бэкенд занят, а не сломан: предохранитель не трогаем
+        if isinstance(exc, RateLimitExceeded):
+            self.breaker.release()
+        elif self.breaker.record_failure():
+            self._m["breaker_open"].inc()
+
+    def cancelled(self) -> None:
+        self.count("cancelled")
+        self.breaker.release()
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self.counters)
+        out["breaker"] = self.breaker.state
+        for mode, w in self.latency.items():
+            p50, p95 = w.quantile(0.5), w.quantile(0.95)
+            out[f"{mode}_p50_ms"] = None if p50 is None else round(p50 * 1000.0, 1)
+            out[f"{mode}_p95_ms"] = None if p95 is None else round(p95 * 1000.0, 1)
+        return out
+
+
+class _BackendSet:
+    """Общая часть sync/async: порядок бэкендов, задержка хеджа и статистика."""
+
+    def _init_backends(
+        self,
+        backends: Sequence[Tuple[str, Any]],
+        hedge: bool,
+        hedge_after: float,
+        min_hedge_delay: float,
+        failure_threshold: int,
+        reset_timeout: float,
+    ) -> None:
+        if not backends:
+            raise ValueError("at least one backend is required")
+        self.backends: List[Backend] = [
+            Backend(name, llm, CircuitBreaker(failure_threshold, reset_timeout)) for name, llm in backends
+        ]
+        self.hedge = bool(hedge)
+        self.hedge_after = float(hedge_after)
+        self.min_hedge_delay = float(min_hedge_delay)
+        self.log = get_logger("FailoverLLM")
+        # для интроспекции (окно контекста, ключ кэша) — модель основного бэкенда
+        self.inner = self.backends[0].llm
+
+    def _order(self) -> List[Backend]:
+        # По порядку приоритета, без бэкендов с разомкнутым предохранителем
+        return [b for b in self.backends if b.breaker.available()]
+
+    def _hedge_delay(self, b: Backend, mode: str) -> Optional[float]:
+        """Сколько ждать бэкенд, прежде чем параллельно спросить следующий; None — не хеджируем."""
+        if not self.hedge:
+            return None
+        p95 = b.latency[mode].quantile(0.95)
+        delay = p95 if p95 is not None else self.hedge_after
+        return max(self.min_hedge_delay, delay) if delay > 0 else None
+
+    def _next(self, order: Iterator[Backend]) -> Optional[Backend]:
+        for b in order:
+            if b.breaker.allow():
+                b.count("calls")
+                return b
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {b.name: b.stats() for b in self.backends}
+
+
+class FailoverLLM(_BackendSet, BaseLLM):
+    """
+    Несколько провайдеров по приоритету (например, openrouter → groq → ollama):
+    ошибка или разомкнутый предохранитель — переходим к следующему.
+    С hedge=True медленный бэкенд (дольше своего скользящего p95) дублируется запросом
+    к следующему, побеждает первый ответ. В sync-варианте проигравший HTTP-запрос
+    прервать нельзя — его результат просто отбрасывается; поток хеджируется только в async.
+    """
+
+    def __init__(
+        self,
+        backends: Sequence[Tuple[str, BaseLLM]],
+        hedge: bool = False,
+        hedge_after: float = 2.0,
+        min_hedge_delay: float = 0.05,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        max_workers: int = 16,
+    ) -> None:
+        self._init_backends(backends, hedge, hedge_after, min_hedge_delay, failure_threshold, reset_timeout)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_workers = max_workers
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def _call(self, b: Backend, messages: List[dict]) -> str:
+        t0 = time.perf_counter()
+        with span("llm.backend", backend=b.name):
+            out = b.llm.chat(messages)
+        b.succeeded("chat", time.perf_counter() - t0)
+        return out
+
+    def _submit(self, b: Backend, messages: List[dict]) -> Future:
+        # В потоке пула нет contextvars вызывающего — переносим (трассировка, ключ лимитера)
+        ctx = contextvars.copy_context()
+        return self._pool().submit(ctx.run, self._call, b, messages)
+
+    def chat(self, messages: List[dict]) -> str:
+        order = iter(self._order())
+        last_exc: Optional[BaseException] = None
+        if not self.hedge:
+            while True:
+                b = self._next(order)
+                if b is None:
+                    break
+                try:
+                    return self._call(b, messages)
+                except Exception as e:
+                    b.failed(e)
+                    last_exc = e
+                    self.log.warning("backend %s failed, failing over: %s", b.name, e)
+            raise last_exc or NoBackendAvailable("all LLM backends are unavailable")
+
+        pending: Dict[Future, Backend] = {}
+        b = self._next(order)
+        if b is None:
+            raise NoBackendAvailable("all LLM backends are unavailable")
+        pending[self._submit(b, messages)] = b
+        newest = b
+        exhausted = False
+        try:
+            while pending:
+                delay = None if exhausted else self._hedge_delay(newest, "chat")
+                done, _ = futures_wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    nb = self._next(order)
+                    if nb is None:
+                        exhausted = True
+                        continue
+                    nb.count("hedges")
+                    pending[self._submit(nb, messages)] = nb
+                    newest = nb
+                    continue
+                for fut in done:
+                    fb = pending.pop(fut)
+                    exc = fut.exception()
+                    if exc is None:
+                        fb.count("wins")
+                        return fut.result()
+                    fb.failed(exc)
+                    last_exc = exc
+                    self.log.warning("backend %s failed, failing over: %s", fb.name, exc)
+                if not pending and not exhausted:
+                    nb = self._next(order)
+                    if nb is not None:
+                        pending[self._submit(nb, messages)] = nb
+                        newest = nb
+        finally:
+            for fut, fb in pending.items():
+                fut.cancel()
+                fb.cancelled()
+        raise last_exc or NoBackendAvailable("all LLM backends are unavailable")
+
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        # Переключаемся, только пока клиенту ничего не отдано
+        order = iter(self._order())
+        last_exc: Optional[BaseException] = None
+        while True:
+            b = self._next(order)
+            if b is None:
+                break
+            t0 = time.perf_counter()
+            started = False
+            try:
+                for piece in b.llm.chat_stream(messages):
+                    if not started:
+                        started = True
+                        b.succeeded("stream", time.perf_counter() - t0)
+                    yield piece
+                if not started:
+                    b.succeeded("stream", time.perf_counter() - t0)
+                return
+            except Exception as e:
+                b.failed(e)
+                if started:
+                    raise
+                last_exc = e
+                self.log.warning("backend %s stream failed, failing over: %s", b.name, e)
+        raise last_exc or NoBackendAvailable("all LLM backends are unavailable")
+
+
+class HedgedLLM(FailoverLLM):
+    """FailoverLLM с хеджированием по умолчанию."""
+
+    def __init__(self, backends: Sequence[Tuple[str, BaseLLM]], **kw: Any) -> None:
+        kw.setdefault("hedge", True)
+        super().__init__(backends, **kw)
+
+
+class AsyncFailoverLLM(_BackendSet, AsyncBaseLLM):
+    """
+    Асинхронный FailoverLLM: проигравший хедж отменяется (задача и HTTP-запрос),
+    а поток хеджируется по времени до первого куска.
+    """
+
+    def __init__(
+        self,
+        backends: Sequence[Tuple[str, AsyncBaseLLM]],
+        hedge: bool = False,
+        hedge_after: float = 2.0,
+        min_hedge_delay: float = 0.05,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ) -> None:
+        self._init_backends(backends, hedge, hedge_after, min_hedge_delay, failure_threshold, reset_timeout)
+
+    async def _call(self, b: Backend, messages: List[dict]) -> str:
+        t0 = time.perf_counter()
+        with span("llm.backend", backend=b.name):
+            out = await b.llm.chat(messages)
+        b.succeeded("chat", time.perf_counter() - t0)
+        return out
+
+    async def _race(
+        self,
+        start: Callable[[Backend], "asyncio.Future[Any]"],
+        mode: str,
+        on_cancel: Callable[[Backend], Any],
+    ) -> Tuple[Backend, Any]:
+        """
+        Общий цикл: запускаем первый бэкенд, при ошибке — следующий, при медленном ответе
+        (hedge) — следующий параллельно. Возвращает победителя и его результат.
+        """
+        order = iter(self._order())
+        pending: Dict["asyncio.Future[Any]", Backend] = {}
+        last_exc: Optional[BaseException] = None
+        exhausted = False
+        newest: Optional[Backend] = None
+
+        def launch(hedge: bool) -> bool:
+            nonlocal newest
+            nb = self._next(order)
+            if nb is None:
+                return False
+            if hedge:
+                nb.count("hedges")
+            pending[start(nb)] = nb
+            newest = nb
+            return True
+
+        if not launch(False):
+            raise NoBackendAvailable("all LLM backends are unavailable")
+        try:
+            while pending:
+                delay = None if exhausted or newest is None else self._hedge_delay(newest, mode)
+                done, _ = await asyncio.wait(list(pending), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    exhausted = not launch(True)
+                    continue
+                for task in done:
+                    tb = pending.pop(task)
+                    exc = task.exception()
+                    if exc is None:
+                        tb.count("wins")
+                        return tb, task.result()
+                    tb.failed(exc)
+                    last_exc = exc
+                    self.log.warning("backend %s failed, failing over: %s", tb.name, exc)
+                if not pending and not exhausted:
+                    exhausted = not launch(False)
+        finally:
+            for task, tb in pending.items():
+                task.cancel()
+                tb.cancelled()
+                on_cancel(tb)
+            if pending:
+                # дожидаемся отмены, иначе поток проигравшего нельзя закрыть (он ещё «выполняется»)
+                await asyncio.gather(*pending, return_exceptions=True)
+        raise last_exc or NoBackendAvailable("all LLM backends are unavailable")
+
+    async def chat(self, messages: List[dict]) -> str:
+        _, out = await self._race(lambda b: asyncio.ensure_future(self._call(b, messages)), "chat", lambda b: None)
+        return out
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        streams: Dict[str, Any] = {}
+        started: Dict[str, float] = {}
+
+        async def first_piece(b: Backend) -> Tuple[Any, Optional[str]]:
+            agen = streams[b.name]
+            try:
+                piece = await agen.__anext__()
+            except StopAsyncIteration:
+                piece = None
+            b.succeeded("stream", time.perf_counter() - started[b.name])
+            return agen, piece
+
+        def start(b: Backend) -> "asyncio.Future[Any]":
+            streams[b.name] = b.llm.chat_stream(messages)
+            started[b.name] = time.perf_counter()
+            return asyncio.ensure_future(first_piece(b))
+
+        losers: List[Any] = []
+        try:
+            winner, (agen, first) = await self._race(start, "stream", lambda b: losers.append(streams[b.name]))
+        finally:
+            for loser in losers:
+                await _aclose_quietly(loser)
+        if first is None:
+            return
+        yield first
+        try:
+            async for piece in agen:
+                yield piece
+        except Exception as e:
+            winner.failed(e)
+            raise
+
+    async def aclose(self) -> None:
+        for b in self.backends:
+            await b.llm.aclose()
+
+
+class AsyncHedgedLLM(AsyncFailoverLLM):
+    """AsyncFailoverLLM с хеджированием по умолчанию."""
+
+    def __init__(self, backends: Sequence[Tuple[str, AsyncBaseLLM]], **kw: Any) -> None:
+        kw.setdefault("hedge", True)
+        super().__init__(backends, **kw)
+
+
+async def _aclose_quietly(agen: Any) -> None:
+    try:
+        await agen.aclose()
+    except Exception:
+        pass
@@ -1,8 +1,50 @@
 from __future__ import annotations
 import json
 import requests
-from typing import Dict, List, Optional
-from .base import BaseLLM
+import httpx
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from .base import BaseLLM, AsyncBaseLLM
+from .transport import HTTPPool
+
+
+def _sse_delta(line: str) -> Tuple[bool, Optional[str]]:
+    """
+    Разбор одной строки SSE-потока chat/completions: (конец_потока, кусок_текста).
+    """
+    line = line.strip()
+    if not line.startswith("data:"):
+        return False, None  # пустые строки-разделители, комментарии ": keep-alive", event:
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return True, None
+    obj = json.loads(data)
+    choices = obj.get("choices") or []
+    if not choices:
+        return False, None
+    delta = choices[0].get("delta") or {}
+    return False, delta.get("content") or None
+
+
+def _iter_sse_lines(resp: requests.Response) -> Iterator[bytes]:
+    """
+    Строки потока по мере прихода. iter_lines() читает блоками по 512 байт, и без chunked-кодирования
+    (ответ до закрытия соединения) короткие delta ждали бы заполнения блока — терялся TTFT.
+    read1 (urllib3 2.x) отдаёт то, что уже пришло.
+    """
+    read1 = getattr(getattr(resp, "raw", None), "read1", None)
+    if read1 is None:
+        yield from resp.iter_lines()
+        return
+    buf = b""
+    while True:
+        data = read1(8192, decode_content=True)
+        if not data:
+            break
+        *lines, buf = (buf + data).split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if buf:
+        yield buf
 
 
 class OpenAICompatLLM(BaseLLM):
@@ -24,6 +66,7 @@ class OpenAICompatLLM(BaseLLM):
         top_p: float = 0.95,
         timeout: int = 60,
         return_errors: bool = False,
+        transport: Optional[HTTPPool] = None,
     ) -> None:
         self.url = base_url.rstrip("/") + "/chat/completions"
         self.api_key = api_key
@@ -33,12 +76,23 @@ class OpenAICompatLLM(BaseLLM):
         self.top_p = top_p
         self.timeout = timeout
         self.return_errors = return_errors
+        # Без пула — прежнее поведение: отдельный requests.post на каждый вызов
+        self.transport = transport
 
-    def chat(self, messages: List[dict]) -> str:
-        headers = {"Content-Type": "application/json", **self.extra_headers}
+        # Заголовки не меняются между запросами — собираем один раз
+        self._headers = {"Content-Type": "application/json", **self.extra_headers}
         if self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
+            self._headers["Authorization"] = f"Bearer {self.api_key}"
+        self._stream_headers = {**self._headers, "Accept": "text/event-stream"}
+
+    def _post(self, payload: dict, headers: Dict[str, str], stream: bool = False) -> requests.Response:
+        if self.transport is not None:
+            return self.transport.post(self.url, json=payload, headers=headers, stream=stream)
+        if stream:
+            return requests.post(self.url, headers=headers, json=payload, timeout=self.timeout, stream=True)
+        return requests.post(self.url, headers=headers, json=payload, timeout=self.timeout)
 
+    def chat(self, messages: List[dict]) -> str:
         payload = {
             "model": self.model,
             "messages": messages,
@@ -47,7 +101,7 @@ class OpenAICompatLLM(BaseLLM):
         }
 
         try:
-            resp = requests.post(self.url, headers=headers, json=payload, timeout=self.timeout)
+            resp = self._post(payload, self._headers)
             resp.raise_for_status()
             data = resp.json()
             return data["choices"][0]["message"]["content"]
@@ -56,5 +110,131 @@ class OpenAICompatLLM(BaseLLM):
                 return f"LLM error: {e}"
             raise
 
+    def chat_stream(self, messages: List[dict]) -> Iterator[str]:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "stream": True,
+        }
+
+        sent = False
+        try:
+            with self._post(payload, self._stream_headers, stream=True) as resp:
+                resp.raise_for_status()
+                # Декодируем сами: у text/event-stream часто нет charset, и requests выбрал бы latin-1
+                for raw in _iter_sse_lines(resp):
+                    done, delta = _sse_delta(raw.decode("utf-8"))
+                    if done:
+                        return
+                    if delta:
+                        sent = True
+                        yield delta
+        except Exception as e:
+            # Оборванный ответ не выдаём за полный: после первого куска ошибку пробрасываем
+            if self.return_errors and not sent:
+                yield f"LLM error: {e}"
+                return
+            raise
+
     def __repr__(self) -> str:
         return f"OpenAICompatLLM(url='{self.url}', model='{self.model}')"
+
+
+class AsyncOpenAICompatLLM(AsyncBaseLLM):
+    """
+    Асинхронный клиент для тех же OpenAI-совместимых API на базе httpx.AsyncClient.
+    Клиент создаётся лениво (уже внутри event loop) и переиспользуется между вызовами.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str],
+        model: str,
+        extra_headers: Optional[Dict[str, str]] = None,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        timeout: int = 60,
+        return_errors: bool = False,
+        client: Optional[httpx.AsyncClient] = None,
+        pool: Optional[HTTPPool] = None,
+    ) -> None:
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.api_key = api_key
+        self.model = model
+        self.extra_headers = extra_headers or {}
+        self.temperature = temperature
+        self.top_p = top_p
+        self.timeout = timeout
+        self.return_errors = return_errors
+        self._client = client
+        self._pool = pool
+        # Клиент из пула принадлежит пулу: его закрывает владелец пула, а не этот объект
+        self._owns_client = client is None and pool is None
+
+        # Заголовки не меняются между запросами — собираем один раз
+        self._headers = {"Content-Type": "application/json", **self.extra_headers}
+        if self.api_key:
+            self._headers["Authorization"] = f"Bearer {self.api_key}"
+        self._stream_headers = {**self._headers, "Accept": "text/event-stream"}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._pool is not None:
+            return self._pool.async_client()
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def chat(self, messages: List[dict]) -> str:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+        }
+
+        try:
+            resp = await self._get_client().post(self.url, headers=self._headers, json=payload)
+            resp.raise_for_status()
+            data = resp.json()
+            return data["choices"][0]["message"]["content"]
+        except Exception as e:
+            if self.return_errors:
+                return f"LLM error: {e}"
+            raise
+
+    async def chat_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "stream": True,
+        }
+        sent = False
+        try:
+            async with self._get_client().stream("POST", self.url, headers=self._stream_headers, json=payload) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    done, delta = _sse_delta(line)
+                    if done:
+                        return
+                    if delta:
+                        sent = True
+                        yield delta
+        except Exception as e:
+            if self.return_errors and not sent:
+                yield f"LLM error: {e}"
+                return
+            raise
+
+    async def aclose(self) -> None:
+        # Чужой (переданный снаружи) клиент не закрываем
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    def __repr__(self) -> str:
+        return f"AsyncOpenAICompatLLM(url='{self.url}', model='{self.model}')"
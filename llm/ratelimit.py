@@ -0,0 +1,426 @@
+# llm/ratelimit.py
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from core.metrics import RATELIMIT_ADJUST, RATELIMIT_QUEUE, RATELIMIT_RATE, RATELIMIT_REJECTED, RATELIMIT_WAIT
+
+# Ключ «пользователя» для лимита на уровне channel:user_id; ставит оркестратор на время хода
+_RATE_KEY: ContextVar[Optional[str]] = ContextVar("orion_rate_key", default=None)
+
+
+class RateLimitExceeded(Exception):
+    """Жетон не получить за допустимое время; retry_after — оценка, когда пробовать снова (с)."""
+
+    def __init__(self, message: str, retry_after: float = 0.0) -> None:
+        super().__init__(message)
+        self.retry_after = max(0.0, float(retry_after))
+
+
+class rate_limit_key:
+    """with rate_limit_key("telegram:42"): ... — вызовы LLM внутри делят лимит этого ключа."""
+
+    def __init__(self, key: Optional[str]) -> None:
+        self.key = key
+
+    def __enter__(self) -> "rate_limit_key":
+        self._prev = _RATE_KEY.get()
+        self._token = _RATE_KEY.set(self.key)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        try:
+            _RATE_KEY.reset(self._token)
+        except ValueError:
+            # генератор докрутили в другом контексте (iterate_in_threadpool)
+            _RATE_KEY.set(self._prev)
+
+
+def current_rate_key() -> Optional[str]:
+    return _RATE_KEY.get()
+
+
+class Bucket:
+    """Жетонный бакет без собственного ожидания: только учёт, решения принимает лимитер."""
+
+    __slots__ = ("rate", "burst", "tokens", "last")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.last = now
+
+    def refill(self, now: float) -> float:
+        if now > self.last:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+        return self.tokens
+
+    def wait_time(self, now: float, need: float = 1.0) -> float:
+        # через сколько секунд накопится need жетонов
+        deficit = need - self.refill(now)
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def set_rate(self, rate: float, now: float) -> None:
+        self.refill(now)
+        self.rate = float(rate)
+
+
+class _Waiter:
+    __slots__ = ("key", "provider", "buckets", "enqueued", "granted", "cancelled", "notify")
+
+    def __init__(self, key: str, provider: str, buckets: Tuple[Bucket, ...], now: float, notify: Callable[[], None]) -> None:
+        self.key = key
+        self.provider = provider
+        self.buckets = buckets
+        self.enqueued = now
+        self.granted = False
+        self.cancelled = False
+        self.notify = notify
+
+
+class RateLimiter:
+    """
+    Иерархический лимитер: запрос проходит, только когда жетон есть сразу на всех уровнях —
+    глобальном, провайдера и ключа channel:user_id (уровень с rate <= 0 отключён).
+
+    Ожидающие стоят в очередях по ключу: внутри ключа FIFO, между ключами — по кругу,
+    поэтому активный чат не выедает общий бюджет у остальных. Будит ожидающих один
+    диспетчер-поток: спит на Condition до ближайшего пополнения или нового запроса и отдаёт
+    жетон событием (sync) или future (async), без опроса и джиттера.
+    max_wait — отказ сразу (RateLimitExceeded), если прогноз ожидания больше.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 0.0,
+        global_burst: float = 1.0,
+        provider_rate: float = 2.0,
+        provider_burst: float = 2.0,
+        key_rate: float = 0.0,
+        key_burst: float = 1.0,
+        provider_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        max_wait: Optional[float] = None,
+        max_keys: int = 100_000,
+    ) -> None:
+        now = time.monotonic()
+        self._global = Bucket(global_rate, global_burst, now) if global_rate > 0 else None
+        self.provider_rate, self.provider_burst = float(provider_rate), float(provider_burst)
+        self.provider_limits = dict(provider_limits or {})
+        self.key_rate, self.key_burst = float(key_rate), float(key_burst)
+        self.max_wait = max_wait if max_wait and max_wait > 0 else None
+        self.max_keys = max(1, int(max_keys))
+
+        self._providers: Dict[str, Optional[Bucket]] = {}
+        self._keys: "OrderedDict[str, Bucket]" = OrderedDict()
+        # очереди ожидания по ключу; порядок ключей — очередь обхода по кругу
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._depth: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._dispatcher: Optional[threading.Thread] = None
+
+        self.granted = 0
+        self.rejected = 0
+        self.wait_max = 0.0
+
+    # --- уровни ---
+
+    def _provider_bucket(self, provider: str, now: float) -> Optional[Bucket]:
+        if provider not in self._providers:
+            rate, burst = self.provider_limits.get(provider, (self.provider_rate, self.provider_burst))
+            self._providers[provider] = Bucket(rate, burst, now) if rate > 0 else None
+        return self._providers[provider]
+
+    def _key_bucket(self, key: str, now: float) -> Optional[Bucket]:
+        if self.key_rate <= 0 or not key:
+            return None
+        b = self._keys.get(key)
+        if b is None:
+            b = self._keys[key] = Bucket(self.key_rate, self.key_burst, now)
+            if len(self._keys) > self.max_keys:
+                # полный бакет без очереди ничего не помнит — его можно забыть
+                for old in list(self._keys)[: len(self._keys) - self.max_keys]:
+                    if old not in self._queues:
+                        del self._keys[old]
+        else:
+            self._keys.move_to_end(key)
+        return b
+
+    def _buckets(self, provider: str, key: str, now: float) -> Tuple[Bucket, ...]:
+        levels = (self._global, self._provider_bucket(provider, now), self._key_bucket(key, now))
+        return tuple(b for b in levels if b is not None)
+
+    def limit_provider(self, provider: str, rate: float, burst: float) -> None:
+        """Лимит конкретного провайдера; на уже заведённый бакет не влияет."""
+        with self._lock:
+            self.provider_limits.setdefault(provider, (float(rate), float(burst)))
+
+    def set_provider_rate(self, provider: str, rate: float) -> None:
+        """Меняет скорость уровня провайдера на лету (см. AIMDController)."""
+        with self._lock:
+            now = time.monotonic()
+            b = self._provider_bucket(provider, now)
+            if b is not None and rate > 0:
+                b.set_rate(rate, now)
+                self._wake.notify()
+
+    def pause_provider(self, provider: str, seconds: float) -> None:
+        """
+        Retry-After для всех: опустошаем бакет провайдера в долг, чтобы следующий жетон
+        появился не раньше чем через seconds. Уже набранный долг не уменьшаем.
+        """
+        with self._lock:
+            now = time.monotonic()
+            b = self._provider_bucket(provider, now)
+            if b is not None and seconds > 0:
+                b.refill(now)
+                b.tokens = min(b.tokens, 1.0 - seconds * b.rate)
+
+    def rate_of(self, provider: str) -> Optional[float]:
+        with self._lock:
+            b = self._provider_bucket(provider, time.monotonic())
+            return b.rate if b is not None else None
+
+    # --- захват ---
+
+    @staticmethod
+    def _ready(buckets: Tuple[Bucket, ...], now: float) -> bool:
+        return all(b.refill(now) >= 1.0 for b in buckets)
+
+    @staticmethod
+    def _take(buckets: Tuple[Bucket, ...]) -> None:
+        for b in buckets:
+            b.tokens -= 1.0
+
+    def _projected_wait(self, provider: str, key: str, qkey: str, buckets: Tuple[Bucket, ...], now: float) -> float:
+        # Оценка сверху: бакет ключа делят только ожидающие этого ключа, остальные уровни — вся очередь провайдера
+        key_bucket = self._keys.get(key)
+        ahead_key = len(self._queues.get(qkey, ()))
+        ahead_provider = self._depth.get(provider, 0)
+        wait = 0.0
+        for b in buckets:
+            ahead = ahead_key if b is key_bucket else ahead_provider
+            wait = max(wait, b.wait_time(now, 1.0 + ahead))
+        return wait
+
+    def _enqueue_or_take(self, provider: str, key: str, notify: Callable[[], None]) -> Optional[_Waiter]:
+        """None — жетон выдан сразу; иначе ожидающий уже в очереди. Вызывать без self._lock."""
+        qkey = key or f"~{provider}"
+        with self._lock:
+            now = time.monotonic()
+            buckets = self._buckets(provider, key, now)
+            if not self._queues and self._ready(buckets, now):
+                self._take(buckets)
+                self.granted += 1
+                RATELIMIT_WAIT.labels(provider).observe(0.0)
+                return None
+            if self.max_wait is not None:
+                projected = self._projected_wait(provider, key, qkey, buckets, now)
+                if projected > self.max_wait:
+                    self.rejected += 1
+                    RATELIMIT_REJECTED.labels(provider, "deadline").inc()
+                    raise RateLimitExceeded(
+                        f"rate limit: projected wait {projected:.2f}s > {self.max_wait:.2f}s", retry_after=projected
+                    )
+            w = _Waiter(qkey, provider, buckets, now, notify)
+            self._queues.setdefault(qkey, deque()).append(w)
+            self._depth[provider] = self._depth.get(provider, 0) + 1
+            RATELIMIT_QUEUE.labels(provider).inc()
+            self._dispatch_locked(now)
+            self._ensure_dispatcher_locked()
+            self._wake.notify()
+            return w
+
+    def _cancel(self, w: _Waiter, reason: str, refund: bool = False) -> bool:
+        """
+        Ожидающий сдаётся. False — жетон уже выдан (гонка с таймаутом): при refund он
+        возвращается в бакеты, иначе вызывающий им пользуется.
+        """
+        with self._lock:
+            if w.granted:
+                if refund:
+                    for b in w.buckets:
+                        b.tokens = min(b.burst, b.tokens + 1.0)
+                    self._wake.notify()
+                return False
+            w.cancelled = True
+            q = self._queues.get(w.key)
+            if q is not None:
+                try:
+                    q.remove(w)
+                except ValueError:
+                    pass
+                if not q:
+                    del self._queues[w.key]
+            self._left_queue_locked(w)
+            self.rejected += 1
+            RATELIMIT_REJECTED.labels(w.provider, reason).inc()
+            self._wake.notify()
+            return True
+
+    def _left_queue_locked(self, w: _Waiter) -> None:
+        self._depth[w.provider] = self._depth.get(w.provider, 1) - 1
+        RATELIMIT_QUEUE.labels(w.provider).dec()
+
+    def _dispatch_locked(self, now: float) -> Optional[float]:
+        """Раздаёт жетоны по кругу между ключами; возвращает время до следующей возможной выдачи."""
+        progress = True
+        while progress and self._queues:
+            progress = False
+            for qkey in list(self._queues):
+                q = self._queues[qkey]
+                w = q[0]
+                if not self._ready(w.buckets, now):
+                    continue
+                self._take(w.buckets)
+                q.popleft()
+                if q:
+                    self._queues.move_to_end(qkey)  # следующий жетон — другому ключу
+                else:
+                    del self._queues[qkey]
+                w.granted = True
+                self._left_queue_locked(w)
+                wait = now - w.enqueued
+                self.granted += 1
+                self.wait_max = max(self.wait_max, wait)
+                RATELIMIT_WAIT.labels(w.provider).observe(wait)
+                w.notify()
+                progress = True
+        if not self._queues:
+            return None
+        return min(max(b.wait_time(now) for b in q[0].buckets) for q in self._queues.values())
+
+    def _ensure_dispatcher_locked(self) -> None:
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._run_dispatcher, name="ratelimit-dispatch", daemon=True)
+            self._dispatcher.start()
+
+    def _run_dispatcher(self) -> None:
+        with self._lock:
+            while True:
+                due = self._dispatch_locked(time.monotonic())
+                if due is None:
+                    # очередь пуста — ждём новых запросов, а долгий простой завершает поток
+                    if not self._wake.wait(timeout=30.0) and not self._queues:
+                        self._dispatcher = None
+                        return
+                else:
+                    self._wake.wait(timeout=max(due, 0.0005))
+
+    def acquire(self, provider: str = "", key: Optional[str] = None, timeout: Optional[float] = None) -> None:
+        """Блокирует поток до выдачи жетона. key по умолчанию — из rate_limit_key()."""
+        key = current_rate_key() if key is None else key
+        ev = threading.Event()
+        w = self._enqueue_or_take(provider, key or "", ev.set)
+        if w is None:
+            return
+        limit = timeout if timeout is not None else self.max_wait
+        if not ev.wait(limit) and self._cancel(w, "timeout"):
+            raise RateLimitExceeded(f"rate limit: no token within {limit:.2f}s", retry_after=limit or 0.0)
+
+    async def aacquire(self, provider: str = "", key: Optional[str] = None, timeout: Optional[float] = None) -> None:
+        key = current_rate_key() if key is None else key
+        loop = asyncio.get_running_loop()
+        fut: "asyncio.Future[None]" = loop.create_future()
+
+        def notify() -> None:
+            loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(None))
+
+        w = self._enqueue_or_take(provider, key or "", notify)
+        if w is None:
+            return
+        limit = timeout if timeout is not None else self.max_wait
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), limit)
+        except asyncio.TimeoutError:
+            if self._cancel(w, "timeout"):
+                raise RateLimitExceeded(f"rate limit: no token within {limit:.2f}s", retry_after=limit or 0.0) from None
+        except asyncio.CancelledError:
+            self._cancel(w, "cancelled", refund=True)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": sum(len(q) for q in self._queues.values()),
+                "queued_keys": len(self._queues),
+                "tracked_keys": len(self._keys),
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "wait_ms_max": self.wait_max * 1000.0,
+                "providers": {p: (b.rate if b is not None else None) for p, b in self._providers.items()},
+            }
+
+
+class AIMDController:
+    """
+    Подстройка скорости провайдера по ответам: 429 — умножаем rate на decrease (не чаще раза
+    за cooldown, чтобы пачка отказов от одного всплеска не обрушила скорость до минимума),
+    успех — прибавляем increase / rate, т.е. примерно +increase rps за секунду успешной работы.
+    Retry-After из 429 дополнительно ставит весь провайдер на паузу.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        provider: str,
+        min_rate: float = 0.1,
+        max_rate: Optional[float] = None,
+        decrease: float = 0.5,
+        increase: float = 0.1,
+        cooldown: float = 1.0,
+    ) -> None:
+        self.limiter = limiter
+        self.provider = provider
+        start = limiter.rate_of(provider)
+        if start is None:
+            raise ValueError(f"provider {provider!r} has no rate limit to adapt")
+        self.rate = start
+        self.min_rate = max(1e-3, float(min_rate))
+        self.max_rate = float(max_rate) if max_rate else start
+        self.decrease = min(max(float(decrease), 0.05), 0.99)
+        self.increase = max(0.0, float(increase))
+        self.cooldown = max(0.0, float(cooldown))
+        self._last_cut = float("-inf")
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self._m_rate = RATELIMIT_RATE.labels(provider)
+        self._m_rate.set(self.rate)
+
+    def on_success(self) -> None:
+        if self.increase <= 0:
+            return
+        with self._lock:
+            if self.rate >= self.max_rate:
+                return
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            rate = self.rate
+        self.limiter.set_provider_rate(self.provider, rate)
+        self._m_rate.set(rate)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.throttled += 1
+            cut = now - self._last_cut >= self.cooldown
+            if cut:
+                self._last_cut = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+            rate = self.rate
+        if cut:
+            self.limiter.set_provider_rate(self.provider, rate)
+            self._m_rate.set(rate)
+            RATELIMIT_ADJUST.labels(self.provider).inc()
+        if retry_after:
+            self.limiter.pause_provider(self.provider, retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"rate": self.rate, "min_rate": self.min_rate, "max_rate": self.max_rate, "throttled": self.throttled}
@@ -0,0 +1,218 @@
+# llm/transport.py
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from core.logging import get_logger  # type: ignore
+except ImportError:
+    import logging
+    get_logger = logging.getLogger
+
+
+class HTTPPool:
+    """
+    Общий пул keep-alive соединений к одному провайдеру.
+    Синхронный путь — requests.Session с HTTPAdapter, асинхронный — httpx.AsyncClient
+    (HTTP/2 доступен только ему: requests умеет лишь HTTP/1.1).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        headers: Optional[Dict[str, str]] = None,
+        pool_size: int = 10,
+        per_host: int = 20,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        http2: bool = False,
+        keepalive_expiry: float = 30.0,
+    ) -> None:
+        self.name = name
+        self.log = get_logger(f"HTTPPool[{name}]")
+        self.headers = dict(headers or {})
+        self.pool_size = max(1, int(pool_size))    # сколько хостов держим в кэше пулов
+        self.per_host = max(1, int(per_host))      # соединений на один хост
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.keepalive_expiry = float(keepalive_expiry)
+        self.http2 = bool(http2) and self._h2_available()
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.per_host, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._async: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._async_requests = 0
+        self._async_new_conns = 0
+        self._async_active = 0
+
+    def _h2_available(self) -> bool:
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            self.log.warning("HTTP/2 запрошен, но пакет h2 не установлен — используем HTTP/1.1")
+            return False
+
+    # --- синхронный путь ---
+
+    def post(self, url: str, *, json: Any, headers: Optional[Dict[str, str]] = None, stream: bool = False) -> requests.Response:
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return self.session.post(url, json=json, headers=headers, timeout=self.timeout, stream=stream)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    # --- асинхронный путь ---
+
+    def async_client(self) -> httpx.AsyncClient:
+        # Создаём лениво и пересоздаём после aclose (новый event loop, перезапуск lifespan)
+        if self._async is None or self._async.is_closed:
+            connect, read = self.timeout
+            # У httpx нет лимита на хост — общий потолок как у синхронного пула: pool_size хостов × per_host
+            total = self.pool_size * self.per_host
+            transport = httpx.AsyncHTTPTransport(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=total,
+                    max_keepalive_connections=total,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+            self._async = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(read, connect=connect),
+                transport=_CountingTransport(transport, self),
+            )
+        return self._async
+
+    # --- статистика и закрытие ---
+
+    def stats(self) -> Dict[str, Any]:
+        requests_total = 0
+        new_conns = 0
+        idle = 0
+        for pool in self._sync_pools():
+            requests_total += getattr(pool, "num_requests", 0)
+            new_conns += getattr(pool, "num_connections", 0)
+            queue = getattr(getattr(pool, "pool", None), "queue", None) or []
+            idle += sum(1 for c in list(queue) if c is not None)
+
+        return {
+            "sync": {
+                "requests": requests_total,
+                "new_connections": new_conns,
+                "reuse_ratio": _reuse_ratio(requests_total, new_conns),
+                "active": self._in_flight,
+                "idle": idle,
+            },
+            "async": {
+                "requests": self._async_requests,
+                "new_connections": self._async_new_conns,
+                "reuse_ratio": _reuse_ratio(self._async_requests, self._async_new_conns),
+                "active": self._async_active,
+                "http2": self.http2,
+            },
+        }
+
+    def _sync_pools(self) -> list:
+        pools = []
+        for adapter in {id(a): a for a in self.session.adapters.values()}.values():
+            manager = getattr(adapter, "poolmanager", None)
+            container = getattr(manager, "pools", None)
+            if container is None:
+                continue
+            for key in list(container.keys()):
+                pool = container.get(key)
+                if pool is not None:
+                    pools.append(pool)
+        return pools
+
+    def close(self) -> None:
+        self.session.close()
+
+    async def aclose(self) -> None:
+        if self._async is not None:
+            await self._async.aclose()
+            self._async = None
+        self.close()
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """
+    Обёртка транспорта httpx для статистики пула без доступа к его внутренностям:
+    новые соединения считаем по trace-событиям httpcore (публичное расширение запроса),
+    активные — запросы, чей ответ ещё не дочитан и не закрыт.
+    """
+
+    _CONNECT_EVENTS = ("connection.connect_tcp.complete", "connection.connect_unix_socket.complete")
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, pool: HTTPPool) -> None:
+        self.inner = inner
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        pool = self.pool
+        user_trace = request.extensions.get("trace")
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            if event in self._CONNECT_EVENTS:
+                pool._async_new_conns += 1
+            if user_trace is not None:
+                await user_trace(event, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        pool._async_requests += 1
+        pool._async_active += 1
+        try:
+            response = await self.inner.handle_async_request(request)
+        except BaseException:
+            pool._async_active -= 1
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, self._release),  # type: ignore[arg-type]
+            extensions=response.extensions,
+        )
+
+    def _release(self) -> None:
+        self.pool._async_active -= 1
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Any) -> None:
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):  # type: ignore[override]
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close, on_close = None, self._on_close
+                on_close()
+
+
+def _reuse_ratio(requests_total: int, new_conns: int) -> float:
+    if requests_total <= 0:
+        return 0.0
+    return max(0.0, 1.0 - new_conns / requests_total)
@@ -0,0 +1,56 @@
+from __future__ import annotations
+import argparse
+
+import numpy as np
+
+from core.config import settings
+from vectorstores.numpy_store import NumpyVectorStore
+from vectorstores.ann import recall_at_k
+
+
+def main():
+    ap = argparse.ArgumentParser(description="recall@k IVF-индекса против полного перебора")
+    ap.add_argument("--path", default=settings.NUMPY_STORE_PATH, help="файл NumpyVectorStore")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--nlist", type=int, default=settings.IVF_NLIST)
+    ap.add_argument("--train-min", type=int, default=None,
+                    help="обучать IVF с этого числа векторов (по умолчанию 39×nlist)")
+    ap.add_argument("--nprobe", default="1,2,4,8,16,32", help="значения nprobe через запятую")
+    ap.add_argument("--noise", type=float, default=0.05, help="шум к векторам корпуса для запросов")
+    args = ap.parse_args()
+
+    # Эмбеддер не нужен: запросы берём из самих векторов корпуса с шумом
+    store = NumpyVectorStore(
+        embeddings=None, path=args.path, index="ivf", nlist=args.nlist, train_min=args.train_min,
+    )
+    matrix = store.raw()
+    if len(store) == 0:
+        raise RuntimeError(f"[ann_recall] хранилище {args.path} пустое")
+    if not store.ann_trained:
+        # Необученный IVF отвечает полным перебором — recall был бы 1.0 и ничего не значил
+        raise RuntimeError(
+            f"[ann_recall] IVF не обучен: rows={len(store)} меньше порога обучения; "
+            f"уменьшите --nlist или задайте --train-min"
+        )
+    print(f"[ann_recall] rows={len(store)} dim={matrix.shape[1]} nlist={args.nlist} k={args.k}")
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(store), size=min(args.queries, len(store)), replace=False)
+    queries = np.asarray(matrix[picks]) + rng.normal(0.0, args.noise, size=(len(picks), matrix.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    for nprobe in [int(x) for x in args.nprobe.split(",") if x.strip()]:
+        res = recall_at_k(
+            lambda q, k: store.top_k(q, k, nprobe=nprobe),
+            store.exact_top_k,
+            queries,
+            k=args.k,
+        )
+        print(
+            f"  nprobe={nprobe:<4} recall@{args.k}={res['recall']:.3f} "
+            f"ann={res['ann_ms']:.2f} ms exact={res['exact_ms']:.2f} ms"
+        )
+
+if __name__ == "__main__":
+    main()
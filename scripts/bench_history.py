@@ -0,0 +1,83 @@
+from __future__ import annotations
+import argparse
+import copy
+import threading
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, List
+
+from core.history import HistoryRepository
+
+
+class LegacyHistoryRepository:
+    """Прежняя реализация (глобальный Lock, срез списка на запись, deepcopy на чтение) — для сравнения."""
+
+    def __init__(self, window: int = 20, max_keys: int | None = None):
+        self._store: Dict[str, List[dict]] = defaultdict(list)
+        self._win = window
+        self._lock = Lock()
+        self._max_keys = max_keys
+
+    @staticmethod
+    def _key(channel: str, user_id: str) -> str:
+        return f"{channel}:{user_id}"
+
+    def messages(self, channel: str, user_id: str) -> List[dict]:
+        with self._lock:
+            msgs = self._store[self._key(channel, user_id)][-self._win:]
+            return copy.deepcopy(msgs)
+
+    def append(self, channel: str, user_id: str, role: str, content: str) -> None:
+        key = self._key(channel, user_id)
+        with self._lock:
+            if self._max_keys is not None and key not in self._store and len(self._store) >= self._max_keys:
+                self._store.pop(next(iter(self._store)), None)
+            self._store[key].append({"role": role, "content": content, "ts": time.time()})
+            self._store[key] = self._store[key][-self._win:]
+
+
+def _turns(repo, users: int, turns: int, offset: int = 0) -> None:
+    # Один ход диалога как в оркестраторе: append(user) → messages → append(assistant)
+    text = "x" * 200
+    for t in range(turns):
+        uid = str(offset + t % users)
+        repo.append("web", uid, "user", text)
+        repo.messages("web", uid)
+        repo.append("web", uid, "assistant", text)
+
+
+def _run(repo, threads: int, users: int, turns: int) -> float:
+    started = time.perf_counter()
+    if threads <= 1:
+        _turns(repo, users, turns)
+    else:
+        pool = [
+            threading.Thread(target=_turns, args=(repo, users, turns // threads, i * users))
+            for i in range(threads)
+        ]
+        for th in pool:
+            th.start()
+        for th in pool:
+            th.join()
+    return turns / (time.perf_counter() - started)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Микробенчмарк HistoryRepository против прежней реализации")
+    ap.add_argument("--turns", type=int, default=200_000)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--window", type=int, default=20)
+    ap.add_argument("--threads", default="1,8", help="число потоков через запятую")
+    args = ap.parse_args()
+
+    for threads in [int(x) for x in args.threads.split(",") if x.strip()]:
+        legacy = _run(LegacyHistoryRepository(window=args.window), threads, args.users, args.turns)
+        current = _run(HistoryRepository(window=args.window), threads, args.users, args.turns)
+        print(
+            f"[bench_history] threads={threads:<3} legacy={legacy:,.0f} turns/s "
+            f"ring={current:,.0f} turns/s x{current / legacy:.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
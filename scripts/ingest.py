@@ -0,0 +1,65 @@
+from __future__ import annotations
+import argparse
+import os
+import sys
+
+from core.config import settings
+from vectorstores.factory import make_store
+from services.ingest import DEFAULT_EXTS, IngestPipeline, IngestStats, default_embedder
+from services.manifest import IndexManifest
+
+
+def _report(stats: IngestStats) -> None:
+    print(f"[ingest] {stats.line()}", file=sys.stderr, flush=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Массовая загрузка txt/md/jsonl в векторное хранилище")
+    ap.add_argument("root", help="каталог или файл корпуса")
+    ap.add_argument("--provider", default=settings.VS_PROVIDER, help="chroma | qdrant | numpy")
+    ap.add_argument("--exts", default=",".join(DEFAULT_EXTS), help="расширения через запятую")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                    help="процессов для эмбеддинга (0 — в текущем процессе)")
+    ap.add_argument("--batch", type=int, default=64, help="чанков в батче эмбеддинга")
+    ap.add_argument("--upsert-batch", type=int, default=512, help="максимум записей в одном upsert")
+    ap.add_argument("--max-pending", type=int, default=None, help="батчей в работе (по умолчанию 2×workers)")
+    ap.add_argument("--chunk-size", type=int, default=settings.INDEX_CHUNK_SIZE, help="размер чанка, символов")
+    ap.add_argument("--overlap", type=int, default=settings.INDEX_CHUNK_OVERLAP, help="перекрытие чанков, символов")
+    ap.add_argument("--incremental", action="store_true",
+                    help="только новые/изменённые чанки по манифесту; пропавшие документы удаляются")
+    ap.add_argument("--manifest", default=settings.INDEX_MANIFEST_PATH, help="файл манифеста для --incremental")
+    ap.add_argument("--progress-every", type=float, default=2.0, help="период отчёта, секунд")
+    args = ap.parse_args()
+
+    store = make_store(args.provider)
+    if store is None:
+        raise RuntimeError("VectorStore factory вернул None")
+
+    manifest = IndexManifest(args.manifest) if args.incremental else None
+    print(
+        f"[ingest] provider={args.provider} root={args.root} workers={args.workers} batch={args.batch}"
+        f" incremental={args.incremental}"
+    )
+    pipeline = IngestPipeline(
+        store,
+        workers=args.workers,
+        # workers=0 — векторы считает сам стор своим эмбеддером (с его кэшем)
+        embedder_factory=default_embedder if args.workers > 0 else None,
+        batch_size=args.batch,
+        upsert_batch=args.upsert_batch,
+        max_pending=args.max_pending,
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+        manifest=manifest,
+        progress=_report,
+        progress_every=args.progress_every,
+    )
+    try:
+        stats = pipeline.run(args.root, exts=[e for e in args.exts.split(",") if e.strip()])
+    finally:
+        if manifest is not None:
+            manifest.close()
+    print(f"[ingest] готово: {stats.line()}")
+
+if __name__ == "__main__":
+    main()
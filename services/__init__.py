@@ -1,10 +1,20 @@
 from .orchestrator import ChatOrchestrator
-from .retriever import Retriever
+from .retriever import CoalescingRetriever, Retriever
 from .prompts import build_system_preamble, make_context_system_message
+from .semantic_cache import SemanticCache
+from .ingest import IngestPipeline, IngestStats
+from .manifest import IndexManifest
+from .compaction import Compactor
 
 __all__ = [
     "ChatOrchestrator",
     "Retriever",
+    "CoalescingRetriever",
+    "SemanticCache",
+    "IngestPipeline",
+    "IngestStats",
+    "IndexManifest",
+    "Compactor",
     "build_system_preamble",
     "make_context_system_message",
 ]
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+from core.history import HistoryRepository, Message
+from core.logging import get_logger
+from core.tokens import message_tokens, messages_tokens
+from llm.base import BaseLLM
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
+_SUMMARIZER_PROMPT = (
+    "Сожми переписку ассистента с пользователем в краткую сводку для продолжения диалога. "
+    "Сохрани факты о пользователе, имена, числа, принятые решения и открытые вопросы. "
+    "Без вступлений и оценок, на языке переписки."
+)
+
+_STOP = object()
+
+
+def parse_thresholds(items: Iterable[str]) -> Dict[str, int]:
+    """«telegram=2000», «web=6000» → {канал: порог}; битые пары пропускаем."""
+    out: Dict[str, int] = {}
+    for item in items:
+        name, sep, value = item.partition("=")
+        if sep and name.strip() and value.strip().isdigit():
+            out[name.strip()] = int(value)
+    return out
+
+
+class Compactor:
+    """
+    Фоновое сжатие длинных диалогов: когда окно истории ключа превышает порог в токенах,
+    старые ходы (всё, кроме keep_recent последних) пересказываются LLM и заменяются
+    одним system-сообщением со сводкой. Запрос пользователя не ждёт: работа в отдельном потоке,
+    а замена применяется, только если окно не сдвинулось за время пересказа.
+    """
+
+    def __init__(
+        self,
+        history: HistoryRepository,
+        llm: BaseLLM,
+        threshold_tokens: int = 3000,
+        keep_recent: int = 6,
+        channels: Optional[Sequence[str]] = None,
+        thresholds: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self.log = get_logger("compaction")
+        self.history = history
+        self.llm = llm
+        self.threshold = max(1, int(threshold_tokens))
+        self.keep_recent = max(1, int(keep_recent))
+        # Пустой список каналов — все; thresholds переопределяет порог для отдельных каналов
+        self.channels = set(channels or ())
+        self.thresholds = dict(thresholds or {})
+
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._scheduled: set = set()
+        self._lock = threading.Condition()
+
+        self.scheduled = 0
+        self.compactions = 0
+        self.stale = 0
+        self.skipped = 0
+        self.errors = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.summarize_ms_max = 0.0
+        self._worker = threading.Thread(target=self._run, name="history-compactor", daemon=True)
+        self._worker.start()
+
+    def threshold_for(self, channel: str) -> Optional[int]:
+        if self.channels and channel not in self.channels and channel not in self.thresholds:
+            return None
+        return self.thresholds.get(channel, self.threshold)
+
+    def maybe_schedule(self, channel: str, user_id: str) -> bool:
+        """Дешёвая проверка после хода (токены сообщений кэшируются); True — поставлено в очередь."""
+        threshold = self.threshold_for(channel)
+        if threshold is None or not self._worker.is_alive():
+            return False
+        messages = self.history.messages(channel, user_id)
+        if len(messages) <= self.keep_recent + 1 or messages_tokens(messages) <= threshold:
+            return False
+        key = (channel, user_id)
+        with self._lock:
+            if key in self._scheduled:
+                return False
+            self._scheduled.add(key)
+            self.scheduled += 1
+        self._queue.put(key)
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт, пока очередь сжатия опустеет (для тестов и остановки)."""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._scheduled, timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._worker.is_alive():
+            self._queue.put(_STOP)
+            self._worker.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "scheduled": self.scheduled,
+                "queued": len(self._scheduled),
+                "compactions": self.compactions,
+                "stale": self.stale,
+                "skipped": self.skipped,
+                "errors": self.errors,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "tokens_saved": self.tokens_before - self.tokens_after,
+                # во сколько раз в среднем уменьшился промпт сжатых диалогов
+                "reduction": (1.0 - self.tokens_after / self.tokens_before) if self.tokens_before else 0.0,
+                "summarize_ms_max": self.summarize_ms_max,
+            }
+
+    # --- фоновый поток ---
+
+    def _run(self) -> None:
+        while True:
+            key = self._queue.get()
+            if key is _STOP:
+                return
+            try:
+                self._compact(*key)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                self.log.warning("compaction of %s:%s failed: %s", key[0], key[1], e)
+            finally:
+                with self._lock:
+                    self._scheduled.discard(key)
+                    self._lock.notify_all()
+
+    def _compact(self, channel: str, user_id: str) -> None:
+        messages = self.history.messages(channel, user_id)
+        older, recent = messages[: -self.keep_recent], messages[-self.keep_recent :]
+        if not older or (len(older) == 1 and older[0]["role"] == "system"):
+            return  # сжимать нечего: только прошлая сводка
+        before = messages_tokens(messages)
+
+        t0 = time.perf_counter()
+        summary = (self.llm.chat(self._prompt(older)) or "").strip()
+        dt = (time.perf_counter() - t0) * 1000.0
+
+        msg = Message("system", SUMMARY_PREFIX + summary)
+        if not summary or message_tokens(msg) >= messages_tokens(older):
+            with self._lock:
+                self.skipped += 1
+            return
+        applied = self.history.append_system(channel, user_id, msg["content"], replaces=older)
+        after = messages_tokens(recent) + message_tokens(msg)
+        with self._lock:
+            self.summarize_ms_max = max(self.summarize_ms_max, dt)
+            if not applied:
+                self.stale += 1
+                return
+            self.compactions += 1
+            self.tokens_before += before
+            self.tokens_after += after
+        self.log.info(
+            "compacted %s:%s: %d → %d tokens (%d turns into summary, %.0f ms)",
+            channel, user_id, before, after, len(older), dt,
+        )
+
+    @staticmethod
+    def _prompt(older: Sequence[Message]) -> list:
+        lines = []
+        for m in older:
+            content = m["content"]
+            if m["role"] == "system" and content.startswith(SUMMARY_PREFIX):
+                # прошлая сводка тоже входит в новую — сводка «катится»
+                lines.append(f"[сводка ранее]: {content[len(SUMMARY_PREFIX):]}")
+            else:
+                lines.append(f"{m['role']}: {content}")
+        return [
+            {"role": "system", "content": _SUMMARIZER_PROMPT},
+            {"role": "user", "content": "\n".join(lines)},
+        ]
+
+
+def make_compactor(history: HistoryRepository, llm: Optional[BaseLLM] = None) -> Optional[Compactor]:
+    """Compactor по настройкам; None, если сжатие выключено."""
+    from core.config import settings
+    from llm.factory import make_llm
+
+    if not settings.COMPACTION_ENABLED:
+        return None
+    if settings.COMPACTION_PROVIDER or settings.COMPACTION_MODEL or llm is None:
+        # отдельный (обычно более дешёвый) клиент; кэш ответов для пересказов бесполезен
+        llm = make_llm(
+            settings.COMPACTION_PROVIDER or settings.LLM_PROVIDER,
+            with_cache=False,
+            model=settings.COMPACTION_MODEL or None,
+        )
+    return Compactor(
+        history,
+        llm,
+        threshold_tokens=settings.COMPACTION_THRESHOLD_TOKENS,
+        keep_recent=settings.COMPACTION_KEEP_RECENT,
+        channels=settings.COMPACTION_CHANNELS,
+        thresholds=parse_thresholds(settings.COMPACTION_THRESHOLDS),
+    )
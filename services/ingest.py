@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import json
+import multiprocessing as mp
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from core.logging import get_logger
+from vectorstores.base import BaseVectorStore
+
+from .manifest import IndexManifest, chunk_hash, chunk_id, doc_digest
+
+if TYPE_CHECKING:
+    from embedder.base import BaseEmbedder
+
+DEFAULT_EXTS = ("txt", "md", "jsonl")
+
+
+@dataclass(frozen=True)
+class SourceDoc:
+    source: str
+    text: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class IngestStats:
+    docs: int = 0
+    chunks: int = 0
+    batches: int = 0
+    unchanged: int = 0  # документы, пропущенные по манифесту
+    reused: int = 0     # чанки изменённых документов, уже лежащие в сторе
+    deleted: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return max(1e-9, (self.finished or time.monotonic()) - self.started)
+
+    @property
+    def docs_per_s(self) -> float:
+        return self.docs / self.elapsed
+
+    @property
+    def chunks_per_s(self) -> float:
+        return self.chunks / self.elapsed
+
+    def line(self) -> str:
+        return (
+            f"docs={self.docs} chunks={self.chunks} batches={self.batches} "
+            f"unchanged={self.unchanged} reused={self.reused} deleted={self.deleted} "
+            f"{self.docs_per_s:.1f} docs/s {self.chunks_per_s:.1f} chunks/s elapsed={self.elapsed:.1f}s"
+        )
+
+
+# --- чтение корпуса ---
+
+def iter_documents(root: str, exts: Sequence[str] = DEFAULT_EXTS) -> Iterator[SourceDoc]:
+    """
+    Обходит каталог (или один файл) лениво: в памяти только текущий документ.
+    txt/md — документ на файл, jsonl — документ на строку (поле text или content).
+    """
+    allowed = {e.lower().lstrip(".") for e in exts}
+    base = Path(root)
+    if base.is_file():
+        files: Iterable[Path] = [base]
+    else:
+        files = _walk(base)
+    for path in files:
+        ext = path.suffix.lower().lstrip(".")
+        if ext not in allowed:
+            continue
+        if ext == "jsonl":
+            yield from _iter_jsonl(path)
+        else:
+            text = path.read_text(encoding="utf-8", errors="replace")
+            if text.strip():
+                yield SourceDoc(source=str(path), text=text)
+
+
+def _walk(base: Path) -> Iterator[Path]:
+    # os.walk с сортировкой — детерминированный порядок без списка всех файлов разом
+    for dirpath, dirnames, filenames in os.walk(base):
+        dirnames.sort()
+        for name in sorted(filenames):
+            yield Path(dirpath) / name
+
+
+def _iter_jsonl(path: Path) -> Iterator[SourceDoc]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(obj, dict):
+                continue
+            text = obj.get("text") or obj.get("content") or ""
+            if not isinstance(text, str) or not text.strip():
+                continue
+            source = str(obj.get("source") or obj.get("id") or f"{path}#{lineno}")
+            meta = {
+                k: v
+                for k, v in obj.items()
+                if k not in ("text", "content") and isinstance(v, (str, int, float, bool))
+            }
+            yield SourceDoc(source=source, text=text, metadata=meta)
+
+
+def split_text(text: str, size: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """
+    Окна по size символов с перекрытием overlap; границы окна по возможности
+    выравниваем на перевод строки или пробел, чтобы не резать слова.
+    """
+    size = max(1, int(size))
+    overlap = max(0, min(int(overlap), size // 2))
+    n = len(text)
+    start = 0
+    while start < n:
+        end = min(n, start + size)
+        if end < n:
+            floor = start + size // 2
+            cut = max(text.rfind("\n", floor, end), text.rfind(" ", floor, end))
+            if cut > start:
+                end = cut
+        piece = text[start:end].strip()
+        if piece:
+            yield piece
+        if end >= n:
+            break
+        nxt = max(end - overlap, start + 1)
+        if overlap and not text[nxt - 1].isspace():
+            # начало перекрытия тоже выравниваем на границу слова
+            space = text.find(" ", nxt, end)
+            if space != -1:
+                nxt = space + 1
+        start = nxt
+
+
+def iter_chunks(
+    docs: Iterable[SourceDoc],
+    size: int = 1000,
+    overlap: int = 200,
+    stats: Optional[IngestStats] = None,
+) -> Iterator[Tuple[str, Dict[str, Any], str]]:
+    """(текст, metadata, id) чанков; id детерминирован по (source, sha256 текста)."""
+    for doc in docs:
+        if stats is not None:
+            stats.docs += 1
+        for i, piece in enumerate(split_text(doc.text, size, overlap)):
+            yield piece, {**doc.metadata, "source": doc.source, "chunk": i}, chunk_id(doc.source, chunk_hash(piece))
+
+
+# --- эмбеддинг в пуле процессов ---
+
+_WORKER_EMBEDDER: Optional["BaseEmbedder"] = None
+
+
+def default_embedder() -> "BaseEmbedder":
+    # В воркерах без батчера и дискового кэша: append-only файлы кэша не рассчитаны на несколько процессов
+    from embedder.factory import make_embedder
+
+    return make_embedder(batching=False, cache=False)
+
+
+def _init_worker(factory: Callable[[], "BaseEmbedder"]) -> None:
+    global _WORKER_EMBEDDER
+    _WORKER_EMBEDDER = factory()
+
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    assert _WORKER_EMBEDDER is not None, "воркер не инициализирован"
+    return np.asarray(_WORKER_EMBEDDER.embed_documents(texts), dtype=np.float32)
+
+
+class _InlineExecutor(Executor):
+    # workers=0: считаем в текущем процессе тем же интерфейсом Future
+    def submit(self, fn, /, *args, **kwargs):  # type: ignore[override]
+        fut: Future = Future()
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            fut.set_exception(e)
+        return fut
+
+
+@dataclass
+class _DocState:
+    # Документ ждёт записи своих новых чанков, прежде чем попасть в манифест
+    source: str
+    digest: str
+    mapping: Dict[str, str]
+    stale: List[str]
+    remaining: int
+
+
+_Item = Tuple[str, Dict[str, Any], str, Optional[_DocState]]
+_Batch = Tuple[Future, List[str], List[Dict[str, Any]], List[str], List[Optional[_DocState]]]
+
+
+class IngestPipeline:
+    """
+    Массовая загрузка корпуса: чтение → чанки → эмбеддинг батчами в пуле процессов → upsert.
+    Обратное давление: в работе не больше max_pending батчей, чтение ждёт, пока стор их примет,
+    поэтому память ограничена max_pending * batch_size чанками независимо от размера корпуса.
+
+    С manifest загрузка инкрементальная: неизменные документы пропускаются по хэшу,
+    у изменённых эмбеддятся только новые чанки, исчезнувшие чанки и документы удаляются из стора.
+    Без эмбеддера (workers=0, embedder и embedder_factory не заданы) векторы считает сам стор.
+    """
+
+    def __init__(
+        self,
+        store: BaseVectorStore,
+        workers: int = 0,
+        embedder: Optional["BaseEmbedder"] = None,
+        embedder_factory: Optional[Callable[[], "BaseEmbedder"]] = None,
+        batch_size: int = 64,
+        upsert_batch: int = 512,
+        max_pending: Optional[int] = None,
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        manifest: Optional[IndexManifest] = None,
+        progress: Optional[Callable[[IngestStats], None]] = None,
+        progress_every: float = 2.0,
+    ) -> None:
+        self.log = get_logger("ingest")
+        self.store = store
+        self.workers = max(0, int(workers))
+        self.embedder = embedder
+        self.embedder_factory = embedder_factory
+        self.batch_size = max(1, int(batch_size))
+        self.upsert_batch = max(1, int(upsert_batch))
+        self.max_pending = max(1, int(max_pending if max_pending is not None else 2 * max(1, self.workers)))
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.manifest = manifest
+        self.progress = progress
+        self.progress_every = float(progress_every)
+
+    def _executor(self) -> Optional[Executor]:
+        if self.workers == 0:
+            if self.embedder is None and self.embedder_factory is None:
+                return None
+            emb = self.embedder or self.embedder_factory()  # type: ignore[misc]
+            _init_worker(lambda: emb)
+            return _InlineExecutor()
+        # spawn: родитель мог уже загрузить модель/torch, fork с его потоками небезопасен
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.embedder_factory or default_embedder,),
+        )
+
+    def run(self, root: str, exts: Sequence[str] = DEFAULT_EXTS) -> IngestStats:
+        return self.run_docs(iter_documents(root, exts))
+
+    def run_docs(self, docs: Iterable[SourceDoc], prune: Optional[bool] = None) -> IngestStats:
+        """
+        Загружает документы. prune (по умолчанию — при наличии манифеста): docs — полный снимок корпуса,
+        и источники манифеста, которых в нём нет, удаляются из стора.
+        """
+        prune = self.manifest is not None if prune is None else bool(prune)
+        if prune and self.manifest is None:
+            raise ValueError("prune требует manifest")
+        stats = IngestStats()
+        seen: set = set()
+        pending: Deque[_Batch] = deque()
+        last_report = time.monotonic()
+
+        if self.manifest is not None:
+            # staging оборванного запуска; его tombstones удалятся вместе с нынешними
+            self.manifest.discard_staged()
+
+        executor = self._executor()
+        try:
+            for texts, metas, ids, states in _batched(self._plan(docs, stats, seen), self.batch_size):
+                while len(pending) >= self.max_pending:
+                    self._drain_one(pending, stats)
+                if executor is not None:
+                    fut = executor.submit(_embed_batch, texts)
+                else:
+                    fut = Future()
+                    fut.set_result(None)
+                pending.append((fut, texts, metas, ids, states))
+                if self.progress is not None and time.monotonic() - last_report >= self.progress_every:
+                    self.progress(stats)
+                    last_report = time.monotonic()
+            while pending:
+                self._drain_one(pending, stats)
+        finally:
+            for batch in pending:
+                batch[0].cancel()
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+        if prune and self.manifest is not None:
+            for source in self.manifest.sources():
+                if source not in seen:
+                    self.manifest.drop_source(source)
+        self._finish(stats)
+        stats.finished = time.monotonic()
+        if self.progress is not None:
+            self.progress(stats)
+        self.log.info("ingest done: %s", stats.line())
+        return stats
+
+    def _plan(self, docs: Iterable[SourceDoc], stats: IngestStats, seen: set) -> Iterator[_Item]:
+        if self.manifest is None:
+            for text, meta, cid in iter_chunks(docs, self.chunk_size, self.overlap, stats):
+                yield text, meta, cid, None
+            return
+
+        for doc in docs:
+            stats.docs += 1
+            seen.add(doc.source)
+            digest = doc_digest(doc.text, self.chunk_size, self.overlap)
+            if self.manifest.digest(doc.source) == digest:
+                stats.unchanged += 1
+                continue
+            old = self.manifest.chunks(doc.source)
+            mapping: Dict[str, str] = {}
+            fresh: List[Tuple[str, Dict[str, Any], str]] = []
+            for i, piece in enumerate(split_text(doc.text, self.chunk_size, self.overlap)):
+                h = chunk_hash(piece)
+                if h in mapping:
+                    continue
+                mapping[h] = cid = chunk_id(doc.source, h)
+                if h in old:
+                    stats.reused += 1  # metadata chunk у такого чанка остаётся от прошлой нарезки
+                else:
+                    fresh.append((piece, {**doc.metadata, "source": doc.source, "chunk": i}, cid))
+            state = _DocState(
+                source=doc.source,
+                digest=digest,
+                mapping=mapping,
+                stale=[cid for h, cid in old.items() if h not in mapping],
+                remaining=len(fresh),
+            )
+            if not fresh:
+                self._commit(state)
+            for text, meta, cid in fresh:
+                yield text, meta, cid, state
+
+    def _commit(self, state: _DocState) -> None:
+        assert self.manifest is not None
+        # в манифест документ попадёт в _finish — после сохранения стора
+        self.manifest.stage(state.source, state.digest, state.mapping, state.stale)
+
+    def _finish(self, stats: IngestStats) -> None:
+        """
+        Стор сохраняется один раз за запуск: запись всего корпуса — время диффа, а не корпуса.
+        Порядок: одно delete всех устаревших id, flush, перенос staging в манифест,
+        снятие tombstones. Обрыв до promote лишь повторит документы этого запуска:
+        id чанков детерминированы, повторная запись — upsert.
+        """
+        if self.manifest is None:
+            self.store.flush()
+            return
+        ids = self.manifest.pending_deletes()
+        if ids:
+            stats.deleted += self.store.delete(ids)
+        self.store.flush()
+        self.manifest.promote()
+        self.manifest.clear_tombstones(ids)
+
+    def _drain_one(self, pending: Deque[_Batch], stats: IngestStats) -> None:
+        # FIFO: ждём самый старый батч — порядок записи совпадает с порядком корпуса
+        fut, texts, metas, ids, states = pending.popleft()
+        vectors = fut.result()
+        for i in range(0, len(texts), self.upsert_batch):
+            j = i + self.upsert_batch
+            if vectors is None:
+                self.store.add_texts(texts[i:j], metadatas=metas[i:j], ids=ids[i:j])
+            else:
+                self.store.add_embeddings(texts[i:j], vectors[i:j], metadatas=metas[i:j], ids=ids[i:j])
+        stats.chunks += len(texts)
+        stats.batches += 1
+
+        for state in states:
+            if state is not None:
+                state.remaining -= 1
+                if state.remaining == 0:
+                    self._commit(state)
+
+
+def _batched(
+    items: Iterable[_Item], size: int
+) -> Iterator[Tuple[List[str], List[Dict[str, Any]], List[str], List[Optional[_DocState]]]]:
+    texts: List[str] = []
+    metas: List[Dict[str, Any]] = []
+    ids: List[str] = []
+    states: List[Optional[_DocState]] = []
+    for text, meta, cid, state in items:
+        texts.append(text)
+        metas.append(meta)
+        ids.append(cid)
+        states.append(state)
+        if len(texts) >= size:
+            yield texts, metas, ids, states
+            texts, metas, ids, states = [], [], [], []
+    if texts:
+        yield texts, metas, ids, states
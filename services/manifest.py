@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Фиксированное пространство имён: один и тот же (source, hash) всегда даёт тот же id
+_ID_NAMESPACE = uuid.UUID("6f1c2a4e-3b7d-5e8f-9a0b-1c2d3e4f5a6b")
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source: str, digest: str) -> str:
+    # UUID-строка: такой id принимают и Chroma, и Qdrant
+    return str(uuid.uuid5(_ID_NAMESPACE, f"{source}\0{digest}"))
+
+
+def doc_digest(text: str, chunk_size: int, overlap: int) -> str:
+    # Параметры нарезки входят в хэш: при их смене документ пересобирается
+    return hashlib.sha256(f"{chunk_size}:{overlap}\0{text}".encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    """
+    Локальный манифест индекса (SQLite): какие чанки (source, hash) → id уже лежат в сторе.
+    Документ фиксируется в манифесте только после записи всех его новых чанков;
+    устаревшие id сначала попадают в tombstones и вычищаются из стора отдельно,
+    поэтому обрыв загрузки не оставляет «потерянных» записей.
+    Загрузка пишет документы в staging (stage) и переносит их в манифест одной
+    транзакцией (promote) после единственного сохранения стора.
+    """
+
+    def __init__(self, path: str = "./index_manifest.sqlite3") -> None:
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " source TEXT NOT NULL, hash TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (source, hash))"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS tombstones (id TEXT PRIMARY KEY)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS staged_sources (source TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS staged_chunks ("
+            " source TEXT NOT NULL, hash TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (source, hash))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS staged_stale (source TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (source, id))"
+        )
+
+    # --- чтение ---
+
+    def digest(self, source: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM sources WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def chunks(self, source: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self._db.execute("SELECT hash, id FROM chunks WHERE source = ?", (source,)).fetchall()
+        return dict(rows)
+
+    def sources(self) -> Iterator[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT source FROM sources").fetchall()
+        return (r[0] for r in rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            (n,) = self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()
+        return int(n)
+
+    # --- запись ---
+
+    def commit(self, source: str, digest: str, mapping: Dict[str, str], stale: Iterable[str] = ()) -> None:
+        """Атомарно заменяет чанки документа; stale — id, которые нужно удалить из стора."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self._db.executemany(
+                    "INSERT INTO chunks(source, hash, id) VALUES (?, ?, ?)",
+                    [(source, h, i) for h, i in mapping.items()],
+                )
+                self._db.execute("INSERT OR REPLACE INTO sources(source, digest) VALUES (?, ?)", (source, digest))
+                self._db.executemany("INSERT OR IGNORE INTO tombstones(id) VALUES (?)", [(i,) for i in stale])
+                # чанк мог вернуться в документ, пока его id ждал удаления
+                self._db.executemany("DELETE FROM tombstones WHERE id = ?", [(i,) for i in mapping.values()])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def drop_source(self, source: str) -> int:
+        """Документ исчез из корпуса: все его id уходят в tombstones."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                cur = self._db.execute(
+                    "INSERT OR IGNORE INTO tombstones(id) SELECT id FROM chunks WHERE source = ?", (source,)
+                )
+                self._db.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self._db.execute("DELETE FROM sources WHERE source = ?", (source,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return cur.rowcount
+
+    def stage(self, source: str, digest: str, mapping: Dict[str, str], stale: Iterable[str] = ()) -> None:
+        """Как commit, но в staging: в манифест документ попадёт на promote, после сохранения стора."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for table in ("staged_sources", "staged_chunks", "staged_stale"):
+                    self._db.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+                self._db.execute("INSERT INTO staged_sources(source, digest) VALUES (?, ?)", (source, digest))
+                self._db.executemany(
+                    "INSERT INTO staged_chunks(source, hash, id) VALUES (?, ?, ?)",
+                    [(source, h, i) for h, i in mapping.items()],
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO staged_stale(source, id) VALUES (?, ?)", [(source, i) for i in stale]
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def pending_deletes(self) -> List[str]:
+        """Что удалить из стора до promote: tombstones и устаревшие id staging, кроме вернувшихся в документы."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM tombstones UNION SELECT id FROM staged_stale EXCEPT SELECT id FROM staged_chunks"
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def promote(self) -> int:
+        """Переносит staging в манифест одной транзакцией; возвращает число документов."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                (n,) = self._db.execute("SELECT COUNT(*) FROM staged_sources").fetchone()
+                self._db.execute("DELETE FROM chunks WHERE source IN (SELECT source FROM staged_sources)")
+                self._db.execute("INSERT INTO chunks(source, hash, id) SELECT source, hash, id FROM staged_chunks")
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sources(source, digest) SELECT source, digest FROM staged_sources"
+                )
+                self._db.execute("INSERT OR IGNORE INTO tombstones(id) SELECT id FROM staged_stale")
+                self._db.execute("DELETE FROM tombstones WHERE id IN (SELECT id FROM staged_chunks)")
+                self._clear_staged()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return int(n)
+
+    def discard_staged(self) -> None:
+        """Staging оборванного запуска: стор мог не сохраниться — эти документы просто загрузятся заново."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._clear_staged()
+            self._db.execute("COMMIT")
+
+    def _clear_staged(self) -> None:
+        for table in ("staged_sources", "staged_chunks", "staged_stale"):
+            self._db.execute(f"DELETE FROM {table}")
+
+    def tombstones(self, limit: int = 1000) -> List[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM tombstones LIMIT ?", (int(limit),)).fetchall()
+        return [r[0] for r in rows]
+
+    def clear_tombstones(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._db.executemany("DELETE FROM tombstones WHERE id = ?", [(i,) for i in ids])
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
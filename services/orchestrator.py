@@ -1,16 +1,57 @@
 from __future__ import annotations
-from typing import List, Optional
+import asyncio
+import time
+from typing import AsyncIterator, Iterator, List, Optional, Sequence, Tuple
 
 from core.config import settings
 from core.history import HistoryRepository
 from core.utils import chunk, sanitize
 from core.logging import get_logger
+from core.metrics import HISTORY_LATENCY, LLM_TOKENS
+from core.tracing import span
+from core.tokens import context_window, count_tokens, fit_to_budget, message_tokens, messages_tokens
 
-from llm.factory import make_llm
-from llm.base import BaseLLM
+from llm.factory import make_llm, make_async_llm
+from llm.base import BaseLLM, AsyncBaseLLM
+from llm.ratelimit import rate_limit_key
 
-from .retriever import Retriever
+from .retriever import CoalescingRetriever, Retriever
 from .prompts import make_context_system_message
+from .semantic_cache import SemanticCache, SemanticProbe
+from .compaction import Compactor, make_compactor
+
+
+_HIST_APPEND = HISTORY_LATENCY.labels("append")
+_HIST_MESSAGES = HISTORY_LATENCY.labels("messages")
+
+
+def _model_name(llm: object) -> Optional[str]:
+    # Декораторы оборачивают клиента через .inner — ищем model у базового
+    seen = 0
+    while llm is not None and seen < 16:
+        model = getattr(llm, "model", None)
+        if isinstance(model, str):
+            return model
+        llm = getattr(llm, "inner", None)
+        seen += 1
+    return None
+
+
+def _default_retriever() -> Retriever:
+    r = Retriever()
+    return CoalescingRetriever(r) if settings.RAG_COALESCE else r
+
+
+def _default_semantic_cache() -> Optional[SemanticCache]:
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    from embedder.factory import make_embedder
+
+    return SemanticCache(
+        make_embedder(),
+        threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+        max_entries=settings.SEMANTIC_CACHE_MAX,
+    )
 
 
 class ChatOrchestrator:
@@ -21,44 +62,219 @@ class ChatOrchestrator:
         retriever: Optional[Retriever] = None,
         rag_enabled: bool = False,
         max_part_len: int = 4096 - 16,
+        allm: Optional[AsyncBaseLLM] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        semantic_channels: Optional[List[str]] = None,
+        context_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+        compactor: Optional[Compactor] = None,
     ) -> None:
         self.log = get_logger("orchestrator")
         self.history = history
+        # Если синхронный LLM передан явно, а асинхронный нет — areply уводит его в поток,
+        # чтобы не подменять пользовательский клиент провайдером из настроек
+        if allm is None and llm is None:
+            allm = make_async_llm(settings.LLM_PROVIDER)
         self.llm = llm or make_llm(settings.LLM_PROVIDER)
-        self.retriever = retriever or Retriever()
+        self.allm = allm
+        self.retriever = retriever or _default_retriever()
         self.rag = bool(rag_enabled)
         self.max_part_len = max_part_len
+        self.semantic = semantic_cache if semantic_cache is not None else _default_semantic_cache()
+        self.semantic_channels = set(semantic_channels if semantic_channels is not None else settings.SEMANTIC_CACHE_CHANNELS)
+        # Бюджет промпта в токенах: окно модели минус резерв под ответ (и под RAG-контекст на ходу)
+        self.model_name = _model_name(self.allm if self.allm is not None else self.llm)
+        self.context_tokens = int(
+            context_tokens or settings.LLM_CONTEXT_TOKENS or context_window(self.model_name)
+        )
+        self.completion_tokens = int(
+            completion_tokens if completion_tokens is not None else settings.LLM_MAX_COMPLETION_TOKENS
+        )
+        self.compactor = compactor if compactor is not None else make_compactor(history, self.llm)
+        self._m_prompt_tokens = LLM_TOKENS.labels(self.model_name or "", "prompt")
+        self._m_completion_tokens = LLM_TOKENS.labels(self.model_name or "", "completion")
 
     def set_rag(self, enabled: bool) -> None:
         self.rag = bool(enabled)
-    
+
     def toggle_rag(self) -> bool:
         self.rag = not self.rag
         return self.rag
 
-    def reply(self, channel: str, user_id: str, user_text: str) -> List[str]:        
+    def _with_context(self, messages: Sequence[dict], sys_msg: dict) -> List[dict]:
+        if messages:
+            return [*messages[:-1], sys_msg, messages[-1]]
+        return [sys_msg]
+
+    def _start_turn(self, channel: str, user_id: str, user_text: str) -> Tuple[str, Sequence[dict]]:
         clean = sanitize(user_text or "")
-        self.history.append_user(channel, user_id, clean)
+        with span("history.load"):
+            t0 = time.perf_counter()
+            self.history.append_user(channel, user_id, clean)
+            t1 = time.perf_counter()
+            messages = self.history.messages(channel, user_id)
+            _HIST_MESSAGES.observe(time.perf_counter() - t1)
+            _HIST_APPEND.observe(t1 - t0)
+        return clean, messages
+
+    def _finish_turn(self, channel: str, user_id: str, answer: str) -> None:
+        with span("history.save"):
+            self.history.append_assistant(channel, user_id, answer)
+            if self.compactor is not None:
+                # только постановка в очередь — пересказ идёт в фоне
+                self.compactor.maybe_schedule(channel, user_id)
+
+    def _semantic_namespace(self, channel: str, messages: Sequence[dict]) -> Optional[str]:
+        # Только однократный вопрос: с предысторией тот же текст может значить другое
+        if self.semantic is None or len(messages) != 1:
+            return None
+        if self.semantic_channels and channel not in self.semantic_channels:
+            return None
+        return f"{channel}:rag" if self.rag else channel
+
+    def _semantic_probe(self, channel: str, clean: str, messages: Sequence[dict]) -> Optional[SemanticProbe]:
+        ns = self._semantic_namespace(channel, messages)
+        if ns is None:
+            return None
+        try:
+            with span("semantic_cache.probe"):
+                return self.semantic.probe(ns, clean)
+        except Exception as e:
+            self.log.warning("semantic cache failed: %s", e)
+            return None
 
-        messages = self.history.messages(channel, user_id)
+    async def _asemantic_probe(self, channel: str, clean: str, messages: Sequence[dict]) -> Optional[SemanticProbe]:
+        ns = self._semantic_namespace(channel, messages)
+        if ns is None:
+            return None
+        try:
+            with span("semantic_cache.probe"):
+                return await asyncio.to_thread(self.semantic.probe, ns, clean)
+        except Exception as e:
+            self.log.warning("semantic cache failed: %s", e)
+            return None
 
+    def _remember(self, probe: Optional[SemanticProbe], answer: str) -> None:
+        # Вызывается только после ответа LLM (не на попадании в кэш) — здесь же считаем токены ответа
+        self._m_completion_tokens.inc(count_tokens(answer, self.model_name))
+        if probe is not None:
+            self.semantic.remember(probe, answer)
+
+    def _assemble(self, messages: Sequence[dict], sys_msg: Optional[dict] = None) -> List[dict]:
+        # Свежие сообщения первыми, пока влезают в бюджет; вопрос пользователя — всегда
+        with span("prompt.assemble") as sp:
+            budget = self.context_tokens - self.completion_tokens
+            if sys_msg is not None:
+                budget -= message_tokens(sys_msg, self.model_name)
+            fitted = fit_to_budget(messages, budget, self.model_name)
+            if len(fitted) < len(messages):
+                self.log.debug("prompt trimmed: %d of %d messages fit %d tokens", len(fitted), len(messages), budget)
+            out = self._with_context(fitted, sys_msg) if sys_msg is not None else list(fitted)
+            tokens = messages_tokens(out, self.model_name)
+            sp.set("messages", len(out))
+            sp.set("tokens", tokens)
+        self._m_prompt_tokens.inc(tokens)
+        return out
+
+    def _rag_input(self, clean: str, messages: Sequence[dict]) -> List[dict]:
         if self.rag and self.retriever.available:
             try:
                 rr = self.retriever.retrieve(clean)
-                sys_msg = make_context_system_message(rr).as_chat_dict()
-                if messages:                    
-                    local = [*messages[:-1], sys_msg, messages[-1]]
-                else:
-                    local = [sys_msg]
-                model_input = local
-            except Exception as e:                
+                return self._assemble(messages, make_context_system_message(rr).as_chat_dict())
+            except Exception as e:
                 self.log.warning("retriever failed: %s", e)
-                model_input = messages
-        else:
-            model_input = messages
+        return self._assemble(messages)
 
-        answer = self.llm.chat(model_input) or ""
+    async def _arag_input(self, clean: str, messages: Sequence[dict]) -> List[dict]:
+        if self.rag and self.retriever.available:
+            try:
+                # Эмбеддинг и поиск синхронные и тяжёлые по CPU — уводим из event loop
+                rr = await asyncio.to_thread(self.retriever.retrieve, clean)
+                return self._assemble(messages, make_context_system_message(rr).as_chat_dict())
+            except Exception as e:
+                self.log.warning("retriever failed: %s", e)
+        return self._assemble(messages)
+
+    def reply(self, channel: str, user_id: str, user_text: str) -> List[str]:
+        with span("chat.reply", channel=channel), rate_limit_key(f"{channel}:{user_id}"):
+            clean, messages = self._start_turn(channel, user_id, user_text)
+
+            probe = self._semantic_probe(channel, clean, messages)
+            if probe is not None and probe.answer is not None:
+                answer = probe.answer
+            else:
+                model_input = self._rag_input(clean, messages)
+                answer = self.llm.chat(model_input) or ""
+                self._remember(probe, answer)
+
+            self._finish_turn(channel, user_id, answer)
+
+            return list(chunk(answer, self.max_part_len))
+
+    async def areply(self, channel: str, user_id: str, user_text: str) -> List[str]:
+        with span("chat.reply", channel=channel), rate_limit_key(f"{channel}:{user_id}"):
+            # история (SQLite, блокировки) и постановка пересказа — синхронные, не держим ими event loop
+            clean, messages = await asyncio.to_thread(self._start_turn, channel, user_id, user_text)
+
+            probe = await self._asemantic_probe(channel, clean, messages)
+            if probe is not None and probe.answer is not None:
+                answer = probe.answer
+            else:
+                model_input = await self._arag_input(clean, messages)
+                if self.allm is not None:
+                    answer = await self.allm.chat(model_input) or ""
+                else:
+                    answer = await asyncio.to_thread(self.llm.chat, model_input) or ""
+                self._remember(probe, answer)
+
+            await asyncio.to_thread(self._finish_turn, channel, user_id, answer)
+
+            return list(chunk(answer, self.max_part_len))
+
+    def reply_stream(self, channel: str, user_id: str, user_text: str) -> Iterator[str]:
+        with span("chat.stream", channel=channel), rate_limit_key(f"{channel}:{user_id}"):
+            clean, messages = self._start_turn(channel, user_id, user_text)
+
+            parts: List[str] = []
+            probe = self._semantic_probe(channel, clean, messages)
+            if probe is not None and probe.answer is not None:
+                parts.append(probe.answer)
+                yield probe.answer
+            else:
+                model_input = self._rag_input(clean, messages)
+                for piece in self.llm.chat_stream(model_input):
+                    parts.append(piece)
+                    yield piece
+                self._remember(probe, "".join(parts))
+
+            # В историю пишем только полностью полученный ответ
+            self._finish_turn(channel, user_id, "".join(parts))
+
+    async def areply_stream(self, channel: str, user_id: str, user_text: str) -> AsyncIterator[str]:
+        with span("chat.stream", channel=channel), rate_limit_key(f"{channel}:{user_id}"):
+            clean, messages = await asyncio.to_thread(self._start_turn, channel, user_id, user_text)
+
+            parts: List[str] = []
+            probe = await self._asemantic_probe(channel, clean, messages)
+            if probe is not None and probe.answer is not None:
+                parts.append(probe.answer)
+                yield probe.answer
+            else:
+                model_input = await self._arag_input(clean, messages)
+                if self.allm is not None:
+                    async for piece in self.allm.chat_stream(model_input):
+                        parts.append(piece)
+                        yield piece
+                else:
+                    answer = await asyncio.to_thread(self.llm.chat, model_input) or ""
+                    parts.append(answer)
+                    yield answer
+                self._remember(probe, "".join(parts))
 
-        self.history.append_assistant(channel, user_id, answer)
+            await asyncio.to_thread(self._finish_turn, channel, user_id, "".join(parts))
 
-        return list(chunk(answer, self.max_part_len))
+    async def aclose(self) -> None:
+        if self.compactor is not None:
+            await asyncio.to_thread(self.compactor.close)
+        if self.allm is not None:
+            await self.allm.aclose()
@@ -1,20 +1,39 @@
 from __future__ import annotations
+import time
 from typing import Optional, Sequence, Dict, Any, List
 
 from core.config import settings
 from core.logging import get_logger
+from core.metrics import RETRIEVER_LATENCY
+from core.singleflight import SingleFlight
+from core.tracing import span
 
 from vectorstores.factory import make_store
-from vectorstores.base import BaseVectorStore
+from vectorstores.base import BaseVectorStore, SearchHit
 
 from domain.rag import DocumentChunk, RetrievalResult
 
+from .ingest import IngestPipeline, SourceDoc
+from .manifest import IndexManifest, chunk_hash
+
+_EMBED = RETRIEVER_LATENCY.labels("embed")
+_SEARCH = RETRIEVER_LATENCY.labels("search")
+_TOTAL = RETRIEVER_LATENCY.labels("total")
+
 
 class Retriever:
-    def __init__(self, store: Optional[BaseVectorStore] = None, top_k: int = 3) -> None:
+    def __init__(
+        self,
+        store: Optional[BaseVectorStore] = None,
+        top_k: int = 3,
+        min_score: Optional[float] = None,
+    ) -> None:
         self.log = get_logger("retriever")
-        self.store = store or make_store(getattr(settings, "VS_PROVIDER", "chroma"))
+        # пустой стор ложен по __len__, поэтому сравниваем с None
+        self.store = store if store is not None else make_store(getattr(settings, "VS_PROVIDER", "chroma"))
         self.top_k = int(top_k)
+        # Порог близости: слабые совпадения только раздувают промпт
+        self.min_score = min_score if min_score is not None else getattr(settings, "RAG_MIN_SCORE", None)
 
     @property
     def available(self) -> bool:
@@ -25,22 +44,111 @@ class Retriever:
         texts: Sequence[str],
         metadatas: Optional[Sequence[Dict[str, Any]]] = None,
         ids: Optional[Sequence[str]] = None,
+        incremental: bool = False,
+        manifest: Optional[IndexManifest] = None,
     ) -> int:
-        if not self.store:
+        """
+        incremental=True: texts — полный снимок корпуса; источник документа — ids[i],
+        metadata["source"] или хэш текста. Эмбеддятся только новые/изменённые чанки,
+        пропавшие источники удаляются. Возвращает число записанных чанков.
+        """
+        if self.store is None:
             raise RuntimeError("VectorStore недоступен (VS_PROVIDER=none?)")
-        added = self.store.add_texts(texts, metadatas=metadatas, ids=ids)
-        self.log.info("indexed %d docs into store", added)
-        return added
+        if not incremental:
+            added = self.store.add_texts(texts, metadatas=metadatas, ids=ids)
+            self.store.flush()
+            self.log.info("indexed %d docs into store", added)
+            return added
+
+        docs = []
+        for i, text in enumerate(texts):
+            meta = dict(metadatas[i]) if metadatas is not None else {}
+            source = str(ids[i]) if ids is not None else str(meta.pop("source", "") or chunk_hash(text))
+            meta.pop("source", None)
+            docs.append(SourceDoc(source=source, text=text, metadata=meta))
+
+        own = manifest is None
+        manifest = manifest or IndexManifest(getattr(settings, "INDEX_MANIFEST_PATH", "./index_manifest.sqlite3"))
+        try:
+            stats = IngestPipeline(
+                self.store,
+                manifest=manifest,
+                chunk_size=getattr(settings, "INDEX_CHUNK_SIZE", 1000),
+                overlap=getattr(settings, "INDEX_CHUNK_OVERLAP", 200),
+            ).run_docs(docs)
+        finally:
+            if own:
+                manifest.close()
+        self.log.info(
+            "incremental index: %d new chunks, %d unchanged docs, %d deleted", stats.chunks, stats.unchanged, stats.deleted
+        )
+        return stats.chunks
+
+    def _search(self, query: str, k: int) -> List[SearchHit]:
+        t0 = time.perf_counter()
+        embed = getattr(self.store, "embed_query", None)
+        vector = None
+        if embed is not None:
+            with span("retriever.embed"):
+                vector = embed(query)
+        if vector is not None:
+            t1 = time.perf_counter()
+            with span("retriever.search"):
+                hits = self.store.search_by_vector(vector, k=k)
+            t2 = time.perf_counter()
+            _EMBED.observe(t1 - t0)
+            _SEARCH.observe(t2 - t1)
+        else:
+            # стор эмбеддит внутри поиска — стадии не разделить, пишем только total
+            with span("retriever.search"):
+                hits = self.store.search_with_scores(query, k=k)
+            t2 = time.perf_counter()
+        _TOTAL.observe(t2 - t0)
+        return hits
 
     def retrieve(self, query: str, k: Optional[int] = None) -> RetrievalResult:
-        if not self.store:
+        if self.store is None:
             raise RuntimeError("VectorStore недоступен (VS_PROVIDER=none?)")
         kk = int(k or self.top_k)
-        contents: List[str] = self.store.search(query, k=kk)
+        with span("retriever.retrieve", k=kk) as sp:
+            hits = self._search(query, kk)
+            sp.set("hits", len(hits))
+
+        if self.min_score is not None:
+            kept = [h for h in hits if h.score is None or h.score >= self.min_score]
+            if len(kept) < len(hits):
+                self.log.debug("dropped %d weak chunks (min_score=%.3f)", len(hits) - len(kept), self.min_score)
+            hits = kept
 
         chunks = [
-            DocumentChunk(content=c, source=None, score=None) 
-            for c in contents
+            DocumentChunk(
+                content=h.content,
+                source=h.metadata.get("source"),
+                score=h.score,
+                metadata={**h.metadata, "id": h.id} if h.id is not None else dict(h.metadata),
+            )
+            for h in hits
         ]
         rr = RetrievalResult(query=query, chunks=chunks, k=kk, model_name=getattr(settings, "EMB_MODEL", None))
         return rr
+
+
+class CoalescingRetriever:
+    """
+    Обёртка над Retriever: одинаковые одновременные запросы (query, k) ищутся один раз,
+    остальные получают тот же RetrievalResult. Прочие атрибуты — от обёрнутого.
+    """
+
+    def __init__(self, inner: Retriever, flight: Optional[SingleFlight] = None) -> None:
+        self.inner = inner
+        self.flight = flight or SingleFlight("retriever")
+
+    def retrieve(self, query: str, k: Optional[int] = None) -> RetrievalResult:
+        kk = int(k or self.inner.top_k)
+        return self.flight.do((query, kk), lambda: self.inner.retrieve(query, kk))
+
+    def stats(self) -> Dict[str, Any]:
+        return self.flight.stats()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.inner, name)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.logging import get_logger
+from core.metrics import CACHE_EVENTS
+from embedder.base import BaseEmbedder
+
+
+@dataclass
+class SemanticProbe:
+    namespace: str
+    vector: np.ndarray
+    answer: Optional[str] = None
+    score: float = 0.0
+
+
+_HIT = CACHE_EVENTS.labels("semantic", "hit")
+_MISS = CACHE_EVENTS.labels("semantic", "miss")
+
+
+class _Namespace:
+    """
+    Маленький индекс одного пространства имён: матрица нормированных векторов фиксированной ёмкости.
+    Свободных строк нет — при заполнении перезаписывается давно не использованная (LRU).
+    """
+
+    def __init__(self, dim: int, capacity: int) -> None:
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.used = np.zeros(capacity, dtype=np.float64)
+        self.answers: List[Optional[str]] = [None] * capacity
+        self.size = 0
+
+    def search(self, vec: np.ndarray) -> tuple[int, float]:
+        if self.size == 0:
+            return -1, 0.0
+        scores = self.vectors[: self.size] @ vec
+        i = int(np.argmax(scores))
+        return i, float(scores[i])
+
+    def put(self, vec: np.ndarray, answer: str, now: float) -> bool:
+        # True, если пришлось вытеснить запись
+        if self.size < len(self.answers):
+            row, evicted = self.size, False
+            self.size += 1
+        else:
+            row, evicted = int(np.argmin(self.used)), True
+        self.vectors[row] = vec
+        self.answers[row] = answer
+        self.used[row] = now
+        return evicted
+
+
+class SemanticCache:
+    """
+    Кэш ответов по смыслу: вопрос-перефразировка с косинусной близостью ≥ threshold
+    получает уже готовый ответ без вызова LLM. Отдельные пространства имён на канал.
+    """
+
+    def __init__(self, embedder: BaseEmbedder, threshold: float = 0.92, max_entries: int = 1000) -> None:
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        self.log = get_logger("semantic_cache")
+        self.embedder = embedder
+        self.threshold = float(threshold)
+        self.max_entries = max(1, int(max_entries))
+        self._spaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.lookup_ms_total = 0.0
+        self.lookup_ms_max = 0.0
+
+    def _embed(self, text: str) -> np.ndarray:
+        vec = np.asarray(self.embedder.embed_query(text), dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+
+    def probe(self, namespace: str, text: str) -> SemanticProbe:
+        t0 = time.perf_counter()
+        vec = self._embed(text)
+        probe = SemanticProbe(namespace=namespace, vector=vec)
+        with self._lock:
+            space = self._spaces.get(namespace)
+            if space is not None:
+                i, score = space.search(vec)
+                probe.score = score
+                if i >= 0 and score >= self.threshold:
+                    probe.answer = space.answers[i]
+                    space.used[i] = time.monotonic()
+            dt = (time.perf_counter() - t0) * 1000.0
+            self.lookups += 1
+            self.hits += probe.answer is not None
+            (_MISS if probe.answer is None else _HIT).inc()
+            self.lookup_ms_total += dt
+            self.lookup_ms_max = max(self.lookup_ms_max, dt)
+        return probe
+
+    def remember(self, probe: SemanticProbe, answer: str) -> None:
+        if not answer:
+            return
+        with self._lock:
+            space = self._spaces.get(probe.namespace)
+            if space is None:
+                space = self._spaces[probe.namespace] = _Namespace(len(probe.vector), self.max_entries)
+            self.evictions += space.put(probe.vector, answer, time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": (self.hits / self.lookups) if self.lookups else 0.0,
+                "evictions": self.evictions,
+                "lookup_ms_avg": (self.lookup_ms_total / self.lookups) if self.lookups else 0.0,
+                "lookup_ms_max": self.lookup_ms_max,
+                "entries": {ns: space.size for ns, space in self._spaces.items()},
+            }
@@ -0,0 +1,90 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from api.admission import AdmissionController, ClientDisconnected, Overloaded, run_until_disconnect
+from api.app import create_app
+
+
+def test_bounded_inflight_queue_and_fast_fail():
+    async def go():
+        ctl = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=0.5)
+        await ctl.acquire()
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        assert ctl.stats()["queued"] == 1
+        try:
+            await ctl.acquire()
+        except Overloaded as e:
+            assert e.reason == "queue_full" and e.retry_after >= 1.0
+        else:
+            raise AssertionError("full queue must fail fast")
+        ctl.release(0.2)  # слот переходит ожидающему
+        await waiter
+        assert ctl.inflight == 1 and ctl.stats()["queued"] == 0
+
+        ctl.queue_timeout = 0.02
+        try:
+            await ctl.acquire()
+        except Overloaded as e:
+            assert e.reason == "timeout"
+        ctl.release()
+        assert ctl.inflight == 0
+        return ctl.stats()
+
+    stats = asyncio.run(go())
+    assert stats["admitted"] == 2 and stats["rejected_queue_full"] == 1 and stats["rejected_timeout"] == 1
+
+
+def test_client_disconnect_cancels_work_and_frees_slot():
+    async def go():
+        ctl = AdmissionController(max_inflight=1)
+        cancelled = asyncio.Event()
+
+        async def receive():
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+
+        async def work():
+            async with ctl.slot():
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+
+        try:
+            await run_until_disconnect(receive, work(), ctl)
+        except ClientDisconnected:
+            pass
+        else:
+            raise AssertionError("disconnect must cancel the request")
+        return cancelled.is_set(), ctl.stats()
+
+    cancelled, stats = asyncio.run(go())
+    assert cancelled and stats["inflight"] == 0 and stats["client_disconnects"] == 1
+
+
+def test_saturated_api_returns_429_with_retry_after():
+    class Orch:
+        async def areply(self, channel, user_id, text):
+            return ["ok"]
+
+    app = create_app()
+    app.state.orch = Orch()
+    client = TestClient(app)
+    body = {"channel": "web", "user_id": "u", "text": "x"}
+    assert client.post("/v1/chat", json=body).json()["parts"] == ["ok"]
+
+    adm = app.state.admission
+    adm.max_inflight, adm.max_queue = 1, 0
+    asyncio.run(adm.acquire())  # единственный слот занят настоящим захватом, очереди нет
+    for path in ("/v1/chat", "/v1/chat/stream"):
+        r = client.post(path, json=body)
+        assert r.status_code == 429 and int(r.headers["retry-after"]) >= 1
+    admission = client.get("/healthz").json()["admission"]
+    assert admission["rejected_queue_full"] == 2 and admission["inflight"] == 1
+
+    adm.release()  # отказы слотов не занимали: после освобождения запрос проходит
+    assert client.post("/v1/chat", json=body).json()["parts"] == ["ok"]
+    assert adm.stats()["inflight"] == 0
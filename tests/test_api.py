@@ -39,3 +39,21 @@ def test_chat():
     assert r.json() == {"parts": ["echo: ку"], "provider": "openrouter"}
     
 
+
+
+def test_chat_stream_sse():
+    class FakeStreamingOrchestrator:
+        async def areply_stream(self, channel: str, user_id: str, user_text: str):
+            for piece in ["При", "вет"]:
+                yield piece
+
+    app.state.orch = FakeStreamingOrchestrator()
+
+    r = client.post(
+        "/v1/chat/stream",
+        json={"channel": "web", "user_id": "u-123", "text": "ку"},
+    )
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = [line for line in r.text.split("\n\n") if line]
+    assert events == ['data: {"delta": "При"}', 'data: {"delta": "вет"}', "data: [DONE]"]
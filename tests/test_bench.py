@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+from bench.fake_llm import FakeConfig, LatencyModel, create_fake_app
+from bench.loadgen import histogram_quantile, parse_prometheus, percentile, run_load, summarize
+
+
+def test_fake_server_speaks_chat_completions_and_streams():
+    client = TestClient(create_fake_app(FakeConfig(latency="const:0", tokens=3)))
+    r = client.post("/v1/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "hi"}]})
+    assert r.json()["choices"][0]["message"]["content"].startswith("echo(2)")
+
+    r = client.post("/chat/completions", json={"model": "m", "messages": [], "stream": True})
+    lines = [l for l in r.text.splitlines() if l.startswith("data:")]
+    assert lines[-1] == "data: [DONE]"
+    assert json.loads(lines[0][5:])["choices"][0]["delta"]["content"] == "w0 "
+    assert client.get("/stats").json() == {"requests": 2, "streams": 1, "errors": 0}
+
+def test_fake_server_errors_and_latency_specs():
+    client = TestClient(create_fake_app(FakeConfig(latency="const:0", error_rate=1.0, error_statuses=(429,), retry_after=2)))
+    r = client.post("/v1/chat/completions", json={"messages": []})
+    assert r.status_code == 429 and r.headers["retry-after"] == "2"
+    assert LatencyModel("uniform:10:20").sample_ms() >= 10
+    try:
+        LatencyModel("gauss:1")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("bad spec accepted")
+
+def test_open_loop_load_against_asgi_app():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200 if len(calls) % 5 else 503, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://svc") as client:
+            return await run_load("http://svc", rate=200, duration=0.1, users=3, client=client, seed=1)
+
+    samples = asyncio.run(go())
+    res = summarize(samples, wall_s=0.1)
+    assert res["requests"] == 20 and res["ok"] == 16 and res["errors"] == {"503": 4}
+    assert res["latency_ms"]["p99"] >= res["latency_ms"]["p50"] >= 0
+
+def test_percentiles_and_metrics_parsing():
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    text = (
+        '# TYPE w histogram\n'
+        'w_bucket{provider="p",le="0.1"} 5\n'
+        'w_bucket{provider="p",le="1"} 10\n'
+        'w_bucket{provider="p",le="+Inf"} 10\n'
+        'w_count{provider="p"} 10\n'
+    )
+    parsed = parse_prometheus(text)
+    assert parsed[("w_count", (("provider", "p"),))] == 10
+    assert abs(histogram_quantile([(0.1, 5), (1.0, 10), (float("inf"), 10)], 0.75) - 0.55) < 1e-9
@@ -0,0 +1,116 @@
+import threading
+
+from core.history import HistoryRepository
+from core.history_backends import SQLiteHistoryBackend
+from llm.base import BaseLLM
+from services.compaction import SUMMARY_PREFIX, Compactor, parse_thresholds
+from services.orchestrator import ChatOrchestrator
+
+
+class SummaryLLM(BaseLLM):
+    model = "cheap-summarizer"
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.prompts = []
+
+    def chat(self, messages):
+        self.prompts.append(list(messages))
+        if self.gate is not None:
+            self.gate.wait(5)
+        return "пользователь Иван, обсуждали отпуск"
+
+class EchoLLM(BaseLLM):
+    model = "unit-test-model"
+
+    def chat(self, messages):
+        return "ответ " + "z" * 200
+
+class NoRetriever:
+    available = False
+
+def _orch(history, compactor):
+    return ChatOrchestrator(
+        history=history, llm=EchoLLM(), retriever=NoRetriever(),
+        semantic_cache=None, compactor=compactor,
+    )
+
+def test_summary_replaces_older_turns_without_blocking_reply():
+    h = HistoryRepository(window=50)
+    gate = threading.Event()
+    comp = Compactor(h, SummaryLLM(gate), threshold_tokens=300, keep_recent=2)
+    orch = _orch(h, comp)
+    for i in range(4):
+        orch.reply("web", "u1", f"вопрос {i} " + "q" * 100)  # пересказ ещё висит на gate — ответы идут
+    assert comp.stats()["compactions"] == 0
+    gate.set()
+    assert comp.flush(timeout=5)
+
+    msgs = h.messages("web", "u1")
+    assert msgs[0]["role"] == "system" and msgs[0]["content"].startswith(SUMMARY_PREFIX)
+    assert len(msgs) == 3 and msgs[-1]["role"] == "assistant"
+    st = comp.stats()
+    assert st["compactions"] == 1 and 0.0 < st["reduction"] < 1.0
+    assert st["tokens_saved"] == st["tokens_before"] - st["tokens_after"] > 0
+    comp.close()
+
+def test_stale_window_is_not_overwritten():
+    h = HistoryRepository(window=50)
+    for i in range(6):
+        h.append_user("web", "u1", f"m{i}")
+    older = h.messages("web", "u1")[:4]
+    h.reset("web", "u1")
+    h.append_user("web", "u1", "новое")
+    assert h.append_system("web", "u1", "сводка", replaces=older) is False
+    assert [m["content"] for m in h.messages("web", "u1")] == ["новое"]
+
+def test_channels_and_thresholds():
+    h = HistoryRepository()
+    comp = Compactor(h, SummaryLLM(), threshold_tokens=100, channels=["web"], thresholds=parse_thresholds(["tg=5000", "bad"]))
+    assert comp.threshold_for("web") == 100
+    assert comp.threshold_for("tg") == 5000
+    assert comp.threshold_for("api") is None
+    comp.close()
+
+def test_compaction_persists_in_sqlite(tmp_path):
+    path = str(tmp_path / "h.sqlite3")
+    h = HistoryRepository(window=10, backend=SQLiteHistoryBackend(path))
+    for i in range(6):
+        h.append_user("tg", "u1", f"m{i}")
+    older = h.messages("tg", "u1")[:4]
+    assert h.append_system("tg", "u1", "сводка", replaces=older)
+    h.close()
+
+    h2 = HistoryRepository(window=10, backend=SQLiteHistoryBackend(path))
+    assert [m["content"] for m in h2.messages("tg", "u1")] == ["сводка", "m4", "m5"]
+    h2.close()
+
+def test_async_reply_keeps_history_off_the_event_loop():
+    import asyncio
+
+    class ThreadRecordingHistory(HistoryRepository):
+        def __init__(self, **kw):
+            super().__init__(**kw)
+            self.threads = set()
+
+        def append_user(self, *a, **kw):
+            self.threads.add(threading.get_ident())
+            return super().append_user(*a, **kw)
+
+        def append_assistant(self, *a, **kw):
+            self.threads.add(threading.get_ident())
+            return super().append_assistant(*a, **kw)
+
+    h = ThreadRecordingHistory(window=50)
+    orch = _orch(h, Compactor(h, SummaryLLM(), threshold_tokens=10_000))
+
+    async def run():
+        await orch.areply("web", "u1", "привет")
+        async for _ in orch.areply_stream("web", "u1", "ещё"):
+            pass
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert h.threads and loop_thread not in h.threads
+    assert [m["role"] for m in h.messages("web", "u1")] == ["user", "assistant", "user", "assistant"]
+    orch.compactor.close()
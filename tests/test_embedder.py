@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import List
+
+from embedder.base import BaseEmbedder
+from embedder.batching import BatchingEmbedder
+
+class SlowEmbedder(BaseEmbedder):
+    def __init__(self):
+        self.calls: List[int] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(len(texts))
+        time.sleep(0.01)
+        return [[float(len(t))] for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def as_langchain(self):
+        return self
+
+def test_batching_embedder_merges_concurrent_queries():
+    inner = SlowEmbedder()
+    emb = BatchingEmbedder(inner, max_batch=8, window_ms=50)
+    results = {}
+
+    def worker(i: int) -> None:
+        results[i] = emb.embed_query("x" * i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    emb.close()
+
+    assert results == {i: [float(i)] for i in range(1, 9)}
+    assert len(inner.calls) < 8  # хотя бы часть запросов ушла одним батчем
+    stats = emb.stats()
+    assert stats["items"] == 8
+    assert sum(size * n for size, n in stats["batch_sizes"].items()) == 8
+
+def test_batching_embedder_propagates_errors():
+    class Broken(SlowEmbedder):
+        def embed_documents(self, texts):
+            raise ValueError("model is down")
+
+    emb = BatchingEmbedder(Broken(), window_ms=1)
+    try:
+        emb.embed_query("x")
+    except ValueError as e:
+        assert "model is down" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
+    finally:
+        emb.close()
+
+from embedder.cache import CachedEmbedder, DiskEmbeddingStore, text_digest
+
+def test_cached_embedder_reindex_costs_no_inference(tmp_path):
+    inner = SlowEmbedder()
+    emb = CachedEmbedder(inner, model_name="m", normalize=False, cache_dir=str(tmp_path))
+    docs = ["alpha", "beta", "alpha"]
+    assert emb.embed_documents(docs) == [[5.0], [4.0], [5.0]]
+    assert inner.calls == [2]  # дубль в батче считаем один раз
+
+    # новый процесс — тот же каталог
+    inner2 = SlowEmbedder()
+    emb2 = CachedEmbedder(inner2, model_name="m", normalize=False, cache_dir=str(tmp_path))
+    assert emb2.embed_documents(docs + ["gamma!"]) == [[5.0], [4.0], [5.0], [6.0]]
+    assert inner2.calls == [1]
+    assert emb2.stats()["doc_rows"] == 3
+
+    # другая модель — другое пространство ключей
+    inner3 = SlowEmbedder()
+    CachedEmbedder(inner3, model_name="other", normalize=False, cache_dir=str(tmp_path)).embed_documents(["alpha"])
+    assert inner3.calls == [1]
+
+def test_cached_embedder_query_lru():
+    inner = SlowEmbedder()
+    emb = CachedEmbedder(inner, model_name="m", normalize=True, query_cache_size=1)
+    emb.embed_query("a")
+    emb.embed_query("a")
+    emb.embed_query("bb")
+    emb.embed_query("a")
+    assert inner.calls == [1, 1, 1]
+    assert emb.stats()["query_hits"] == 1
+
+def test_disk_store_recovers_from_torn_write(tmp_path):
+    import numpy as np
+
+    meta = {"model": "m", "normalize": False}
+    store = DiskEmbeddingStore(str(tmp_path), meta)
+    store.put_many([text_digest("a")], np.array([[1.0, 1.0]]))
+    # падение после fsync векторов, до дозаписи ключей: в vectors.f32 лишняя строка и обрывок следующей
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.array([[9.0, 9.0]], dtype=np.float32).tobytes() + b"\x00\x01")
+
+    store = DiskEmbeddingStore(str(tmp_path), meta)
+    assert len(store) == 1 and (tmp_path / "vectors.f32").stat().st_size == 2 * 4
+    store.put_many([text_digest("b")], np.array([[2.0, 2.0]]))
+
+    reopened = DiskEmbeddingStore(str(tmp_path), meta)
+    a, b = reopened.get_many([text_digest("a"), text_digest("b")])
+    assert a.tolist() == [1.0, 1.0] and b.tolist() == [2.0, 2.0]
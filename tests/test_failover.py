@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from llm.base import AsyncBaseLLM
+from llm.failover import AsyncHedgedLLM, CircuitBreaker, FailoverLLM, HedgedLLM, NoBackendAvailable
+
+
+class Sync:
+    def __init__(self, answer, delay=0.0, fail=False):
+        self.answer, self.delay, self.fail, self.calls = answer, delay, fail, 0
+
+    def chat(self, messages):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError(self.answer)
+        return self.answer
+
+    def chat_stream(self, messages):
+        if self.fail:
+            raise ConnectionError(self.answer)
+        yield self.answer
+
+
+class Async(AsyncBaseLLM):
+    def __init__(self, answer, delay=0.0):
+        self.answer, self.delay, self.cancelled = answer, delay, 0
+
+    async def chat(self, messages):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.answer
+
+    async def chat_stream(self, messages):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        for w in self.answer.split():
+            yield w
+
+
+def test_failover_and_breaker_skip_dead_backend():
+    dead, live = Sync("down", fail=True), Sync("ok")
+    llm = FailoverLLM([("a", dead), ("b", live)], failure_threshold=2, reset_timeout=60)
+    assert [llm.chat([]) for _ in range(3)] == ["ok", "ok", "ok"]
+    assert dead.calls == 2  # после двух ошибок подряд предохранитель разомкнут
+    stats = llm.stats()
+    assert stats["a"]["breaker"] == "open" and stats["b"]["ok"] == 3
+    assert list(llm.chat_stream([])) == ["ok"]
+
+    only_dead = FailoverLLM([("a", Sync("down", fail=True))], failure_threshold=1)
+    for expected in (ConnectionError, NoBackendAvailable):
+        try:
+            only_dead.chat([])
+        except expected:
+            pass
+        else:
+            raise AssertionError(f"{expected.__name__} expected")
+
+
+def test_breaker_half_open_probe():
+    br = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    assert br.record_failure() and br.state == "open" and not br.allow()
+    time.sleep(0.02)
+    assert br.allow() and not br.allow()  # в half_open — одна проба
+    br.record_success()
+    assert br.state == "closed"
+
+
+def test_sync_hedge_returns_faster_backend():
+    slow, fast = Sync("slow", delay=0.5), Sync("fast", delay=0.0)
+    llm = HedgedLLM([("a", slow), ("b", fast)], hedge_after=0.05)
+    t0 = time.monotonic()
+    assert llm.chat([]) == "fast"
+    assert time.monotonic() - t0 < 0.4
+    assert llm.stats()["b"]["hedges"] == 1 and llm.stats()["a"]["cancelled"] == 1
+
+
+def test_async_hedge_cancels_loser_for_chat_and_stream():
+    async def go():
+        slow, fast = Async("slow answer", delay=1.0), Async("fast answer", delay=0.0)
+        llm = AsyncHedgedLLM([("a", slow), ("b", fast)], hedge_after=0.05)
+        t0 = time.monotonic()
+        out = await llm.chat([])
+        pieces = [p async for p in llm.chat_stream([])]
+        return out, pieces, time.monotonic() - t0, slow.cancelled, llm.stats()
+
+    out, pieces, dt, cancelled, stats = asyncio.run(go())
+    assert out == "fast answer" and pieces == ["fast", "answer"]
+    assert dt < 0.5 and cancelled == 2
+    assert stats["b"]["wins"] == 2 and stats["a"]["ok"] == 0
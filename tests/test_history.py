@@ -0,0 +1,207 @@
+import copy
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from core.history import HistoryRepository, Message
+
+
+def test_window_keeps_last_messages_in_order():
+    h = HistoryRepository(window=3)
+    for i in range(5):
+        h.append_user("web", "u1", f"m{i}")
+    assert [m["content"] for m in h.messages("web", "u1")] == ["m2", "m3", "m4"]
+    assert h.messages("web", "nobody") == ()
+
+    zero = HistoryRepository(window=0)
+    zero.append_user("web", "u1", "x")
+    assert zero.messages("web", "u1") == ()
+
+def test_messages_are_immutable_snapshots():
+    h = HistoryRepository()
+    h.append_user("web", "u1", "hi")
+    snap = h.messages("web", "u1")
+    assert h.messages("web", "u1") is snap  # без изменений — тот же снимок, без копий
+    assert snap[0] == {"role": "user", "content": "hi"}  # ts больше не храним
+    assert json.loads(json.dumps(snap)) == [{"role": "user", "content": "hi"}]
+    with pytest.raises(TypeError):
+        snap[0]["content"] = "hacked"
+    assert copy.deepcopy(snap[0]) is snap[0]
+
+    h.append_assistant("web", "u1", "hello")
+    assert len(snap) == 1 and len(h.messages("web", "u1")) == 2
+
+def test_invalid_role_and_reset():
+    h = HistoryRepository()
+    with pytest.raises(ValueError):
+        h.append("web", "u1", "tool", "x")
+    h.append_system("web", "u1", "sys")
+    h.reset("web", "u1")
+    assert h.messages("web", "u1") == ()
+
+def test_concurrent_appends_from_many_users():
+    h = HistoryRepository(window=1000, stripes=4)
+
+    def worker(uid):
+        for i in range(200):
+            h.append_user("tg", uid, str(i))
+
+    threads = [threading.Thread(target=worker, args=(str(u),)) for u in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(h) == 16
+    assert all(len(h.messages("tg", str(u))) == 200 for u in range(16))
+
+def test_message_record():
+    m = Message("user", "x")
+    assert (m.role, m.content, m.tokens) == ("user", "x", None)
+
+def test_lru_evicts_idle_conversation_not_first_writer():
+    h = HistoryRepository(max_keys=2, stripes=8)
+    h.append_user("tg", "first", "a")
+    h.append_user("tg", "dormant", "b")
+    h.messages("tg", "first")           # первый пишущий активен
+    h.append_user("tg", "new", "c")
+    assert h.messages("tg", "dormant") == ()
+    assert len(h.messages("tg", "first")) == 1
+    st = h.stats()
+    assert st["live_keys"] == 2 and st["evictions"]["lru"] == 1
+
+def test_byte_budget_and_accounting():
+    h = HistoryRepository(window=2, max_bytes=20_000, stripes=4)
+    for u in range(20):
+        h.append_user("tg", str(u), "x" * 2000)
+    st = h.stats()
+    assert st["bytes"] <= 20_000 and st["evictions"]["bytes"] > 0
+    assert len(h.messages("tg", "19")) == 1  # самый свежий на месте
+
+    # окно вытесняет старые сообщения — учёт байт не растёт сверх window сообщений
+    free = HistoryRepository(window=2)
+    free.append_user("tg", "u", "x" * 2000)
+    free.append_user("tg", "u", "x" * 2000)
+    full = free.stats()["bytes"]
+    for _ in range(5):
+        free.append_user("tg", "u", "x" * 2000)
+    assert free.stats()["bytes"] == full
+
+    for u in range(20):
+        h.reset("tg", str(u))
+    assert h.stats()["bytes"] == 0 and len(h) == 0
+
+def test_idle_ttl(monkeypatch):
+    import core.history as mod
+    now = [1000.0]
+    monkeypatch.setattr(mod.time, "monotonic", lambda: now[0])
+    h = HistoryRepository(idle_ttl=60, stripes=2)
+    h.append_user("tg", "old", "a")
+    now[0] += 30
+    h.append_user("tg", "fresh", "b")
+    now[0] += 40
+    assert h.sweep() == 1
+    assert h.messages("tg", "old") == ()
+    assert len(h.messages("tg", "fresh")) == 1
+    assert h.stats()["evictions"]["ttl"] == 1
+
+from core.history_backends import SQLiteHistoryBackend
+
+def test_sqlite_backend_survives_restart(tmp_path):
+    path = str(tmp_path / "h.sqlite3")
+    h = HistoryRepository(window=3, backend=SQLiteHistoryBackend(path, retain=5))
+    for i in range(6):
+        h.append_user("tg", "u1", f"m{i}")
+    h.append_user("tg", "u2", "other")
+    h.reset("tg", "u2")
+    h.close()
+
+    # «рестарт»: новая память, тот же файл
+    h2 = HistoryRepository(window=3, backend=SQLiteHistoryBackend(path, retain=5))
+    assert [m["content"] for m in h2.messages("tg", "u1")] == ["m3", "m4", "m5"]
+    assert h2.messages("tg", "u2") == ()
+    h2.append_assistant("tg", "u1", "a")
+    assert [m["content"] for m in h2.messages("tg", "u1")] == ["m4", "m5", "a"]
+    h2.close()
+
+def test_sqlite_backend_group_commits_and_reads_through(tmp_path):
+    backend = SQLiteHistoryBackend(str(tmp_path / "h.sqlite3"), commit_interval_ms=20)
+    h = HistoryRepository(window=10, max_keys=1, backend=backend)
+
+    def worker(uid):
+        for i in range(50):
+            h.append_user("tg", uid, str(i))
+
+    threads = [threading.Thread(target=worker, args=(str(u),)) for u in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert h.flush(timeout=5)
+    st = backend.stats()
+    assert st["written"] == 200 and st["batches"] < 200
+
+    # кэш держит один ключ, остальные читаются из sqlite при промахе
+    assert len(h) == 1
+    assert [m["content"] for m in h.messages("tg", "0")] == [str(i) for i in range(40, 50)]
+    h.close()
+
+def test_sqlite_workers_see_each_others_turns(tmp_path, monkeypatch):
+    import importlib.util
+    import time
+
+    import core.config
+
+    # значение по умолчанию для sqlite — не «доверять кэшу вечно»
+    monkeypatch.setenv("HISTORY_BACKEND", "sqlite")
+    monkeypatch.delenv("HISTORY_CACHE_REVALIDATE", raising=False)
+    spec = importlib.util.spec_from_file_location("config_probe", core.config.__file__)
+    probe = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(probe)
+    assert probe.settings.HISTORY_CACHE_REVALIDATE > 0
+
+    path = str(tmp_path / "h.sqlite3")
+    w1 = HistoryRepository(window=5, backend=SQLiteHistoryBackend(path), revalidate=0.05)
+    w2 = HistoryRepository(window=5, backend=SQLiteHistoryBackend(path), revalidate=0.05)
+    w1.append_user("web", "u", "first")
+    assert w1.flush(timeout=5)
+    assert [m["content"] for m in w2.messages("web", "u")] == ["first"]  # окно закэшировано во втором воркере
+    w1.append_assistant("web", "u", "reply from w1")
+    assert w1.flush(timeout=5)
+    time.sleep(0.1)
+    assert [m["content"] for m in w2.messages("web", "u")] == ["first", "reply from w1"]
+    w1.close()
+    w2.close()
+
+def test_sqlite_backend_retries_and_isolates_bad_op(tmp_path):
+    backend = SQLiteHistoryBackend(str(tmp_path / "h.sqlite3"), commit_interval_ms=50, retry_backoff=0.001)
+    apply = backend._apply
+    calls = {"n": 0}
+
+    def flaky(ops):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise sqlite3.OperationalError("database is locked")  # временный сбой — повтор пачки
+        if any(op[3] == "poison" for op in ops):
+            raise sqlite3.IntegrityError("bad row")
+        return apply(ops)
+
+    backend._apply = flaky
+    h = HistoryRepository(window=10, backend=backend)
+    for text in ("a", "b"):
+        h.append_user("tg", "u", text)
+    assert h.flush(timeout=5)
+    assert backend.stats()["lost"] == 0 and backend.stats()["written"] == 2
+
+    for text in ("c", "poison", "d", "e"):
+        h.append_user("tg", "u", text)
+    assert h.flush(timeout=5)
+    st = backend.stats()
+    # потеряна только сбойная операция, соседи по пачке записаны по порядку
+    assert st["lost"] == 1 and st["written"] == 5
+    h.close()
+
+    h2 = HistoryRepository(window=10, backend=SQLiteHistoryBackend(str(tmp_path / "h.sqlite3")))
+    assert [m["content"] for m in h2.messages("tg", "u")] == ["a", "b", "c", "d", "e"]
+    h2.close()
@@ -0,0 +1,209 @@
+import json
+
+from services.ingest import IngestPipeline, iter_documents, split_text
+from vectorstores.numpy_store import NumpyVectorStore
+from tests.test_vectorstores import KeywordEmbedder
+
+
+def keyword_embedder():
+    # фабрика для воркеров: должна импортироваться по имени
+    return KeywordEmbedder()
+
+def _corpus(root):
+    (root / "sub").mkdir()
+    (root / "a.txt").write_text(" ".join(f"Chroma {i}" for i in range(300)), encoding="utf-8")
+    (root / "sub" / "b.md").write_text("Qdrant и RAG", encoding="utf-8")
+    (root / "skip.bin").write_bytes(b"\0\1")
+    with open(root / "wiki.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "w1", "text": "Pinecone wiki", "lang": "ru"}) + "\n")
+        f.write("\n")
+        f.write(json.dumps({"id": "w2", "content": "wiki про rag"}) + "\n")
+
+def test_split_text_overlaps_and_keeps_words():
+    text = " ".join(f"w{i}" for i in range(200))
+    pieces = list(split_text(text, size=100, overlap=20))
+    assert len(pieces) > 1
+    assert all(len(p) <= 100 for p in pieces)
+    assert all(not p.startswith(" ") and p.split()[0].startswith("w") for p in pieces)
+    # соседние чанки перекрываются
+    assert pieces[0].split()[-1] in pieces[1]
+
+def test_iter_documents_streams_supported_files(tmp_path):
+    _corpus(tmp_path)
+    docs = list(iter_documents(str(tmp_path)))
+    assert [d.source for d in docs] == [str(tmp_path / "a.txt"), "w1", "w2", str(tmp_path / "sub" / "b.md")]
+    assert docs[1].metadata == {"id": "w1", "lang": "ru"}
+
+def test_ingest_pipeline_inline(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    _corpus(corpus)
+    store = NumpyVectorStore(KeywordEmbedder(), path=str(tmp_path / "s.oavs"), autosave=False)
+    reports = []
+    stats = IngestPipeline(
+        store, embedder=KeywordEmbedder(), batch_size=2, max_pending=1,
+        chunk_size=400, overlap=50, progress=reports.append,
+    ).run(str(corpus))
+
+    assert stats.docs == 4
+    assert stats.chunks == len(store) > 4
+    assert reports and reports[-1] is stats
+    hit = store.search_with_scores("pinecone", k=1)[0]
+    assert hit.metadata["source"] == "w1" and hit.metadata["chunk"] == 0
+    # flush в конце сохранил хранилище
+    assert len(NumpyVectorStore(KeywordEmbedder(), path=str(tmp_path / "s.oavs"))) == len(store)
+
+def test_ingest_pipeline_process_pool(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    _corpus(corpus)
+    store = NumpyVectorStore(KeywordEmbedder())
+    stats = IngestPipeline(
+        store, workers=2, embedder_factory=keyword_embedder, batch_size=3, chunk_size=400, overlap=50,
+    ).run(str(corpus))
+    assert stats.chunks == len(store)
+    assert store.search("qdrant", k=1) == ["Qdrant и RAG"]
+
+from services.manifest import IndexManifest
+from services.retriever import Retriever
+
+class CountingEmbedder(KeywordEmbedder):
+    def __init__(self):
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+def test_incremental_ingest_embeds_only_the_diff(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    _corpus(corpus)
+    store = NumpyVectorStore(KeywordEmbedder())
+    manifest = IndexManifest(str(tmp_path / "manifest.sqlite3"))
+    emb = CountingEmbedder()
+
+    def run():
+        return IngestPipeline(store, embedder=emb, manifest=manifest, chunk_size=400, overlap=50).run(str(corpus))
+
+    first = run()
+    assert first.chunks == len(store) == len(manifest) == emb.embedded
+
+    # повторный запуск без изменений — ни одного эмбеддинга
+    second = run()
+    assert (second.chunks, second.unchanged, second.deleted) == (0, 4, 0)
+    assert emb.embedded == first.chunks
+
+    # дописали абзац в конец длинного файла и удалили md: пересчитан только хвост
+    with open(corpus / "a.txt", "a", encoding="utf-8") as f:
+        f.write("\nQdrant " * 20)
+    (corpus / "sub" / "b.md").unlink()
+    before = emb.embedded
+    third = run()
+    assert third.unchanged == 2
+    assert third.reused > 0 and 0 < third.chunks < first.chunks
+    assert emb.embedded - before == third.chunks
+    assert third.deleted >= 1
+    assert len(store) == len(manifest)
+    assert "Qdrant и RAG" not in store.search("qdrant rag", k=len(store))
+
+def test_retriever_incremental_index(tmp_path):
+    store = NumpyVectorStore(KeywordEmbedder())
+    manifest = IndexManifest(str(tmp_path / "m.sqlite3"))
+    r = Retriever(store=store, top_k=1)
+    assert r.index(["Chroma wiki", "Qdrant"], ids=["c", "q"], incremental=True, manifest=manifest) == 2
+    assert r.index(["Chroma wiki", "Qdrant"], ids=["c", "q"], incremental=True, manifest=manifest) == 0
+    assert r.index(["Chroma wiki v2"], ids=["c"], incremental=True, manifest=manifest) == 1
+    assert [h.content for h in store.search_with_scores("chroma", k=5)] == ["Chroma wiki v2"]
+
+def test_manifest_never_runs_ahead_of_store(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    _corpus(corpus)
+    path = str(tmp_path / "s.oavs")
+    store = NumpyVectorStore(KeywordEmbedder(), path=path, autosave=False)
+
+    def on_disk():
+        return set(NumpyVectorStore(KeywordEmbedder(), path=path)._row)
+
+    class CheckedManifest(IndexManifest):
+        # падение сразу после любой записи манифеста не должно терять чанки
+        def promote(self):
+            n = super().promote()
+            assert {i for src in self.sources() for i in self.chunks(src).values()} <= on_disk()
+            return n
+
+        def clear_tombstones(self, ids):
+            assert not set(ids) & on_disk()
+            super().clear_tombstones(ids)
+
+    manifest = CheckedManifest(str(tmp_path / "m.sqlite3"))
+    run = lambda: IngestPipeline(  # noqa: E731
+        store, embedder=KeywordEmbedder(), manifest=manifest, batch_size=2, upsert_batch=1,
+        chunk_size=400, overlap=50,
+    ).run(str(corpus))
+    run()
+    (corpus / "sub" / "b.md").unlink()
+    assert run().deleted >= 1
+    assert on_disk() == set(store._row) and len(store) == len(manifest)
+
+def test_incremental_run_saves_store_once(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    _corpus(corpus)
+
+    class CountingStore(NumpyVectorStore):
+        flushes = deletes = 0
+
+        def flush(self):
+            CountingStore.flushes += 1
+            super().flush()
+
+        def delete(self, ids):
+            CountingStore.deletes += 1
+            return super().delete(ids)
+
+    store = CountingStore(KeywordEmbedder(), path=str(tmp_path / "s.oavs"))
+    manifest = IndexManifest(str(tmp_path / "m.sqlite3"))
+    run = lambda: IngestPipeline(  # noqa: E731
+        store, embedder=KeywordEmbedder(), manifest=manifest, batch_size=1, upsert_batch=1,
+        chunk_size=400, overlap=50,
+    ).run(str(corpus))
+    run()
+    assert (CountingStore.flushes, CountingStore.deletes) == (1, 0)
+
+    (corpus / "sub" / "b.md").unlink()
+    (corpus / "a.txt").write_text("совсем другой текст", encoding="utf-8")
+    stats = run()
+    # все устаревшие id — одним delete, стор переписан один раз
+    assert stats.deleted > 2 and (CountingStore.flushes, CountingStore.deletes) == (2, 1)
+    assert len(store) == len(manifest) and manifest.pending_deletes() == []
+
+def test_run_interrupted_before_promote_is_redone(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    _corpus(corpus)
+    store = NumpyVectorStore(KeywordEmbedder(), path=str(tmp_path / "s.oavs"))
+
+    class CrashingManifest(IndexManifest):
+        crash = True
+
+        def promote(self):
+            if self.crash:
+                raise RuntimeError("killed")  # стор уже сохранён, манифест — нет
+            return super().promote()
+
+    manifest = CrashingManifest(str(tmp_path / "m.sqlite3"))
+    run = lambda: IngestPipeline(  # noqa: E731
+        store, embedder=KeywordEmbedder(), manifest=manifest, chunk_size=400, overlap=50,
+    ).run(str(corpus))
+    try:
+        run()
+    except RuntimeError:
+        pass
+    assert len(manifest) == 0 and len(store) > 0
+
+    manifest.crash = False
+    stats = run()
+    assert stats.unchanged == 0 and len(store) == len(manifest) == stats.chunks
+    assert run().unchanged == 4
@@ -1,6 +1,15 @@
+import asyncio
 import json
+import threading
+import time
 import types
-from llm.openai_compat import OpenAICompatLLM
+
+import httpx
+
+from llm.base import AsyncBaseLLM, BaseLLM
+from llm.cache import MemoryCache, SQLiteCache
+from llm.decorators import AsyncCachingLLM, AsyncRetryingLLM, CachingLLM
+from llm.openai_compat import AsyncOpenAICompatLLM, OpenAICompatLLM
 
 class DummyResp:
     def __init__(self, status=200, payload=None):
@@ -48,3 +57,308 @@ def test_openai_compat_error_returns_text_when_flag_enabled(monkeypatch):
     )
     out = llm.chat([{"role": "user", "content": "ping"}])
     assert "LLM error" in out or "error" in out.lower()
+
+def test_async_openai_compat_success():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path.endswith("/chat/completions")
+        assert request.headers["Authorization"] == "Bearer key"
+        body = json.loads(request.content)
+        assert body["model"] == "unit-test-model"
+        return httpx.Response(200, json={"choices": [{"message": {"content": "hello"}}]})
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        llm = AsyncOpenAICompatLLM(
+            base_url="http://llm.local/v1",
+            api_key="key",
+            model="unit-test-model",
+            client=client,
+        )
+        try:
+            return await llm.chat([{"role": "user", "content": "ping"}])
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == "hello"
+
+def test_async_retrying_llm_retries_then_succeeds():
+    class Flaky(AsyncBaseLLM):
+        def __init__(self):
+            self.calls = 0
+
+        async def chat(self, messages):
+            self.calls += 1
+            if self.calls < 3:
+                raise RuntimeError("boom")
+            return "ok"
+
+    inner = Flaky()
+    llm = AsyncRetryingLLM(inner, attempts=3, backoff=0.001)
+    assert asyncio.run(llm.chat([{"role": "user", "content": "ping"}])) == "ok"
+    assert inner.calls == 3
+
+class DummyStreamResp:
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for line in self._lines:
+            yield line.encode("utf-8")
+
+def test_openai_compat_stream_parses_deltas(monkeypatch):
+    def fake_post(url, headers=None, json=None, timeout=60, stream=False):
+        assert stream and json["stream"] is True
+        return DummyStreamResp([
+            ": keep-alive",
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            "",
+            'data: {"choices": [{"delta": {"content": "При"}}]}',
+            'data: {"choices": [{"delta": {"content": "вет"}}]}',
+            "data: [DONE]",
+        ])
+
+    import requests
+    monkeypatch.setattr(requests, "post", fake_post)
+
+    llm = OpenAICompatLLM(base_url="", api_key=None, model="unit-test-model")
+    assert list(llm.chat_stream([{"role": "user", "content": "ping"}])) == ["При", "вет"]
+
+def test_orchestrator_stream_writes_history_after_completion():
+    from core.history import HistoryRepository
+    from services.orchestrator import ChatOrchestrator
+
+    class StreamLLM(BaseLLM):
+        def chat(self, messages):
+            return "".join(self.chat_stream(messages))
+
+        def chat_stream(self, messages):
+            yield "a"
+            yield "b"
+
+    class NoRetriever:
+        available = False
+
+    hist = HistoryRepository()
+    orch = ChatOrchestrator(history=hist, llm=StreamLLM(), retriever=NoRetriever())
+    stream = orch.reply_stream("web", "u1", "hi")
+    assert next(stream) == "a"
+    assert [m["role"] for m in hist.messages("web", "u1")] == ["user"]
+    assert list(stream) == ["b"]
+    assert hist.messages("web", "u1")[-1]["content"] == "ab"
+
+def test_stream_broken_after_first_delta_is_not_persisted():
+    from fastapi.testclient import TestClient
+    from api.app import create_app
+    from core.history import HistoryRepository
+    from llm.decorators import AsyncLoggingLLM, LoggingLLM
+    from services.orchestrator import ChatOrchestrator
+
+    class BrokenStream(BaseLLM):
+        def chat(self, messages):
+            return "ab"
+
+        def chat_stream(self, messages):
+            yield "a"
+            raise ConnectionError("upstream reset")
+
+    class AsyncBrokenStream(AsyncBaseLLM):
+        async def chat(self, messages):
+            return "ab"
+
+        async def chat_stream(self, messages):
+            yield "a"
+            raise ConnectionError("upstream reset")
+
+    class NoRetriever:
+        available = False
+
+    hist = HistoryRepository()
+    # return_on_error="" по умолчанию: ошибку до первого куска по-прежнему гасит, после — нет
+    orch = ChatOrchestrator(history=hist, llm=LoggingLLM(BrokenStream()), retriever=NoRetriever())
+    stream = orch.reply_stream("web", "u1", "hi")
+    assert next(stream) == "a"
+    try:
+        list(stream)
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("обрыв потока должен дойти до вызывающего")
+    assert [m["role"] for m in hist.messages("web", "u1")] == ["user"]
+
+    app = create_app()
+    app.state.orch = ChatOrchestrator(
+        history=hist, llm=BrokenStream(), allm=AsyncLoggingLLM(AsyncBrokenStream()), retriever=NoRetriever(),
+    )
+    body = TestClient(app).post("/v1/chat/stream", json={"channel": "web", "user_id": "u2", "text": "hi"}).text
+    assert '"delta": "a"' in body and "event: error" in body and "[DONE]" not in body
+    assert [m["role"] for m in hist.messages("web", "u2")] == ["user"]
+
+def test_sync_stream_yields_first_delta_before_body_ends():
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    gate = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.0"  # без chunked: тело до закрытия соединения
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            self.wfile.write(b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\n')
+            self.wfile.flush()
+            gate.wait(5)
+            self.wfile.write(b'data: {"choices": [{"delta": {"content": "!"}}]}\n\ndata: [DONE]\n\n')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        llm = OpenAICompatLLM(base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key=None, model="m")
+        stream = llm.chat_stream([{"role": "user", "content": "ping"}])
+        t0 = time.monotonic()
+        assert next(stream) == "Hi"
+        assert time.monotonic() - t0 < 2.0  # первый delta пришёл, пока сервер ещё держит тело
+        gate.set()
+        assert list(stream) == ["!"]
+    finally:
+        gate.set()
+        server.shutdown()
+
+def test_pooled_transport_reuses_connection():
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from llm.transport import HTTPPool
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = b'{"choices": [{"message": {"content": "pong"}}]}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pool = HTTPPool("test", per_host=2, connect_timeout=2, read_timeout=5)
+    try:
+        llm = OpenAICompatLLM(
+            base_url=f"http://127.0.0.1:{server.server_port}/v1",
+            api_key="key",
+            model="unit-test-model",
+            transport=pool,
+        )
+        for _ in range(3):
+            assert llm.chat([{"role": "user", "content": "ping"}]) == "pong"
+        stats = pool.stats()["sync"]
+        assert stats["requests"] == 3
+        assert stats["new_connections"] == 1
+        assert stats["idle"] == 1
+        assert abs(stats["reuse_ratio"] - 2 / 3) < 1e-9
+
+        allm = AsyncOpenAICompatLLM(
+            base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="key", model="m", pool=pool,
+        )
+
+        async def run():
+            for _ in range(3):
+                assert await allm.chat([{"role": "user", "content": "ping"}]) == "pong"
+            await pool.aclose()
+
+        asyncio.run(run())
+        stats = pool.stats()["async"]
+        assert (stats["requests"], stats["new_connections"], stats["active"]) == (3, 1, 0)
+        assert abs(stats["reuse_ratio"] - 2 / 3) < 1e-9
+    finally:
+        pool.close()
+        server.shutdown()
+
+class CountingLLM(BaseLLM):
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, messages):
+        self.calls += 1
+        return f"answer #{self.calls}"
+
+def test_caching_llm_hits_on_identical_prompt():
+    inner = CountingLLM()
+    llm = CachingLLM(inner, backend=MemoryCache(max_entries=1), model="m", temperature=0.0)
+    hi = [{"role": "user", "content": "hi", "ts": 1.0}]
+    assert llm.chat(hi) == "answer #1"
+    # метка времени не влияет на ключ
+    assert llm.chat([{"role": "user", "content": "hi", "ts": 2.0}]) == "answer #1"
+    assert llm.chat([{"role": "user", "content": "bye"}]) == "answer #2"  # вытесняет "hi"
+    assert llm.chat(hi) == "answer #3"
+    stats = llm.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 2)
+
+def test_caching_llm_bypasses_sampled_temperature():
+    inner = CountingLLM()
+    llm = CachingLLM(inner, model="m", temperature=0.7)
+    msgs = [{"role": "user", "content": "hi"}]
+    assert llm.chat(msgs) != llm.chat(msgs)
+    assert llm.stats()["bypass"] == 2
+
+    allowed = CachingLLM(CountingLLM(), model="m", temperature=0.7, allow_sampled=True)
+    assert allowed.chat(msgs) == allowed.chat(msgs)
+
+def test_sqlite_cache_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, max_entries=10)
+    cache.set("k", "v")
+    cache.close()
+    reopened = SQLiteCache(path, max_entries=10)
+    assert reopened.get("k") == "v"
+    assert len(reopened) == 1
+    reopened.close()
+
+def test_async_cache_keeps_disk_backend_off_the_event_loop(tmp_path):
+    class ThreadRecordingCache(SQLiteCache):
+        threads = set()
+
+        def get(self, key):
+            self.threads.add(threading.get_ident())
+            return super().get(key)
+
+        def set(self, key, value):
+            self.threads.add(threading.get_ident())
+            super().set(key, value)
+
+    class Upstream(AsyncBaseLLM):
+        calls = 0
+
+        async def chat(self, messages):
+            Upstream.calls += 1
+            return "ok"
+
+    cache = ThreadRecordingCache(str(tmp_path / "c.sqlite3"))
+    llm = AsyncCachingLLM(Upstream(), backend=cache, model="m")
+    msgs = [{"role": "user", "content": "hi"}]
+
+    async def run():
+        assert await llm.chat(msgs) == await llm.chat(msgs) == "ok"
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert Upstream.calls == 1 and llm.stats()["hits"] == 1
+    assert cache.threads and loop_thread not in cache.threads
+    cache.close()
@@ -0,0 +1,67 @@
+from typing import List
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.app import create_app
+from core.metrics import Registry
+from llm.base import BaseLLM
+from llm.decorators import LoggingLLM, RateLimitLLM, RetryingLLM
+
+
+def test_histogram_renders_cumulative_buckets():
+    reg = Registry()
+    h = reg.histogram("t_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    child = h.labels("embed")
+    assert h.labels("embed") is child  # дочерний объект кэшируется
+    for v in (0.05, 0.5, 5.0):
+        child.observe(v)
+    text = reg.render()
+    assert 't_seconds_bucket{stage="embed",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="embed",le="1"} 2' in text
+    assert 't_seconds_bucket{stage="embed",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="embed"} 3' in text
+
+    c = reg.counter("t_total", "test")
+    c.inc(2)
+    assert "t_total 2" in reg.render()
+    with pytest.raises(ValueError):
+        reg.gauge("t_total", "same name, other type")
+    with pytest.raises(ValueError):
+        h.labels("a", "b")
+
+class Flaky(BaseLLM):
+    model = "m-test"
+
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, messages):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+def test_llm_decorators_report_latency_retries_and_wait():
+    llm = LoggingLLM(
+        RetryingLLM(RateLimitLLM(Flaky(), rps=100, burst=1, provider="p-test"), backoff=0.0, provider="p-test"),
+        provider="p-test", model="m-test",
+    )
+    assert llm.chat([{"role": "user", "content": "hi"}]) == "ok"
+
+    class Orch:
+        def reply(self, channel: str, user_id: str, user_text: str) -> List[str]:
+            return ["ok"]
+
+    app = create_app()
+    client = TestClient(app)
+    app.state.orch = Orch()
+    assert client.post("/v1/chat", json={"channel": "web", "user_id": "u", "text": "x"}).status_code == 200
+    r = client.get("/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    text = r.text
+    assert 'orion_llm_retries_total{provider="p-test"} 1' in text
+    assert 'orion_llm_request_seconds_count{provider="p-test",model="m-test",mode="chat"} 1' in text
+    assert 'orion_ratelimit_wait_seconds_count{provider="p-test"} 2' in text
+    assert 'orion_chat_request_seconds_count{endpoint="chat",status="200"}' in text
+    assert 'orion_inflight_requests{endpoint="chat"} 0' in text
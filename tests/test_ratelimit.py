@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from api.app import create_app
+from llm.base import AsyncBaseLLM
+from llm.decorators import AsyncRateLimitLLM, LoggingLLM, RateLimitLLM
+from llm.ratelimit import RateLimiter, RateLimitExceeded, rate_limit_key
+
+
+def test_light_user_is_not_starved_by_heavy_one():
+    limiter = RateLimiter(provider_rate=50, provider_burst=1)
+    limiter.acquire("p")  # бакет пуст — дальше все встают в очередь
+    order = []
+
+    def call(key):
+        limiter.acquire("p", key=key)
+        order.append(key)
+
+    heavy = [threading.Thread(target=call, args=("web:heavy",)) for _ in range(6)]
+    for t in heavy:
+        t.start()
+    time.sleep(0.005)
+    light = threading.Thread(target=call, args=("web:light",))
+    light.start()
+    for t in heavy + [light]:
+        t.join(5)
+    assert len(order) == 7
+    # обход по кругу: лёгкий пользователь проходит вторым, а не после всей очереди тяжёлого
+    assert order.index("web:light") <= 2
+    assert limiter.stats()["queued"] == 0
+
+
+def test_per_key_limit_and_deadline_rejection():
+    limiter = RateLimiter(provider_rate=0, key_rate=1, key_burst=1, max_wait=0.2)
+    limiter.acquire("p", key="tg:1")
+    limiter.acquire("p", key="tg:2")  # у другого ключа свой бакет
+    try:
+        limiter.acquire("p", key="tg:1")
+    except RateLimitExceeded as e:
+        assert 0.5 < e.retry_after <= 1.0
+    else:
+        raise AssertionError("projected wait above max_wait must be rejected at once")
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_rate_limit_key_flows_from_context_and_is_not_swallowed():
+    class Echo:
+        def chat(self, messages):
+            return "ok"
+
+    limiter = RateLimiter(provider_rate=0, key_rate=1, key_burst=1, max_wait=0.05)
+    llm = LoggingLLM(RateLimitLLM(Echo(), provider="p", limiter=limiter))
+    with rate_limit_key("web:u"):
+        assert llm.chat([]) == "ok"
+        try:
+            llm.chat([])
+        except RateLimitExceeded:
+            pass
+        else:
+            raise AssertionError("LoggingLLM must re-raise limiter rejections")
+    assert llm.chat([]) == "ok"  # без ключа уровень пользователя не применяется
+
+
+def test_async_waiters_are_woken_in_order():
+    class Echo(AsyncBaseLLM):
+        async def chat(self, messages):
+            return messages[0]["content"]
+
+        async def chat_stream(self, messages):
+            yield messages[0]["content"]
+
+    async def go():
+        llm = AsyncRateLimitLLM(Echo(), rps=40, burst=1)
+        t0 = time.monotonic()
+        out = await asyncio.gather(*(llm.chat([{"role": "user", "content": str(i)}]) for i in range(5)))
+        return out, time.monotonic() - t0, llm.limiter
+
+    out, dt, limiter = asyncio.run(go())
+    assert out == ["0", "1", "2", "3", "4"]
+    assert 0.08 <= dt < 1.0  # 4 ожидания по 25 мс, без опроса с джиттером
+    assert limiter.stats()["granted"] == 5
+
+
+def test_api_maps_limiter_rejection_to_429():
+    class Orch:
+        async def areply(self, channel, user_id, text):
+            raise RateLimitExceeded("busy", retry_after=2.3)
+
+    app = create_app()
+    app.state.orch = Orch()
+    r = TestClient(app).post("/v1/chat", json={"channel": "web", "user_id": "u", "text": "x"})
+    assert r.status_code == 429 and r.headers["retry-after"] == "3"
+
+
+def _http_error(status, headers=None):
+    import httpx
+
+    req = httpx.Request("POST", "http://llm/chat/completions")
+    return httpx.HTTPStatusError("err", request=req, response=httpx.Response(status, headers=headers, request=req))
+
+
+def test_classify_terminal_and_retryable_errors():
+    from llm.errors import classify, parse_retry_after
+
+    assert classify(_http_error(400)).retryable is False
+    assert classify(_http_error(401)).retryable is False
+    assert classify(_http_error(409)).retryable is False
+    assert classify(_http_error(503)).retryable is True
+    info = classify(_http_error(429, {"Retry-After": "2"}))
+    assert info.retryable and info.throttled and info.retry_after == 2.0
+    assert classify(TimeoutError()).retryable is True
+    assert parse_retry_after({"retry-after-ms": "250", "retry-after": "9"}) == 0.25
+    assert parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:10 GMT"}, now=1445412480) == 10.0
+
+
+def test_retry_skips_4xx_and_honours_retry_after():
+    from llm.decorators import RetryingLLM
+
+    class Upstream:
+        def __init__(self, errors):
+            self.errors, self.calls = list(errors), 0
+
+        def chat(self, messages):
+            self.calls += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            return "ok"
+
+    bad = Upstream([_http_error(400)] * 3)
+    try:
+        RetryingLLM(bad, attempts=3, backoff=0.0).chat([])
+    except Exception:
+        pass
+    assert bad.calls == 1
+
+    conflict = Upstream([_http_error(409)] * 3)
+    try:
+        RetryingLLM(conflict, attempts=3, backoff=0.0).chat([])
+    except Exception:
+        pass
+    assert conflict.calls == 1
+
+    busy = Upstream([_http_error(429, {"retry-after-ms": "120"})])
+    t0 = time.monotonic()
+    assert RetryingLLM(busy, attempts=3, backoff=0.0).chat([]) == "ok"
+    assert time.monotonic() - t0 >= 0.11 and busy.calls == 2
+
+    # Retry-After дольше допустимого — не ждём, отдаём ошибку сразу
+    slow = Upstream([_http_error(429, {"Retry-After": "120"})])
+    try:
+        RetryingLLM(slow, attempts=3, backoff=0.0, max_retry_after=5).chat([])
+    except Exception:
+        pass
+    assert slow.calls == 1
+
+
+def test_aimd_cuts_rate_on_429_and_recovers_on_success():
+    from llm.ratelimit import AIMDController
+
+    limiter = RateLimiter(provider_rate=8, provider_burst=1)
+    ctl = AIMDController(limiter, "p", min_rate=1, decrease=0.5, increase=4, cooldown=0.0)
+
+    class Upstream:
+        fail = True
+
+        def chat(self, messages):
+            if self.fail:
+                raise _http_error(429, {"retry-after-ms": "50"})
+            return "ok"
+
+    up = Upstream()
+    llm = RateLimitLLM(up, provider="p", limiter=limiter, controller=ctl)
+    for _ in range(2):
+        try:
+            llm.chat([])
+        except Exception:
+            pass
+    assert limiter.rate_of("p") == 2.0
+    t0 = time.monotonic()
+    up.fail = False
+    assert llm.chat([]) == "ok"
+    assert time.monotonic() - t0 >= 0.04  # Retry-After поставил провайдера на паузу
+    for _ in range(6):
+        llm.chat([])
+    assert limiter.rate_of("p") == 8.0  # не выше исходного потолка
+    assert ctl.stats()["throttled"] == 2
@@ -0,0 +1,69 @@
+from typing import List
+
+from core.history import HistoryRepository
+from embedder.base import BaseEmbedder
+from llm.base import BaseLLM
+from services.orchestrator import ChatOrchestrator
+from services.semantic_cache import SemanticCache
+
+VOCAB = ["chroma", "qdrant", "что", "такое", "расскажи", "про"]
+
+class BagOfWordsEmbedder(BaseEmbedder):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        words = text.lower().replace("?", "").split()
+        return [float(words.count(w)) + (0.1 if w == "chroma" else 0.0) for w in VOCAB]
+
+    def as_langchain(self):
+        return self
+
+class CountingLLM(BaseLLM):
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, messages):
+        self.calls += 1
+        return f"answer #{self.calls}"
+
+class NoRetriever:
+    available = False
+
+def make_orch(threshold=0.8):
+    cache = SemanticCache(BagOfWordsEmbedder(), threshold=threshold, max_entries=2)
+    llm = CountingLLM()
+    orch = ChatOrchestrator(
+        history=HistoryRepository(),
+        llm=llm,
+        retriever=NoRetriever(),
+        semantic_cache=cache,
+        semantic_channels=["telegram"],
+    )
+    return orch, llm, cache
+
+def test_paraphrase_served_from_semantic_cache():
+    orch, llm, cache = make_orch()
+    assert orch.reply("telegram", "u1", "Что такое Chroma?") == ["answer #1"]
+    assert orch.reply("telegram", "u2", "Chroma что такое") == ["answer #1"]
+    assert llm.calls == 1
+    assert orch.reply("telegram", "u3", "Расскажи про Qdrant") == ["answer #2"]
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["lookups"] == 3
+
+def test_semantic_cache_skips_multi_turn_and_other_channels():
+    orch, llm, cache = make_orch()
+    orch.reply("telegram", "u1", "Что такое Chroma?")
+    # второй ход того же диалога — не однократный вопрос
+    assert orch.reply("telegram", "u1", "Что такое Chroma?") == ["answer #2"]
+    # канал вне списка
+    assert orch.reply("web", "u2", "Что такое Chroma?") == ["answer #3"]
+    assert cache.stats()["lookups"] == 1
+
+def test_semantic_cache_evicts_least_recently_used():
+    cache = SemanticCache(BagOfWordsEmbedder(), threshold=0.99, max_entries=2)
+    for text in ["chroma", "qdrant", "про"]:
+        cache.remember(cache.probe("tg", text), f"about {text}")
+    assert cache.stats()["evictions"] == 1
+    assert cache.probe("tg", "chroma").answer is None
+    assert cache.probe("tg", "про").answer == "about про"
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+
+from core.singleflight import AsyncSingleFlight, SingleFlight
+from llm.base import AsyncBaseLLM
+from llm.decorators import AsyncCoalescingLLM, CoalescingLLM
+from services.retriever import CoalescingRetriever
+
+
+def test_concurrent_identical_calls_share_leader_result_and_error():
+    sf = SingleFlight("t")
+    calls = []
+    gate = threading.Event()
+
+    def slow():
+        calls.append(1)
+        gate.wait(2)
+        return "answer"
+
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(sf.do("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join(2)
+    assert out == ["answer"] * 5 and len(calls) == 1
+    assert sf.stats()["shared"] == 4 and len(sf) == 0
+
+    def boom():
+        time.sleep(0.05)
+        raise ValueError("upstream")
+
+    errors = []
+
+    def call():
+        try:
+            sf.do("e", boom)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert errors == ["upstream"] * 3
+
+
+def test_llm_and_retriever_wrappers_coalesce_by_canonical_key():
+    class Upstream:
+        calls = 0
+
+        def chat(self, messages):
+            Upstream.calls += 1
+            time.sleep(0.05)
+            return "ok"
+
+    llm = CoalescingLLM(Upstream(), model="m")
+    msgs = [{"role": "user", "content": "hi", "ts": 1}]
+    other = [{"role": "user", "content": "hi", "ts": 2}]  # служебные поля в ключ не входят
+    threads = [threading.Thread(target=llm.chat, args=(m,)) for m in (msgs, other, msgs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert Upstream.calls == 1 and llm.stats()["shared"] == 2
+
+    class Retr:
+        top_k, available, calls = 3, True, 0
+
+        def retrieve(self, query, k=None):
+            Retr.calls += 1
+            time.sleep(0.05)
+            return (query, k)
+
+    r = CoalescingRetriever(Retr())
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(r.retrieve("q"))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert out == [("q", 3)] * 4 and Retr.calls == 1 and r.available
+
+
+def test_async_followers_survive_leader_cancellation():
+    class Upstream(AsyncBaseLLM):
+        calls = 0
+
+        async def chat(self, messages):
+            Upstream.calls += 1
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        async def chat_stream(self, messages):
+            yield "ok"
+
+    async def go():
+        llm = AsyncCoalescingLLM(Upstream())
+        msgs = [{"role": "user", "content": "hi"}]
+        leader = asyncio.ensure_future(llm.chat(msgs))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(llm.chat(msgs)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()  # клиент лидера ушёл — остальным запрос всё ещё нужен
+        return await asyncio.gather(*followers), leader.cancelled()
+
+    answers, leader_cancelled = asyncio.run(go())
+    assert answers == ["ok"] * 3 and leader_cancelled and Upstream.calls == 1
+
+    async def all_leave():
+        sf = AsyncSingleFlight("t")
+        started = asyncio.Event()
+
+        async def never():
+            started.set()
+            await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(sf.do("k", never))
+        await started.wait()
+        task.cancel()
+        await asyncio.sleep(0.01)  # вызов лидера отменён, запись о нём убрана
+        return len(sf)
+
+    assert asyncio.run(all_leave()) == 0
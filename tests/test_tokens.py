@@ -0,0 +1,70 @@
+from core.history import HistoryRepository, Message
+from core.tokens import context_window, count_tokens, fit_to_budget, message_tokens
+from llm.base import BaseLLM
+from services.orchestrator import ChatOrchestrator
+
+
+def test_message_tokens_cached_on_record(monkeypatch):
+    import core.tokens as tokens
+
+    m = Message("user", "привет, мир")
+    n = message_tokens(m)
+    assert m.tokens == (None, n) and n > tokens.MESSAGE_OVERHEAD
+    monkeypatch.setattr(tokens, "count_tokens", lambda *a, **kw: 10**6)
+    assert message_tokens(m) == n  # второй раз не считаем
+    assert message_tokens({"role": "user", "content": "x" * 400}) == 10**6 + tokens.MESSAGE_OVERHEAD
+
+def test_message_tokens_cache_is_per_encoding(monkeypatch):
+    import core.tokens as tokens
+
+    class Enc:
+        def __init__(self, name, per_char):
+            self.name, self.per_char = name, per_char
+
+        def encode(self, text, disallowed_special=()):
+            return [0] * (len(text) * self.per_char)
+
+    encs = {"big": Enc("o200k", 1), "small": Enc("cl100k", 2), None: Enc("cl100k", 2)}
+    monkeypatch.setattr(tokens, "_encoding", encs.get)
+    m = Message("user", "abc")
+    assert message_tokens(m, "big") == 3 + tokens.MESSAGE_OVERHEAD
+    assert message_tokens(m, "small") == 6 + tokens.MESSAGE_OVERHEAD  # другая модель — пересчёт
+    assert message_tokens(m) == 6 + tokens.MESSAGE_OVERHEAD and m.tokens == ("cl100k", 10)
+
+def test_fit_to_budget_keeps_newest_and_current_question():
+    msgs = [Message("user", "x" * 400) for _ in range(5)] + [Message("user", "ok")]
+    fitted = fit_to_budget(msgs, budget=250)
+    assert fitted[-1] is msgs[-1]
+    assert len(fitted) == 3  # 2 + 104 + 104 токена
+    assert fit_to_budget([Message("user", "y" * 10_000)], budget=10)[0]["content"] == "y" * 10_000
+
+def test_context_window_by_model_name():
+    assert context_window("openai/gpt-4o-mini") == 128_000
+    assert context_window("unknown-model", default=4096) == 4096
+    assert count_tokens("") == 0
+
+class EchoLLM(BaseLLM):
+    model = "unit-test-model"
+
+    def __init__(self):
+        self.seen = []
+
+    def chat(self, messages):
+        self.seen.append(list(messages))
+        return "ok"
+
+class NoRetriever:
+    available = False
+
+def test_orchestrator_trims_prompt_to_token_budget():
+    llm = EchoLLM()
+    orch = ChatOrchestrator(
+        history=HistoryRepository(window=50), llm=llm, retriever=NoRetriever(),
+        semantic_cache=None, context_tokens=1200, completion_tokens=200,
+    )
+    orch.reply("web", "u1", "лог: " + "E" * 8000)  # огромная вставка
+    orch.reply("web", "u1", "а теперь коротко?")
+    prompt = llm.seen[-1]
+    assert prompt[-1]["content"] == "а теперь коротко?"
+    assert all("E" * 100 not in m["content"] for m in prompt)
+    assert sum(message_tokens(m) for m in prompt) <= 1000
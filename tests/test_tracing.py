@@ -0,0 +1,74 @@
+import json
+import logging
+from typing import List
+
+from fastapi.testclient import TestClient
+
+from api.app import create_app
+from core import tracing
+from core.logging import JsonFormatter
+from core.tracing import span
+
+
+class SlowOrchestrator:
+    def reply(self, channel: str, user_id: str, user_text: str) -> List[str]:
+        with span("retriever.retrieve"):
+            pass
+        for _ in range(2):
+            with span("llm.chat"):
+                pass
+        return ["ok"]
+
+def test_server_timing_and_traceparent():
+    app = create_app()
+    client = TestClient(app)
+    app.state.orch = SlowOrchestrator()
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    r = client.post(
+        "/v1/chat",
+        json={"channel": "web", "user_id": "u", "text": "x"},
+        headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+    )
+    assert r.status_code == 200
+    assert r.headers["x-trace-id"] == trace_id
+    timing = r.headers["server-timing"]
+    assert "retriever.retrieve;dur=" in timing and "total;dur=" in timing
+    assert timing.count("llm.chat") == 1  # одноимённые спаны суммируются
+
+    r = client.post("/v1/chat", json={"channel": "web", "user_id": "u", "text": "x"})
+    assert len(r.headers["x-trace-id"]) == 32 and r.headers["x-trace-id"] != trace_id
+
+def test_otlp_file_exporter_links_spans(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracing.configure(export_path=str(path))
+    try:
+        with span("chat.reply", channel="web"):
+            with span("llm.chat", model="m"):
+                pass
+    finally:
+        tracing.shutdown()
+    spans = [
+        s
+        for line in path.read_text().splitlines()
+        for rs in json.loads(line)["resourceSpans"]
+        for ss in rs["scopeSpans"]
+        for s in ss["spans"]
+    ]
+    child, root = spans
+    assert child["traceId"] == root["traceId"] and child["parentSpanId"] == root["spanId"]
+    assert "parentSpanId" not in root
+    assert {"key": "model", "value": {"stringValue": "m"}} in child["attributes"]
+    assert span("outside") is tracing._NOOP  # без запроса и экспорта — бесплатно
+
+def test_json_log_record_carries_trace_ids():
+    trace = tracing.Trace()
+    token = tracing._TRACE.set(trace)
+    try:
+        with span("work") as s:
+            record = logging.LogRecord("x", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+            tracing.TraceContextFilter().filter(record)
+    finally:
+        tracing._TRACE.reset(token)
+    out = json.loads(JsonFormatter().format(record))
+    assert out["msg"] == "hello world"
+    assert out["trace_id"] == trace.trace_id and out["span_id"] == s.span_id
@@ -0,0 +1,155 @@
+import threading
+from typing import List
+
+import numpy as np
+
+from embedder.base import BaseEmbedder
+from vectorstores.numpy_store import NumpyVectorStore
+
+WORDS = ["chroma", "qdrant", "rag", "pinecone", "wiki"]
+
+class KeywordEmbedder(BaseEmbedder):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        low = text.lower()
+        return [float(low.count(w)) + 0.01 for w in WORDS]
+
+    def as_langchain(self):
+        return self
+
+DOCS = [
+    "Chroma - локальная векторная база",
+    "Qdrant - продакшен-векторстор",
+    "RAG использует wiki",
+    "Pinecone - векторы в облаке",
+]
+
+def test_numpy_store_search_and_persist(tmp_path):
+    path = tmp_path / "store.oavs"
+    store = NumpyVectorStore(KeywordEmbedder(), path=str(path))
+    assert store.add_texts(DOCS, metadatas=[{"n": i} for i in range(4)], ids=["a", "b", "c", "d"]) == 4
+    assert store.search("что такое qdrant?", k=1) == ["Qdrant - продакшен-векторстор"]
+    assert len(store.search("rag wiki", k=10)) == 4
+    assert not path.exists()  # запись не переписывает файл, сохраняет flush
+    store.flush()
+
+    reopened = NumpyVectorStore(KeywordEmbedder(), path=str(path), mmap=True)
+    assert isinstance(reopened.raw(), np.memmap)
+    assert reopened.search("pinecone", k=1) == ["Pinecone - векторы в облаке"]
+
+    # upsert по id и дозапись после загрузки с диска
+    reopened.add_texts(["Chroma хранит wiki"], ids=["a"])
+    reopened.add_texts(["Qdrant и Chroma"], ids=["e"])
+    assert len(reopened) == 5
+    assert reopened.search("chroma wiki", k=1) == ["Chroma хранит wiki"]
+
+def test_numpy_store_top_k_is_sorted():
+    store = NumpyVectorStore(KeywordEmbedder())
+    store.add_texts(DOCS)
+    hits = store.top_k(store._embed_query("chroma qdrant"), k=3)
+    scores = [s for _, s in hits]
+    assert scores == sorted(scores, reverse=True)
+
+from vectorstores.ann import recall_at_k
+
+def test_ivf_index_recall_against_brute_force(tmp_path):
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(8, 16))
+    data = np.concatenate([c + 0.1 * rng.normal(size=(100, 16)) for c in centers]).astype(np.float32)
+
+    path = tmp_path / "ivf.oavs"
+    store = NumpyVectorStore(KeywordEmbedder(), path=str(path), index="ivf", nlist=8, nprobe=2, autosave=False)
+    store._ann.train_min = 400
+    store.add_embeddings([f"doc {i}" for i in range(400)], data[:400])
+    assert store._ann.trained
+    store.add_embeddings([f"doc {i}" for i in range(400, 800)], data[400:])  # инкрементальная вставка
+    assert len(store._ann) == 800
+
+    queries = store.raw()[rng.choice(800, size=20, replace=False)]
+    full = recall_at_k(lambda q, k: store.top_k(q, k, nprobe=8), store.exact_top_k, queries, k=5)
+    assert full["recall"] == 1.0
+    partial = recall_at_k(store.top_k, store.exact_top_k, queries, k=5)
+    assert partial["recall"] >= 0.8
+
+    store.save()
+    reopened = NumpyVectorStore(KeywordEmbedder(), path=str(path), index="ivf", nlist=8, nprobe=2)
+    assert reopened._ann.trained and len(reopened._ann) == 800
+    assert reopened.top_k(queries[0], 1)[0][0] == store.top_k(queries[0], 1)[0][0]
+
+from services.retriever import Retriever
+
+def test_retriever_scores_and_cutoff():
+    store = NumpyVectorStore(KeywordEmbedder())
+    store.add_texts(DOCS, metadatas=[{"source": f"doc{i}.md"} for i in range(4)], ids=["a", "b", "c", "d"])
+
+    hits = store.search_with_scores("qdrant", k=2)
+    assert hits[0].id == "b" and hits[0].metadata == {"source": "doc1.md"}
+    assert hits[0].score > hits[1].score
+
+    rr = Retriever(store=store, top_k=4, min_score=0.5).retrieve("qdrant")
+    assert [c.content for c in rr.chunks] == ["Qdrant - продакшен-векторстор"]
+    assert rr.chunks[0].source == "doc1.md"
+    assert rr.chunks[0].metadata["id"] == "b"
+
+def test_numpy_store_delete_keeps_ivf_consistent(tmp_path):
+    rng = np.random.default_rng(2)
+    data = rng.normal(size=(400, 8)).astype(np.float32)
+    store = NumpyVectorStore(KeywordEmbedder(), path=str(tmp_path / "d.oavs"), index="ivf", nlist=4, nprobe=4)
+    store.add_embeddings([f"t{i}" for i in range(400)], data, ids=[str(i) for i in range(400)])
+    assert store.delete([str(i) for i in range(0, 400, 2)] + ["missing"]) == 200
+    assert len(store) == 200
+
+    # полный просмотр IVF совпадает с точным поиском по оставшимся строкам
+    q = data[1] / np.linalg.norm(data[1])
+    assert store.top_k(q, k=5, nprobe=4) == store.exact_top_k(q, k=5)
+    assert store.search_with_scores("x", k=0) == []
+    store.flush()
+    reopened = NumpyVectorStore(KeywordEmbedder(), path=str(tmp_path / "d.oavs"))
+    assert reopened.raw()[0].tolist() == store.raw()[0].tolist()
+    assert reopened._ids[0] == "1"
+
+def test_numpy_store_search_during_delete():
+    rng = np.random.default_rng(3)
+    data = rng.normal(size=(2000, 8)).astype(np.float32)
+    store = NumpyVectorStore(KeywordEmbedder())
+    store.add_embeddings([f"t{i}" for i in range(2000)], data, ids=[str(i) for i in range(2000)])
+    errors = []
+
+    def reader():
+        try:
+            for i in range(300):
+                for hit in store.search_by_vector(data[i % 50], k=10):
+                    assert hit.content == f"t{hit.id}"
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    t = threading.Thread(target=reader)
+    t.start()
+    for start in range(0, 1900, 100):
+        store.delete([str(i) for i in range(start, start + 100)])
+    t.join()
+    assert errors == []
+
+def test_numpy_store_reports_untrained_ivf():
+    data = np.random.default_rng(4).normal(size=(100, 8)).astype(np.float32)
+    store = NumpyVectorStore(KeywordEmbedder(), index="ivf", nlist=8)
+    store.add_embeddings([str(i) for i in range(100)], data)
+    assert not store.ann_trained  # 100 < 39×8: поиск пока точный
+    forced = NumpyVectorStore(KeywordEmbedder(), index="ivf", nlist=8, train_min=50)
+    forced.add_embeddings([str(i) for i in range(100)], data)
+    assert forced.ann_trained
+
+def test_numpy_store_upsert_keeps_snapshots_consistent():
+    store = NumpyVectorStore(KeywordEmbedder())
+    store.add_texts(["Chroma", "Qdrant"], metadatas=[{"v": 1}, {"v": 1}], ids=["a", "b"])
+    vecs, n, ids, texts, metas = store._snapshot()
+    before = vecs[:n].copy()
+
+    store.add_texts(["Pinecone", "RAG"], metadatas=[{"v": 2}, {"v": 2}], ids=["a", "c"])
+    # уже взятый снимок не видит полузаписанный upsert
+    assert texts[:n] == ["Chroma", "Qdrant"] and [m["v"] for m in metas[:n]] == [1, 1]
+    assert np.array_equal(vecs[:n], before)
+    assert [h.content for h in store.search_with_scores("pinecone", k=1)] == ["Pinecone"]
+    assert store.search_with_scores("pinecone", k=1)[0].metadata == {"v": 2}
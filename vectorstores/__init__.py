@@ -1,11 +1,17 @@
-from .base import BaseVectorStore
+from .base import BaseVectorStore, SearchHit
 from .chroma_store import ChromaVectorStore
 from .qdrant_store import QdrantVectorStore
+from .numpy_store import NumpyVectorStore
+from .ann import IVFIndex, recall_at_k
 from .factory import make_store
 
 __all__ = [
     "BaseVectorStore",
+    "SearchHit",
     "ChromaVectorStore",
     "QdrantVectorStore",
+    "NumpyVectorStore",
+    "IVFIndex",
+    "recall_at_k",
     "make_store",
 ]
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Приближённый поиск соседей: IVF (inverted file) с грубым квантованием сферическим k-means.
+    Векторы индекс не хранит — только центроиды и списки строк; матрицу передаёт владелец
+    (NumpyVectorStore). Вставки инкрементальные: новая строка попадает в список ближайшего центроида.
+    nprobe — сколько списков просматривать: больше — выше recall, медленнее поиск.
+    """
+
+    def __init__(
+        self,
+        nlist: int = 256,
+        nprobe: int = 8,
+        train_min: Optional[int] = None,
+        kmeans_iters: int = 20,
+        seed: int = 0,
+    ) -> None:
+        self.nlist = max(1, int(nlist))
+        self.nprobe = max(1, int(nprobe))
+        # Обучаем не раньше, чем наберётся по ~40 точек на кластер (эвристика FAISS)
+        self.train_min = int(train_min) if train_min is not None else 39 * self.nlist
+        self.kmeans_iters = max(1, int(kmeans_iters))
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_on = 0
+        self._lists: List[List[int]] = []
+        self._arrays: List[Optional[np.ndarray]] = []
+        self._assign: Dict[int, int] = {}
+
+    def reset(self) -> None:
+        self.centroids = None
+        self.trained_on = 0
+        self._lists, self._arrays, self._assign = [], [], {}
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return len(self._assign)
+
+    # --- обучение и вставка ---
+
+    def train(self, vectors: np.ndarray) -> None:
+        n = vectors.shape[0]
+        k = min(self.nlist, n)
+        rng = np.random.default_rng(self.seed)
+        cent = vectors[rng.choice(n, size=k, replace=False)].astype(np.float32, copy=True)
+        for _ in range(self.kmeans_iters):
+            labels = self._nearest(vectors, cent)
+            sums = np.zeros_like(cent)
+            np.add.at(sums, labels, vectors)
+            counts = np.bincount(labels, minlength=k)
+            empty = counts == 0
+            if empty.any():
+                # пустые кластеры переносим на случайные точки
+                sums[empty] = vectors[rng.choice(n, size=int(empty.sum()), replace=False)]
+            cent = _normalize(sums)
+        self.centroids = cent
+        self.trained_on = n
+        self._lists = [[] for _ in range(k)]
+        self._arrays = [None] * k
+        self._assign = {}
+        self.add(np.arange(n), vectors)
+
+    def add(self, rows: Union[np.ndarray, Sequence[int]], vectors: np.ndarray) -> None:
+        if self.centroids is None or len(rows) == 0:
+            return
+        labels = self._nearest(vectors, self.centroids)
+        for row, lab in zip(np.asarray(rows).tolist(), labels.tolist()):
+            old = self._assign.get(row)
+            if old == lab:
+                continue
+            if old is not None:  # upsert: вектор строки поменялся
+                self._lists[old].remove(row)
+                self._arrays[old] = None
+            self._lists[lab].append(row)
+            self._arrays[lab] = None
+            self._assign[row] = lab
+
+    def remap(self, keep: np.ndarray, n_old: int) -> None:
+        """Строки keep остались (по порядку), остальные удалены: перенумеровываем списки без переобучения."""
+        if self.centroids is None:
+            return
+        new_row = np.full(n_old, -1, dtype=np.int64)
+        new_row[keep] = np.arange(len(keep), dtype=np.int64)
+        self._assign = {}
+        for lab, lst in enumerate(self._lists):
+            rows = new_row[np.asarray(lst, dtype=np.int64)] if lst else np.zeros(0, np.int64)
+            lst[:] = rows[rows >= 0].tolist()
+            for row in lst:
+                self._assign[row] = lab
+        self._arrays = [None] * len(self._lists)
+
+    def maybe_train(self, matrix: np.ndarray, n: int, growth: float = 4.0) -> bool:
+        """Обучает индекс при достижении train_min и переобучает, когда корпус вырос в growth раз."""
+        if n < self.train_min:
+            return False
+        if self.centroids is not None and n < growth * self.trained_on:
+            return False
+        self.train(np.asarray(matrix[:n]))
+        return True
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+        # Блоками, чтобы матрица расстояний n×nlist не раздувала память
+        out = np.empty(vectors.shape[0], dtype=np.int64)
+        for i in range(0, vectors.shape[0], batch):
+            out[i:i + batch] = np.argmax(vectors[i:i + batch] @ centroids.T, axis=1)
+        return out
+
+    # --- поиск ---
+
+    def _list_array(self, i: int) -> np.ndarray:
+        arr = self._arrays[i]
+        if arr is None:
+            arr = self._arrays[i] = np.asarray(self._lists[i], dtype=np.int64)
+        return arr
+
+    def search(
+        self,
+        query: np.ndarray,
+        matrix: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+    ) -> List[Tuple[int, float]]:
+        if self.centroids is None or k <= 0:
+            return []
+        probe = min(int(nprobe or self.nprobe), self.centroids.shape[0])
+        cscores = self.centroids @ query
+        if probe < cscores.shape[0]:
+            lists = np.argpartition(-cscores, probe - 1)[:probe]
+        else:
+            lists = np.arange(cscores.shape[0])
+        cand = np.concatenate([self._list_array(int(i)) for i in lists])
+        if cand.size == 0:
+            return []
+        scores = matrix[cand] @ query
+        k = min(int(k), cand.size)
+        top = np.argpartition(-scores, k - 1)[:k] if k < cand.size else np.arange(cand.size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(cand[i]), float(scores[i])) for i in top]
+
+    # --- персистентность ---
+
+    def save(self, path: Union[str, Path]) -> None:
+        if self.centroids is None:
+            return
+        sizes = np.asarray([len(lst) for lst in self._lists], dtype=np.int64)
+        rows = np.concatenate([self._list_array(i) for i in range(len(self._lists))]) if len(self) else np.zeros(0, np.int64)
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            tmp,
+            centroids=self.centroids,
+            sizes=sizes,
+            rows=rows,
+            meta=np.asarray([self.nlist, self.nprobe, self.trained_on], dtype=np.int64),
+        )
+        tmp.replace(path)
+
+    def load(self, path: Union[str, Path]) -> None:
+        with np.load(path) as data:
+            self.centroids = data["centroids"].astype(np.float32, copy=False)
+            sizes = data["sizes"]
+            rows = data["rows"]
+            _, _, self.trained_on = (int(x) for x in data["meta"])
+        self._lists = []
+        self._assign = {}
+        start = 0
+        for lab, size in enumerate(sizes.tolist()):
+            chunk = rows[start:start + size].tolist()
+            self._lists.append(chunk)
+            for row in chunk:
+                self._assign[row] = lab
+            start += size
+        self._arrays = [None] * len(self._lists)
+
+
+def recall_at_k(
+    ann_search: Callable[[np.ndarray, int], Iterable[Tuple[int, float]]],
+    exact_search: Callable[[np.ndarray, int], Iterable[Tuple[int, float]]],
+    queries: np.ndarray,
+    k: int = 10,
+) -> Dict[str, Any]:
+    """
+    Доля точных k ближайших (полный перебор), найденных ANN-поиском, и средние задержки обоих.
+    """
+    found = 0
+    total = 0
+    ann_s = exact_s = 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        approx = {row for row, _ in ann_search(q, k)}
+        t1 = time.perf_counter()
+        exact = {row for row, _ in exact_search(q, k)}
+        t2 = time.perf_counter()
+        ann_s += t1 - t0
+        exact_s += t2 - t1
+        found += len(approx & exact)
+        total += len(exact)
+    nq = max(1, len(queries))
+    return {
+        "recall": (found / total) if total else 1.0,
+        "k": k,
+        "queries": len(queries),
+        "ann_ms": ann_s * 1000.0 / nq,
+        "exact_ms": exact_s * 1000.0 / nq,
+    }
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
@@ -1,8 +1,17 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from typing import List, Optional, Sequence, Dict, Any
 
 
+@dataclass(frozen=True)
+class SearchHit:
+    content: str
+    id: Optional[str] = None
+    score: Optional[float] = None  # близость: больше — релевантнее
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
 class BaseVectorStore(ABC):
     @abstractmethod
     def add_texts(
@@ -13,9 +22,38 @@ class BaseVectorStore(ABC):
     ) -> int:
         ...
 
+    def add_embeddings(
+        self,
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> int:
+        # Запись готовых векторов (массовая загрузка). Без нативной поддержки — пересчёт через add_texts
+        return self.add_texts(texts, metadatas=metadatas, ids=ids)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        # Удаление по id (инкрементальная переиндексация); отсутствующие id игнорируются
+        raise NotImplementedError(f"{type(self).__name__} не поддерживает удаление")
+
+    def flush(self) -> None:
+        # Сброс буферизованной записи на диск; сторы с автосохранением ничего не делают
+        return None
+
     @abstractmethod
     def search(self, query: str, k: int = 4) -> List[str]:
         ...
 
+    def search_with_scores(self, query: str, k: int = 4) -> List[SearchHit]:
+        # Сторы без оценок отдают голые тексты; реализации с оценками переопределяют
+        return [SearchHit(content=c) for c in self.search(query, k=k)]
+
+    def embed_query(self, query: str) -> Optional[Any]:
+        # Эмбеддинг запроса отдельно от поиска (метрики по стадиям); None — стор делает это внутри поиска
+        return None
+
+    def search_by_vector(self, vector: Any, k: int = 4) -> List[SearchHit]:
+        raise NotImplementedError(f"{type(self).__name__} не ищет по готовому вектору")
+
     def raw(self) -> Any:
         return None
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import uuid
 from typing import Sequence, Optional, Dict, Any, List, Union, TYPE_CHECKING
 from pathlib import Path
 
@@ -7,7 +8,9 @@ try:
 except Exception:
     from langchain_community.vectorstores import Chroma as LCChroma  # fallback
 
-from .base import BaseVectorStore
+from core.tracing import span
+
+from .base import BaseVectorStore, SearchHit
 
 if TYPE_CHECKING:
     from embedder.base import BaseEmbedder, SupportsLangChainEmbedding
@@ -43,15 +46,57 @@ class ChromaVectorStore(BaseVectorStore):
         ids: Optional[Sequence[str]] = None,
     ) -> int:
         self._db.add_texts(list(texts), metadatas=metadatas, ids=ids)
+        self.flush()
+        return len(texts)
+
+    def add_embeddings(
+        self,
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> int:
+        # Готовые векторы пишем прямо в коллекцию, минуя embedding_function
+        texts = list(texts)
+        if not texts:
+            return 0
+        self._db._collection.upsert(
+            ids=[str(i) for i in ids] if ids is not None else [str(uuid.uuid4()) for _ in texts],
+            embeddings=[[float(x) for x in v] for v in embeddings],
+            documents=texts,
+            metadatas=[dict(m) for m in metadatas] if metadatas is not None else None,
+        )
+        return len(texts)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        ids = [str(i) for i in ids]
+        if ids:
+            self._db._collection.delete(ids=ids)
+        return len(ids)
+
+    def flush(self) -> None:
         try:
             self._db.persist()
         except Exception:
             pass
-        return len(texts)
 
     def search(self, query: str, k: int = 4) -> List[str]:
         docs = self._db.similarity_search(query, k=k)
         return [d.page_content for d in docs]
 
+    def search_with_scores(self, query: str, k: int = 4) -> List[SearchHit]:
+        # relevance score LangChain нормирован в [0, 1]: 1 — совпадение
+        with span("vectorstore.search", store="chroma", k=k):
+            pairs = self._db.similarity_search_with_relevance_scores(query, k=k)
+        return [
+            SearchHit(
+                content=d.page_content,
+                id=getattr(d, "id", None),
+                score=float(score),
+                metadata=dict(d.metadata or {}),
+            )
+            for d, score in pairs
+        ]
+
     def raw(self):
         return self._db
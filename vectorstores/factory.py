@@ -5,6 +5,7 @@ from typing import Optional
 from .base import BaseVectorStore
 from .chroma_store import ChromaVectorStore
 from .qdrant_store import QdrantVectorStore
+from .numpy_store import NumpyVectorStore
 
 # используем наш слой эмбеддингов
 from embedder.factory import make_embedder
@@ -36,4 +37,12 @@ def make_store(provider: Optional[str] = None) -> Optional[BaseVectorStore]:
         collection = getattr(settings, "QDRANT_COLLECTION", "rag_demo") if settings else "rag_demo"
         return QdrantVectorStore(embeddings=emb_lc, url=url, api_key=(api_key or None), collection_name=collection)
 
+    if prov == "numpy":
+        path = getattr(settings, "NUMPY_STORE_PATH", "./numpy_store/store.oavs") if settings else "./numpy_store/store.oavs"
+        mmap = getattr(settings, "NUMPY_STORE_MMAP", True) if settings else True
+        index = getattr(settings, "NUMPY_STORE_INDEX", "flat") if settings else "flat"
+        nlist = getattr(settings, "IVF_NLIST", 256) if settings else 256
+        nprobe = getattr(settings, "IVF_NPROBE", 8) if settings else 8
+        return NumpyVectorStore(embeddings=emb, path=path or None, mmap=mmap, index=index, nlist=nlist, nprobe=nprobe)
+
     raise ValueError(f"Unknown VectorStore provider: {prov}")
@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import json
+import os
+import struct
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+
+import numpy as np
+
+from core.tracing import span
+
+from .base import BaseVectorStore, SearchHit
+from .ann import IVFIndex
+
+if TYPE_CHECKING:
+    from embedder.base import BaseEmbedder, SupportsLangChainEmbedding
+else:
+    BaseEmbedder = object               # заглушки
+    SupportsLangChainEmbedding = object
+
+
+_MAGIC = b"OAVS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIQIQ")  # magic, version, rows, dim, json_len
+_ALIGN = 64
+
+# матрица, число строк, ids, тексты, payload
+_Snapshot = Tuple[np.ndarray, int, List[str], List[str], List[Dict[str, Any]]]
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """
+    Векторное хранилище в процессе: непрерывная float32-матрица нормированных векторов
+    + id и payload рядом. Поиск — одно матричное умножение и argpartition, без циклов по строкам.
+    Персистентность — один файл: заголовок, JSON с payload и выровненная матрица,
+    которая при загрузке отображается через np.memmap без копирования.
+    index="ivf" включает приближённый поиск (IVFIndex) для больших корпусов;
+    до набора train_min векторов поиск остаётся точным.
+    Запись не сохраняется сама: файл целиком переписывается на flush() (после пачки);
+    autosave=True — сохранение после каждой записи, для мелких правок вручную.
+    """
+
+    def __init__(
+        self,
+        embeddings: Union[BaseEmbedder, SupportsLangChainEmbedding],
+        path: Optional[str] = None,
+        mmap: bool = True,
+        autosave: bool = False,
+        index: Optional[str] = None,
+        nlist: int = 256,
+        nprobe: int = 8,
+        train_min: Optional[int] = None,
+    ) -> None:
+        self._emb = embeddings
+        self.path = Path(path) if path else None
+        self.use_mmap = bool(mmap)
+        self.autosave = bool(autosave)
+        self._lock = threading.RLock()
+
+        self._vecs: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+        self._n = 0
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metas: List[Dict[str, Any]] = []
+        self._row: Dict[str, int] = {}
+
+        kind = (index or "flat").lower()
+        if kind not in ("flat", "ivf"):
+            raise ValueError(f"Unknown vector index: {index}")
+        self._ann: Optional[IVFIndex] = (
+            IVFIndex(nlist=nlist, nprobe=nprobe, train_min=train_min) if kind == "ivf" else None
+        )
+
+        if self.path is not None and self.path.exists():
+            self.load(self.path)
+
+    # --- запись ---
+
+    def add_texts(
+        self,
+        texts: Sequence[str],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> int:
+        texts = list(texts)
+        if not texts:
+            return 0
+        vectors = np.asarray(self._emb.embed_documents(texts), dtype=np.float32)
+        self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+        return len(texts)
+
+    def add_embeddings(
+        self,
+        texts: Sequence[str],
+        embeddings: Union[np.ndarray, Sequence[Sequence[float]]],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> int:
+        n = len(texts)
+        if n == 0:
+            return 0
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if vectors.ndim != 2 or vectors.shape[0] != n:
+            raise ValueError("texts и embeddings разной длины")
+        metas = list(metadatas) if metadatas is not None else [{} for _ in range(n)]
+        keys = [str(i) for i in ids] if ids is not None else [uuid.uuid4().hex for _ in range(n)]
+
+        with self._lock:
+            shared = self._vecs
+            self._ensure_capacity(self._n + n, vectors.shape[1])
+            if any(key in self._row for key in keys):
+                # upsert переписывает строки до _n: копируем то, что могли взять снимки поиска
+                if self._vecs is shared:
+                    self._vecs = self._vecs.copy()
+                self._texts = list(self._texts)
+                self._metas = list(self._metas)
+            rows: List[int] = []
+            for text, vec, meta, key in zip(texts, vectors, metas, keys):
+                row = self._row.get(key)
+                if row is None:  # новая запись
+                    row = self._n
+                    self._n += 1
+                    self._ids.append(key)
+                    self._texts.append(text)
+                    self._metas.append(dict(meta or {}))
+                    self._row[key] = row
+                else:            # upsert по существующему id
+                    self._texts[row] = text
+                    self._metas[row] = dict(meta or {})
+                self._vecs[row] = vec
+                rows.append(row)
+            if self._ann is not None and not self._ann.maybe_train(self._vecs, self._n):
+                self._ann.add(rows, vectors)
+            if self.autosave and self.path is not None:
+                self.save()
+        return n
+
+    def delete(self, ids: Sequence[str]) -> int:
+        with self._lock:
+            drop = [self._row[key] for key in map(str, ids) if key in self._row]
+            if not drop:
+                return 0
+            mask = np.ones(self._n, dtype=bool)
+            mask[drop] = False
+            keep = np.flatnonzero(mask)
+            # Уплотняем строки: матрица остаётся непрерывной, поиск — одно умножение
+            self._vecs = np.array(self._vecs[keep], dtype=np.float32)
+            self._ids = [self._ids[i] for i in keep.tolist()]
+            self._texts = [self._texts[i] for i in keep.tolist()]
+            self._metas = [self._metas[i] for i in keep.tolist()]
+            self._row = {key: i for i, key in enumerate(self._ids)}
+            if self._ann is not None:
+                self._ann.remap(keep, self._n)
+            self._n = len(self._ids)
+            if self._n == 0:
+                self._vecs = np.zeros((0, 0), dtype=np.float32)
+            if self.autosave and self.path is not None:
+                self.save()
+        return len(drop)
+
+    def _ensure_capacity(self, rows: int, dim: int) -> None:
+        if self._vecs.shape[1] not in (0, dim):
+            raise ValueError(f"Размерность {dim} не совпадает с хранилищем ({self._vecs.shape[1]})")
+        # Отображённая с диска матрица только для чтения — при первой записи переносим в память.
+        # Ёмкость растёт геометрически, чтобы дозапись была амортизированно O(1)
+        if rows <= self._vecs.shape[0] and not isinstance(self._vecs, np.memmap):
+            return
+        cap = max(rows, 2 * self._vecs.shape[0], 64)
+        grown = np.zeros((cap, dim), dtype=np.float32)
+        if self._n:
+            grown[: self._n] = self._vecs[: self._n]
+        self._vecs = grown
+
+    # --- поиск ---
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        return _normalize(np.asarray(self._emb.embed_query(query), dtype=np.float32))
+
+    def _snapshot(self) -> _Snapshot:
+        # delete и upsert заменяют матрицу и списки копиями, дозапись идёт за строкой _n — снимок согласован
+        with self._lock:
+            return self._vecs, self._n, self._ids, self._texts, self._metas
+
+    def _rows(
+        self, vector: np.ndarray, k: int, nprobe: Optional[int] = None
+    ) -> Tuple[List[Tuple[int, float]], _Snapshot]:
+        ann = self._ann
+        with self._lock:
+            snap = self._snapshot()
+            if ann is not None and ann.trained:
+                # списки IVF перестраиваются на месте при delete — ищем под блокировкой
+                return ann.search(vector, snap[0], k, nprobe=nprobe), snap
+        return _exact_top_k(snap[0], snap[1], vector, k), snap
+
+    def top_k(self, vector: np.ndarray, k: int = 4, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(строка, косинусная близость) для k ближайших векторов, по убыванию близости."""
+        return self._rows(vector, k, nprobe)[0]
+
+    def exact_top_k(self, vector: np.ndarray, k: int = 4) -> List[Tuple[int, float]]:
+        vecs, n = self._snapshot()[:2]
+        return _exact_top_k(vecs, n, vector, k)
+
+    def search(self, query: str, k: int = 4) -> List[str]:
+        rows, (_, _, _, texts, _) = self._rows(self._embed_query(query), k)
+        return [texts[row] for row, _ in rows]
+
+    def search_with_scores(self, query: str, k: int = 4) -> List[SearchHit]:
+        return self.search_by_vector(self._embed_query(query), k)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self._embed_query(query)
+
+    def search_by_vector(self, vector: np.ndarray, k: int = 4) -> List[SearchHit]:
+        ann = self._ann
+        with span("vectorstore.search", store="numpy", rows=self._n, ivf=ann is not None and ann.trained):
+            rows, (_, _, ids, texts, metas) = self._rows(vector, k)
+            return [
+                SearchHit(content=texts[row], id=ids[row], score=score, metadata=dict(metas[row]))
+                for row, score in rows
+            ]
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def ann_trained(self) -> bool:
+        """Поиск идёт через IVF; False — индекса нет или он ещё не обучен и поиск точный."""
+        return self._ann is not None and self._ann.trained
+
+    # --- персистентность ---
+
+    def flush(self) -> None:
+        if self.path is not None:
+            self.save()
+
+    def save(self, path: Optional[Union[str, Path]] = None) -> None:
+        target = Path(path) if path else self.path
+        if target is None:
+            raise ValueError("Не задан путь для сохранения")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            payload = json.dumps(
+                {"ids": self._ids, "texts": self._texts, "metadatas": self._metas},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            dim = self._vecs.shape[1] if self._n else 0
+            head = _HEADER.pack(_MAGIC, _VERSION, self._n, dim, len(payload))
+            pad = (-(len(head) + len(payload))) % _ALIGN
+            tmp = target.with_name(target.name + ".tmp")
+            with open(tmp, "wb") as f:
+                f.write(head)
+                f.write(payload)
+                f.write(b"\0" * pad)
+                f.write(np.ascontiguousarray(self._vecs[: self._n]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            # Атомарная замена: читатели со старым memmap продолжают видеть прежний файл
+            os.replace(tmp, target)
+            if self._ann is not None and self._ann.trained:
+                self._ann.save(_index_path(target))
+
+    def load(self, path: Union[str, Path]) -> None:
+        path = Path(path)
+        with open(path, "rb") as f:
+            magic, version, rows, dim, json_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"{path}: неизвестный формат хранилища")
+            payload = json.loads(f.read(json_len).decode("utf-8"))
+        offset = _HEADER.size + json_len
+        offset += (-offset) % _ALIGN
+
+        with self._lock:
+            if rows == 0:
+                vecs = np.zeros((0, 0), dtype=np.float32)
+            elif self.use_mmap:
+                vecs = np.memmap(path, dtype=np.float32, mode="r", offset=offset, shape=(rows, dim))
+            else:
+                vecs = np.fromfile(path, dtype=np.float32, count=rows * dim, offset=offset).reshape(rows, dim)
+            self._vecs = vecs
+            self._n = int(rows)
+            self._ids = list(payload["ids"])
+            self._texts = list(payload["texts"])
+            self._metas = list(payload["metadatas"])
+            self._row = {key: i for i, key in enumerate(self._ids)}
+
+            if self._ann is not None:
+                ipath = _index_path(path)
+                if ipath.exists():
+                    self._ann.load(ipath)
+                if len(self._ann) != self._n:
+                    # индекса нет или он от другой версии файла — строим заново
+                    self._ann.reset()
+                    self._ann.maybe_train(self._vecs, self._n)
+
+    def raw(self):
+        return self._vecs[: self._n]
+
+
+def _index_path(path: Path) -> Path:
+    return path.with_name(path.name + ".ivf.npz")
+
+
+def _exact_top_k(vecs: np.ndarray, n: int, vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    if n == 0 or k <= 0:
+        return []
+    scores = vecs[:n] @ vector
+    k = min(int(k), n)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    return [(int(i), float(scores[i])) for i in idx]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # Косинусная близость = скалярное произведение нормированных векторов
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
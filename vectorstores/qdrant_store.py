@@ -1,4 +1,5 @@
 from __future__ import annotations
+import uuid
 from typing import Sequence, Optional, Dict, Any, List, Union, TYPE_CHECKING
 
 
@@ -9,11 +10,13 @@ except Exception:
 
 try:
     from qdrant_client import QdrantClient
-    from qdrant_client.http.models import Distance, VectorParams
+    from qdrant_client.http.models import Distance, PointIdsList, PointStruct, VectorParams
 except Exception as e:
     raise ImportError("Нужны пакеты qdrant-client и langchain-(qdrant|community)") from e
 
-from .base import BaseVectorStore
+from core.tracing import span
+
+from .base import BaseVectorStore, SearchHit
 
 if TYPE_CHECKING:
     from embedder.base import BaseEmbedder, SupportsLangChainEmbedding
@@ -35,6 +38,7 @@ class QdrantVectorStore(BaseVectorStore):
         emb = embeddings.as_langchain() if hasattr(embeddings, "as_langchain") else embeddings
 
         self._client = QdrantClient(url=url, api_key=api_key, prefer_grpc=prefer_grpc)
+        self._collection = collection_name
         self._ensure_collection(collection_name, emb, distance)
 
 
@@ -53,10 +57,57 @@ class QdrantVectorStore(BaseVectorStore):
         self._db.add_texts(list(texts), metadatas=metadatas, ids=ids)
         return len(texts)
 
+    def add_embeddings(
+        self,
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> int:
+        # Payload в раскладке LangChain, чтобы similarity_search читал точки как обычно
+        texts = list(texts)
+        if not texts:
+            return 0
+        metas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        keys = [str(i) for i in ids] if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        points = [
+            PointStruct(
+                id=key,
+                vector=[float(x) for x in vec],
+                payload={
+                    self._db.content_payload_key: text,
+                    self._db.metadata_payload_key: dict(meta or {}),
+                },
+            )
+            for key, text, vec, meta in zip(keys, texts, embeddings, metas)
+        ]
+        self._client.upsert(collection_name=self._collection, points=points)
+        return len(texts)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        ids = [str(i) for i in ids]
+        if ids:
+            self._client.delete(collection_name=self._collection, points_selector=PointIdsList(points=ids))
+        return len(ids)
+
     def search(self, query: str, k: int = 4) -> List[str]:
         docs = self._db.similarity_search(query, k=k)
         return [d.page_content for d in docs]
 
+    def search_with_scores(self, query: str, k: int = 4) -> List[SearchHit]:
+        # relevance score LangChain нормирован в [0, 1]: 1 — совпадение
+        with span("vectorstore.search", store="qdrant", k=k):
+            pairs = self._db.similarity_search_with_relevance_scores(query, k=k)
+        return [
+            SearchHit(
+                content=d.page_content,
+                id=getattr(d, "id", None) or d.metadata.get("_id"),
+                score=float(score),
+                metadata=dict(d.metadata or {}),
+            )
+            for d, score in pairs
+        ]
+
     def raw(self):
         return self._db
 